@@ -1,26 +1,276 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
 import logging
 import os
 import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import Depends, FastAPI, HTTPException  # noqa: E402
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Request  # noqa: E402
+from fastapi.concurrency import run_in_threadpool  # noqa: E402
 from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import (  # noqa: E402
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer  # noqa: E402
 from pydantic import BaseModel, Field  # noqa: E402
 
-from gmail_client import fetch_unread_emails, get_gmail_service, mark_as_read  # noqa: E402
-from slack_notifier import send_to_slack  # noqa: E402
-from summariser import ping_ai, summarise_emails  # noqa: E402
+import metrics  # noqa: E402
+from gmail_client import AsyncGmailClient  # noqa: E402
+from jobs import open_job_queue  # noqa: E402
+from message_cache import open_message_cache  # noqa: E402
+from slack_notifier import AsyncSlackClient  # noqa: E402
+from summariser import aping_ai, astream_summary, asummarise_emails, ranking_enabled  # noqa: E402
+from summary_cache import open_summary_cache  # noqa: E402
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
 
-app = FastAPI(title="Email Summariser API")
+# Seconds shutdown waits for a daemon batch in progress
+DAEMON_STOP_TIMEOUT = 30
+
+# Summaries are reused for identical requests within SUMMARY_MEMO_TTL
+# seconds; summaries are dated, so entries should not outlive the day
+SUMMARY_MEMO_ENTRIES = 64
+SUMMARY_MEMO_TTL = 60 * 60
+
+
+def _content_hash(payload) -> str:
+    content = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class EmailSnapshots:
+    """The last /api/emails response for each `bodies` setting, with its ETag.
+
+    Fetches hold `lock`, so a request arriving while one is in progress waits and
+    reuses its result instead of fetching, and marking as read, a second time.
+    `opened` holds the IDs of emails the reader has opened in the dashboard.
+    """
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.opened: set[str] = set()
+        self._snapshots: dict[bool, tuple[str, dict]] = {}
+        self._fetches: dict[bool, int] = {}
+
+    def get(self, bodies: bool) -> tuple[str, dict] | None:
+        return self._snapshots.get(bodies)
+
+    def record_opened(self, ids: list[str]) -> None:
+        # Only emails in a snapshot, so unknown IDs can't pile up
+        known = {e["id"] for _, response in self._snapshots.values() for e in response["emails"]}
+        self.opened.update(known.intersection(ids))
+
+    def fetches(self, bodies: bool) -> int:
+        return self._fetches.get(bodies, 0)
+
+    def put(self, bodies: bool, response: dict) -> tuple[str, dict]:
+        # Weak, as cache stats in the response may differ for the same emails
+        etag = f'W/"{_content_hash(response["emails"])[:32]}"'
+        self._snapshots[bodies] = (etag, response)
+        self._fetches[bodies] = self.fetches(bodies) + 1
+        return etag, response
+
+
+class SummaryStream:
+    """One summary being streamed, which every request for the same emails follows.
+
+    `run` consumes astream_summary's events; `events` replays the deltas so far and
+    then follows the rest. When the last follower leaves before the summary is done,
+    the upstream response is cancelled, as it was before streams were shared.
+    """
+
+    def __init__(self):
+        self.deltas: list[str] = []
+        self.usage: dict | None = None
+        self.error: BaseException | None = None
+        self.finished = False
+        self.task: asyncio.Future | None = None
+        self._followers = 0
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self, events) -> str:
+        try:
+            async for event in events:
+                if event["type"] == "delta":
+                    self.deltas.append(event["text"])
+                else:
+                    self.usage = event["usage"]
+                self._notify()
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self.finished = True
+            self._notify()
+            await events.aclose()
+        return "".join(self.deltas)
+
+    async def events(self):
+        self._followers += 1
+        sent = 0
+        try:
+            while True:
+                changed = self._changed
+                while sent < len(self.deltas):
+                    yield {"type": "delta", "text": self.deltas[sent]}
+                    sent += 1
+                if self.finished:
+                    if self.error is not None:
+                        raise RuntimeError("summary stream failed") from self.error
+                    yield {"type": "done", "usage": self.usage}
+                    return
+                await changed.wait()
+        finally:
+            self._followers -= 1
+            if not self._followers and not self.finished and self.task is not None:
+                self.task.cancel()
+
+
+# (summary task, created at, the stream it was written by if any)
+_MemoEntry = tuple[asyncio.Future, float, SummaryStream | None]
+
+
+class SummaryMemo:
+    """Recent /api/summarise and /api/summarise/stream results, keyed by a hash of
+    the emails summarised.
+
+    A request identical to one still being summarised shares its work: a plain
+    request awaits the same task, a stream request follows the same SummaryStream.
+    Finished summaries are replayed to stream requests as one delta. Failed
+    summaries are not kept.
+    """
+
+    def __init__(self, max_entries: int = SUMMARY_MEMO_ENTRIES, ttl: float = SUMMARY_MEMO_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _MemoEntry] = OrderedDict()
+
+    def _lookup(self, key: str) -> _MemoEntry | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic() - self.ttl:
+            metrics.inc("cache_misses_total", cache="summarise")
+            return None
+        self._entries.move_to_end(key)
+        metrics.inc("cache_hits_total", cache="summarise")
+        return entry
+
+    def _store(self, key: str, task: asyncio.Future, stream: SummaryStream | None) -> None:
+        task.add_done_callback(lambda task: self._forget_failure(key, task))
+        self._entries[key] = (task, time.monotonic(), stream)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_create(self, key: str, create) -> str:
+        entry = self._lookup(key)
+        if entry is None:
+            task = asyncio.ensure_future(create())
+            self._store(key, task, None)
+        elif entry[2] is not None and not entry[2].finished:
+            # Followed like any stream request, so it keeps the stream alive
+            stream = entry[2]
+            async for _ in stream.events():
+                pass
+            return "".join(stream.deltas)
+        else:
+            task = entry[0]
+        # Shielded, so one client hanging up doesn't cancel the summary for the others
+        return await asyncio.shield(task)
+
+    def stream(self, key: str):
+        """Events for a summary already memoised or in progress; None if there is none."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        task, _, stream = entry
+        if stream is not None and not stream.finished:
+            return stream.events()
+        return self._replay(task)
+
+    def start_stream(self, key: str, events):
+        """Share `events` (from astream_summary) with later requests for `key`."""
+        stream = SummaryStream()
+        stream.task = asyncio.ensure_future(stream.run(events))
+        self._store(key, stream.task, stream)
+        return stream.events()
+
+    async def _replay(self, task: asyncio.Future):
+        summary = await asyncio.shield(task)
+        yield {"type": "delta", "text": summary}
+        # Usage was reported to whoever the summary was first written for
+        yield {"type": "done", "usage": None}
+
+    def _forget_failure(self, key: str, task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is None:
+            return
+        if key in self._entries and self._entries[key][0] is task:
+            del self._entries[key]
+
+
+def _start_daemon():
+    # DAEMON=1 summarises new mail in micro-batches on a background thread, woken by
+    # Gmail's Pub/Sub push notifications to /api/gmail/push (see daemon.py)
+    if os.environ.get("DAEMON") != "1":
+        return None
+    from daemon import open_daemon
+
+    daemon = open_daemon(topic=os.environ.get("GMAIL_PUBSUB_TOPIC") or None)
+    daemon.start()
+    return daemon
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created once and shared by every request, so connections are
+    # pooled and Gmail credentials are refreshed only when they expire
+    from openai import AsyncOpenAI
+
+    app.state.gmail = AsyncGmailClient()
+    # Retries are left to request_executor
+    app.state.openai = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY", ""), max_retries=0)
+    app.state.slack = AsyncSlackClient()
+    app.state.jobs = open_job_queue()
+    app.state.daemon = _start_daemon()
+    app.state.snapshots = EmailSnapshots()
+    app.state.summaries = SummaryMemo()
+    # Metrics are on for the API unless METRICS=0
+    metrics_enabled = metrics.registry.enabled
+    metrics.registry.enabled = os.environ.get("METRICS") != "0"
+    try:
+        yield
+    finally:
+        metrics.registry.enabled = metrics_enabled
+        if app.state.daemon is not None:
+            await asyncio.to_thread(app.state.daemon.stop, DAEMON_STOP_TIMEOUT)
+        if app.state.jobs is not None:
+            app.state.jobs.close()
+        app.state.gmail.close()
+        await app.state.openai.close()
+        await app.state.slack.aclose()
+
+
+app = FastAPI(title="Email Summariser API", lifespan=lifespan)
 
 API_KEY = os.environ.get("API_KEY")
+message_cache = open_message_cache()
+summary_cache = open_summary_cache()
 security = HTTPBearer(auto_error=False)
 
 
@@ -40,7 +290,8 @@ app.add_middleware(
     allow_headers=["Content-Type"],
 )
 
-MAX_EMAILS = 50
+# Large inboxes are summarised map-reduce style, see summariser.CHUNK_TOKEN_BUDGET
+MAX_EMAILS = 500
 
 
 class SummariseRequest(BaseModel):
@@ -51,42 +302,237 @@ class SlackRequest(BaseModel):
     summary: str = Field(max_length=50000)
 
 
+class OpenedRequest(BaseModel):
+    ids: list[str] = Field(max_length=MAX_EMAILS)
+
+
+class PushMessage(BaseModel):
+    data: str = Field(default="", max_length=10000)
+    messageId: str | None = None
+
+
+class PushRequest(BaseModel):
+    # Pub/Sub's push format; Gmail's notification is base64 JSON in message.data
+    message: PushMessage
+    subscription: str | None = None
+
+
+class JobRequest(BaseModel):
+    max_results: int = Field(default=20, ge=1, le=MAX_EMAILS)
+
+
 @app.get("/api/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 
+async def _mark_as_read_in_background(gmail: AsyncGmailClient, emails: list[dict]) -> None:
+    try:
+        failures = await gmail.mark_as_read(emails)
+    except Exception:
+        logger.exception("Failed to mark emails as read")
+        return
+    if failures:
+        logger.error("Could not mark %d thread(s) as read: %s", len(failures), failures)
+
+
+@app.get("/api/metrics", dependencies=[Depends(verify_api_key)])
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def _learn_from_opens(emails: list[dict], opened: set[str]) -> None:
+    # Runs after the response has been sent
+    try:
+        from ranking import get_ranker
+
+        ranker = get_ranker()
+        ranker.learn(emails, opened)
+        ranker.save()
+    except Exception:
+        logger.exception("Failed to update the email ranking")
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+async def _fetch_emails(
+    request: Request, background_tasks: BackgroundTasks, bodies: bool, defer_mark_read: bool
+) -> dict:
+    gmail = request.app.state.gmail
+    # bodies=false returns headers only; /api/summarise fetches the bodies it needs
+    emails = await gmail.fetch_unread_emails(cache=message_cache, lazy_bodies=not bodies)
+    response = {"emails": emails, "count": len(emails)}
+    if emails and defer_mark_read:
+        # Labels are updated after the response has been sent
+        background_tasks.add_task(_mark_as_read_in_background, gmail, emails)
+    elif emails:
+        failures = await gmail.mark_as_read(emails)
+        if failures:
+            response["mark_read_failures"] = sorted(failures)
+    if message_cache is not None:
+        response["cache"] = message_cache.stats()
+    return response
+
+
 @app.get("/api/emails", dependencies=[Depends(verify_api_key)])
-def get_emails():
+async def get_emails(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    bodies: bool = True,
+    defer_mark_read: bool = False,
+    refresh: bool = False,
+    if_none_match: str | None = Header(default=None),  # noqa: B008
+):
+    # The last fetch is served from memory until ?refresh=true; fetched emails are
+    # marked as read, so fetching again would not return them
+    snapshots = request.app.state.snapshots
+    fetches = snapshots.fetches(bodies)
+    async with snapshots.lock:
+        snapshot = snapshots.get(bodies)
+        # A refresh that waited for another fetch to finish uses its result
+        if snapshot is None or (refresh and snapshots.fetches(bodies) == fetches):
+            metrics.inc("cache_misses_total", cache="emails")
+            try:
+                response = await _fetch_emails(request, background_tasks, bodies, defer_mark_read)
+            except Exception as e:
+                logger.exception("Failed to fetch emails")
+                raise HTTPException(status_code=500, detail="Failed to fetch emails") from e
+            if snapshot is not None and ranking_enabled():
+                # The replaced emails have had their chance to be opened
+                emails = snapshot[1]["emails"]
+                opened = snapshots.opened & {e["id"] for e in emails}
+                snapshots.opened -= opened
+                background_tasks.add_task(_learn_from_opens, emails, opened)
+            snapshot = snapshots.put(bodies, response)
+        else:
+            metrics.inc("cache_hits_total", cache="emails")
+    etag, response = snapshot
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(response, headers=headers)
+
+
+@app.post("/api/emails/opened", dependencies=[Depends(verify_api_key)])
+async def emails_opened(req: OpenedRequest, request: Request):
+    # The ranking learns from these when the snapshot is next refreshed
+    request.app.state.snapshots.record_opened(req.ids)
+    return {"status": "recorded"}
+
+
+async def verify_push(
+    token: str | None = None,
+    credentials: HTTPAuthorizationCredentials | None = Depends(security),  # noqa: B008
+):
+    # Pub/Sub push can't send the API key, so it may pass PUBSUB_VERIFICATION_TOKEN
+    # as ?token= in the subscription's endpoint URL instead
+    expected = os.environ.get("PUBSUB_VERIFICATION_TOKEN")
+    if expected and token and hmac.compare_digest(token, expected):
+        return
+    await verify_api_key(credentials)
+
+
+@app.post("/api/gmail/push", dependencies=[Depends(verify_push)])
+async def gmail_push(req: PushRequest, request: Request):
+    daemon = request.app.state.daemon
+    if daemon is None:
+        raise HTTPException(status_code=503, detail="Daemon mode is not enabled")
     try:
-        service = get_gmail_service()
-        emails = fetch_unread_emails(service)
-        if emails:
-            mark_as_read(service, emails)
-        return {"emails": emails, "count": len(emails)}
-    except Exception as e:
-        logger.exception("Failed to fetch emails")
-        raise HTTPException(status_code=500, detail="Failed to fetch emails") from e
+        notification = json.loads(base64.b64decode(req.message.data) or b"{}")
+        history_id = str(notification.get("historyId", ""))
+    except (binascii.Error, ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid notification") from e
+    # Listing and summarising happen on the daemon's thread; Pub/Sub only needs a 2xx
+    daemon.notify(history_id if history_id.isdigit() else None)
+    return {"status": "accepted"}
+
+
+async def _with_bodies(request: Request, emails: list[dict]) -> list[dict]:
+    if any("body" not in e for e in emails):
+        return await request.app.state.gmail.load_bodies(emails)
+    return emails
+
+
+async def _summarise(request: Request, emails: list[dict]) -> str:
+    emails = await _with_bodies(request, emails)
+    return await asummarise_emails(emails, request.app.state.openai, cache=summary_cache)
 
 
 @app.post("/api/summarise", dependencies=[Depends(verify_api_key)])
-def summarise(req: SummariseRequest):
+async def summarise(req: SummariseRequest, request: Request):
     if not req.emails:
         raise HTTPException(status_code=400, detail="No emails provided")
     try:
-        summary = summarise_emails(req.emails)
+        summary = await request.app.state.summaries.get_or_create(
+            _content_hash(req.emails), lambda: _summarise(request, req.emails)
+        )
         return {"summary": summary}
     except Exception as e:
         logger.exception("Failed to summarise emails")
         raise HTTPException(status_code=500, detail="Failed to summarise emails") from e
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _astream_summary(request: Request, emails: list[dict]):
+    emails = await _with_bodies(request, emails)
+    events = astream_summary(emails, request.app.state.openai, cache=summary_cache)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def _stream_events(request: Request, events):
+    try:
+        async for event in events:
+            if await request.is_disconnected():
+                return
+            if event["type"] == "delta":
+                yield _sse("delta", {"text": event["text"]})
+            else:
+                yield _sse("done", {"usage": event["usage"]})
+    except Exception:
+        logger.exception("Failed to stream summary")
+        yield _sse("error", {"detail": "Failed to summarise emails"})
+    finally:
+        # Closes the upstream OpenAI response if the client went away mid-stream
+        await events.aclose()
+
+
+@app.post("/api/summarise/stream", dependencies=[Depends(verify_api_key)])
+async def summarise_stream(req: SummariseRequest, request: Request):
+    if not req.emails:
+        raise HTTPException(status_code=400, detail="No emails provided")
+    key = _content_hash(req.emails)
+    events = request.app.state.summaries.stream(key)
+    if events is None:
+        # Registered before the bodies are loaded, so a request arriving meanwhile
+        # follows this stream instead of starting another
+        events = request.app.state.summaries.start_stream(
+            key, _astream_summary(request, req.emails)
+        )
+    return StreamingResponse(
+        _stream_events(request, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/send-slack", dependencies=[Depends(verify_api_key)])
-def slack(req: SlackRequest):
+async def slack(req: SlackRequest, request: Request):
     if not req.summary:
         raise HTTPException(status_code=400, detail="No summary provided")
     try:
-        send_to_slack(req.summary)
+        await request.app.state.slack.send(req.summary)
         return {"status": "sent"}
     except Exception as e:
         logger.exception("Failed to send to Slack")
@@ -94,9 +540,9 @@ def slack(req: SlackRequest):
 
 
 @app.post("/api/ping-ai", dependencies=[Depends(verify_api_key)])
-def ping_ai_endpoint():
+async def ping_ai_endpoint(request: Request):
     try:
-        response = ping_ai()
+        response = await aping_ai(request.app.state.openai)
         return {"response": response}
     except Exception as e:
         logger.exception("Failed to ping AI")
@@ -104,10 +550,48 @@ def ping_ai_endpoint():
 
 
 @app.post("/api/ping-slack", dependencies=[Depends(verify_api_key)])
-def ping_slack():
+async def ping_slack(request: Request):
     try:
-        send_to_slack("hello")
+        await request.app.state.slack.send("hello")
         return {"status": "sent"}
     except Exception as e:
         logger.exception("Failed to ping Slack")
         raise HTTPException(status_code=500, detail="Failed to ping Slack") from e
+
+
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+def _job_queue(request: Request):
+    queue = request.app.state.jobs
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not configured")
+    return queue
+
+
+@app.post("/api/jobs", status_code=202, dependencies=[Depends(verify_api_key)])
+async def enqueue_job(
+    req: JobRequest,
+    request: Request,
+    idempotency_key: str | None = Header(default=None, max_length=200),  # noqa: B008
+):
+    # Retrying the POST with the same Idempotency-Key returns the original job
+    queue = _job_queue(request)
+    job = await run_in_threadpool(queue.enqueue, req.model_dump(), idempotency_key)
+    return _job_status(job)
+
+
+@app.get("/api/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def job_status(job_id: str, request: Request):
+    job = await run_in_threadpool(_job_queue(request).get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
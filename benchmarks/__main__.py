@@ -0,0 +1,53 @@
+"""Run every benchmark and write one JSON report, tagged with the current commit.
+
+Run from the repo root: python -m benchmarks [results.json]
+Each benchmark runs in its own process, so one's fake servers and cached
+clients can't leak into the next.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = ("bench_mime", "bench_pipeline", "bench_api", "bench_startup", "bench_openai")
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in BENCHMARKS:
+            path = os.path.join(tmp, f"{name}.json")
+            print(f"== {name}", file=sys.stderr)
+            # Progress lines go to stderr so stdout stays valid JSON
+            subprocess.run(
+                [sys.executable, "-m", f"benchmarks.{name}", path], check=True, stdout=sys.stderr
+            )
+            with open(path) as f:
+                report["results"][name] = json.load(f)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Request throughput of api.py under concurrent load, served by uvicorn.
+
+The API's Gmail, OpenAI and Slack calls go to the fake servers. Plain requests are
+served from the API's email snapshot and summary memo; the `_refresh` and
+`_uncached` endpoints measure the round trips behind them.
+Run from the repo root: python -m benchmarks.bench_api [results.json]
+"""
+
+import asyncio
+import itertools
+import json
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from benchmarks.fakes import Backends
+from benchmarks.mailbox import generate_mailbox
+from benchmarks.stats import describe
+
+CONCURRENCY = (1, 8, 32)
+REQUESTS = 64
+MAILBOX_SIZE = 20
+# Per-request latency of each fake, in seconds
+LATENCY = {"gmail": 0.05, "openai": 0.5, "slack": 0.05}
+
+
+class _Server:
+    """api.app on uvicorn in a background thread, bound to a free local port."""
+
+    def __init__(self):
+        import api
+
+        self._sock = socket.socket()
+        self._sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self._sock.getsockname()[1]}"
+        self._server = uvicorn.Server(uvicorn.Config(api.app, log_level="warning"))
+        self._thread = threading.Thread(
+            target=self._server.run, kwargs={"sockets": [self._sock]}, daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+        self._sock.close()
+
+
+async def _load(url: str, make_request, concurrency: int, total: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def _worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await make_request(client)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(_worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "errors": errors,
+        "requests_per_second": total / elapsed,
+        "seconds": describe(latencies),
+    }
+
+
+def run(
+    concurrency=CONCURRENCY,
+    requests: int = REQUESTS,
+    mailbox_size: int = MAILBOX_SIZE,
+    latency: dict | None = None,
+) -> dict:
+    latency = latency or LATENCY
+    backends = Backends(
+        generate_mailbox(mailbox_size),
+        gmail_latency=latency["gmail"],
+        openai_latency=latency["openai"],
+        slack_latency=latency["slack"],
+    )
+    backends.install()
+    endpoints = {
+        "emails": lambda client: client.get("/api/emails"),
+        "emails_refresh": lambda client: client.get("/api/emails", params={"refresh": "true"}),
+        "emails_headers_only_refresh": lambda client: client.get(
+            "/api/emails",
+            params={"bodies": "false", "defer_mark_read": "true", "refresh": "true"},
+        ),
+    }
+    results = {"latency": latency, "mailbox_size": mailbox_size, "endpoints": {}}
+    try:
+        with _Server() as server:
+            emails = httpx.get(f"{server.url}/api/emails", timeout=120).json()["emails"]
+            endpoints["summarise"] = lambda client: client.post(
+                "/api/summarise", json={"emails": emails}
+            )
+            # A different subject each time, so no request hits the summary memo
+            subjects = itertools.count()
+            endpoints["summarise_uncached"] = lambda client: client.post(
+                "/api/summarise",
+                json={"emails": [{**emails[0], "subject": f"Run {next(subjects)}"}, *emails[1:]]},
+            )
+            for name, make_request in endpoints.items():
+                results["endpoints"][name] = {
+                    str(level): asyncio.run(_load(server.url, make_request, level, requests))
+                    for level in concurrency
+                }
+    finally:
+        backends.close()
+    return results
+
+
+def main() -> None:
+    results = run()
+    for name, levels in results["endpoints"].items():
+        for level, result in levels.items():
+            print(
+                f"{name:>20} x{level:>3}: {result['requests_per_second']:7.1f} req/s  "
+                f"p50 {result['seconds']['median'] * 1000:7.1f}ms  "
+                f"p95 {result['seconds']['p95'] * 1000:7.1f}ms  errors {result['errors']}"
+            )
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
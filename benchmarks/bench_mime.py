@@ -0,0 +1,129 @@
+"""Compare the streaming body extractor with the previous full-parse implementation,
+and measure message parsing throughput over a synthetic mailbox.
+
+Run from the repo root: python -m benchmarks.bench_mime
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from email import message_from_bytes
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP
+
+from benchmarks.mailbox import generate_mailbox
+from gmail_client import BODY_CHAR_LIMIT, _extract_body, _parse_raw_message
+
+
+def _legacy_extract_body(raw: bytes) -> str:
+    # The implementation _extract_body replaced: full Message tree, full decode
+    mime_msg = message_from_bytes(raw)
+    body = ""
+    if mime_msg.is_multipart():
+        for part in mime_msg.walk():
+            if part.get_content_type() == "text/plain":
+                payload = part.get_payload(decode=True)
+                if isinstance(payload, bytes):
+                    charset = part.get_content_charset() or "utf-8"
+                    body = payload.decode(charset, errors="replace")
+                    break
+    else:
+        payload = mime_msg.get_payload(decode=True)
+        if isinstance(payload, bytes):
+            charset = mime_msg.get_content_charset() or "utf-8"
+            body = payload.decode(charset, errors="replace")
+    if len(body) > BODY_CHAR_LIMIT:
+        body = body[:BODY_CHAR_LIMIT] + "..."
+    return body
+
+
+def _newsletter(text_chars: int) -> bytes:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = "Newsletter"
+    msg.attach(MIMEText("Weekly digest. " * (text_chars // 15), "plain", "utf-8"))
+    msg.attach(MIMEText("<p>Weekly digest.</p>" * (text_chars // 20), "html", "utf-8"))
+    return msg.as_bytes(policy=SMTP)
+
+
+def _with_attachment(attachment_bytes: int) -> bytes:
+    msg = MIMEMultipart("mixed")
+    msg["Subject"] = "Report attached"
+    msg.attach(MIMEText("Please see the attached report.", "plain", "utf-8"))
+    msg.attach(MIMEApplication(b"\x89PNG" * (attachment_bytes // 4), Name="report.png"))
+    return msg.as_bytes(policy=SMTP)
+
+
+CASES = {
+    "plain_1kb": MIMEText("Hello there. " * 80, "plain", "utf-8").as_bytes(policy=SMTP),
+    "newsletter_500kb": _newsletter(250_000),
+    "attachment_5mb": _with_attachment(5 * 1024 * 1024),
+}
+
+
+def _measure(func, raw: bytes, repeat: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(raw)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    func(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": elapsed, "peak_bytes": peak}
+
+
+def run(repeat: int = 5) -> dict:
+    results = {}
+    for name, raw in CASES.items():
+        assert _extract_body(raw) == _legacy_extract_body(raw)
+        results[name] = {
+            "size_bytes": len(raw),
+            "legacy": _measure(_legacy_extract_body, raw, repeat),
+            "streaming": _measure(_extract_body, raw, repeat),
+        }
+    return results
+
+
+def throughput(count: int = 500, repeat: int = 3, **mailbox_options) -> dict:
+    """Messages and raw bytes parsed per second by _parse_raw_message."""
+    mailbox = generate_mailbox(count, **mailbox_options)
+    size = sum(message["sizeEstimate"] for message in mailbox)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in mailbox:
+            _parse_raw_message(message["id"], message)
+    elapsed = (time.perf_counter() - start) / repeat
+    return {
+        "messages": count,
+        "size_bytes": size,
+        "seconds": elapsed,
+        "messages_per_second": count / elapsed,
+        "mib_per_second": size / elapsed / 1024 / 1024,
+    }
+
+
+def main() -> None:
+    results = run()
+    for name, result in results.items():
+        legacy, streaming = result["legacy"], result["streaming"]
+        print(
+            f"{name:>18}: "
+            f"{legacy['seconds'] * 1000:8.2f}ms -> {streaming['seconds'] * 1000:7.2f}ms  "
+            f"peak {legacy['peak_bytes'] // 1024:>7}KiB -> {streaming['peak_bytes'] // 1024:>5}KiB"
+        )
+    results["mailbox"] = mailbox = throughput()
+    print(
+        f"{'mailbox':>18}: {mailbox['messages_per_second']:8.0f} messages/s  "
+        f"{mailbox['mib_per_second']:7.1f}MiB/s"
+    )
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Tail latency of OpenAI calls through request_executor, with and without hedging.
+
+A fake Chat Completions server answers most requests quickly and a few very
+slowly, as the real API's stragglers do. The same calls are made with hedging
+off, at a fixed delay and at the adaptive p95 delay; the report gives each
+mode's latencies and how many requests the server received for them.
+Run from the repo root: python -m benchmarks.bench_openai [results.json]
+"""
+
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeOpenAI
+from benchmarks.stats import describe
+
+CALLS = 400
+CONCURRENCY = 8
+# Seconds: FAST for most requests, SLOW for one in SLOW_EVERY
+FAST = 0.05
+SLOW = 1.5
+SLOW_EVERY = 50
+HEDGE_DELAY = 0.2
+MODES = {
+    "off": {"hedge_percentile": None},
+    "fixed": {"hedge_delay": HEDGE_DELAY},
+    # The default floor of a second would hide the fake's fast answers
+    "p95": {"hedge_min_delay": FAST},
+}
+
+
+def _latency(rng: random.Random):
+    return lambda: SLOW if rng.random() < 1 / SLOW_EVERY else FAST * (0.5 + rng.random())
+
+
+def run_mode(options: dict, calls: int = CALLS, seed: int = 0) -> dict:
+    from openai import OpenAI
+
+    from request_executor import RequestExecutor
+
+    fake = FakeOpenAI(latency=_latency(random.Random(seed)))
+    try:
+        client = OpenAI(api_key="fake-key", base_url=fake.url, max_retries=0)
+        executor = RequestExecutor(fallback_model=None, **options)
+        messages = [{"role": "user", "content": "Say hello in one sentence."}]
+
+        def _call(_) -> float:
+            start = time.perf_counter()
+            executor.complete(client, "bench", model="gpt-4.1-mini", messages=messages)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            latencies = list(pool.map(_call, range(calls)))
+    finally:
+        fake.close()
+    return {"latency": describe(latencies), "requests": fake.requests, "calls": calls}
+
+
+def run(modes=MODES) -> dict:
+    return {mode: run_mode(options) for mode, options in modes.items()}
+
+
+def main() -> None:
+    results = run()
+    for mode, result in results.items():
+        latency = result["latency"]
+        print(
+            f"hedging {mode:>5}: p50 {latency['median'] * 1000:7.1f}ms  "
+            f"p99 {latency['p99'] * 1000:7.1f}ms  "
+            f"{result['requests'] / result['calls']:.2f} requests per call"
+        )
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
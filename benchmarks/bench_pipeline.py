@@ -0,0 +1,107 @@
+"""End-to-end latency of main.main against the fake Gmail, OpenAI and Slack servers.
+
+Also runs one backlog-mode catch-up (GMAIL_BACKLOG=1) and records its peak
+Python heap, which should stay flat however large the backlog is.
+
+Run from the repo root: python -m benchmarks.bench_pipeline [results.json]
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fakes import Backends
+from benchmarks.mailbox import generate_mailbox
+from benchmarks.stats import describe
+
+SIZES = (10, 50, 500)
+BACKLOG_SIZE = 2000
+# Per-request latency of each fake, in seconds
+LATENCY = {"gmail": 0.05, "openai": 0.5, "slack": 0.05}
+
+
+def _backlog(backends: Backends, size: int) -> dict:
+    import main
+    import metrics
+
+    backends.gmail.mailbox = generate_mailbox(size)
+    os.environ.update({"GMAIL_BACKLOG": "1", "GMAIL_BACKLOG_MAX_EMAILS": str(size)})
+    metrics.registry.reset()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.main()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        os.environ["GMAIL_BACKLOG"] = ""
+    return {"emails": size, "seconds": seconds, "peak_bytes": peak, **metrics.registry.report()}
+
+
+def run(
+    sizes=SIZES, repeat: int = 3, latency: dict | None = None, backlog: int = BACKLOG_SIZE
+) -> dict:
+    latency = latency or LATENCY
+    backends = Backends(
+        gmail_latency=latency["gmail"],
+        openai_latency=latency["openai"],
+        slack_latency=latency["slack"],
+    )
+    backends.install()
+    # Imported once the environment points at the fakes; main loads .env on import
+    import main
+    import metrics
+
+    metrics.registry.enabled = True
+    results = {"latency": latency, "sizes": {}}
+    try:
+        for size in sizes:
+            backends.gmail.mailbox = generate_mailbox(size)
+            os.environ["GMAIL_MAX_RESULTS"] = str(size)
+            samples = []
+            for _ in range(repeat):
+                metrics.registry.reset()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main.main()
+                samples.append(time.perf_counter() - start)
+            results["sizes"][str(size)] = {
+                "seconds": describe(samples),
+                # Stage timers and counters from the last run
+                **metrics.registry.report(),
+            }
+        if backlog:
+            results["backlog"] = _backlog(backends, backlog)
+    finally:
+        metrics.registry.enabled = False
+        backends.close()
+    return results
+
+
+def main() -> None:
+    results = run()
+    for size, result in results["sizes"].items():
+        seconds = result["seconds"]
+        print(
+            f"{size:>4} emails: median {seconds['median'] * 1000:8.1f}ms  "
+            f"min {seconds['min'] * 1000:8.1f}ms  max {seconds['max'] * 1000:8.1f}ms"
+        )
+    backlog = results.get("backlog")
+    if backlog:
+        print(
+            f"backlog of {backlog['emails']} emails: {backlog['seconds']:.1f}s, "
+            f"peak heap {backlog['peak_bytes'] / 2**20:.1f} MiB"
+        )
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Cold-start cost of main.py and api.py, from `python -X importtime`.
+
+Each sample imports the module in a fresh interpreter. The report gives the
+module's total import time, the wall time of the whole process, and the imports
+that took longest.
+Run from the repo root: python -m benchmarks.bench_startup [results.json]
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.stats import describe
+
+MODULES = ("main", "api")
+REPEAT = 5
+SLOWEST = 10
+
+
+def import_profile(module: str) -> dict:
+    """Import `module` in a new interpreter under -X importtime.
+
+    Returns its total import time and process wall time in seconds, every module
+    it imported mapped to its cumulative import time, and the modules it imported.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, {module}; print('\\n'.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+    # Lines read "import time: <self us> | <cumulative us> | <indented name>", with
+    # children before their parent, so the target's imports are the lines since the
+    # last unindented one (the interpreter's own startup imports come first)
+    imports: dict[str, float] = {}
+    total = None
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        seconds = int(cumulative) / 1e6
+        if name[1:].startswith(" "):
+            imports[name.strip()] = seconds
+        elif name.strip() == module:
+            total = seconds
+            break
+        else:
+            imports = {}
+    if total is None:
+        raise RuntimeError(f"no import time reported for {module}")
+    return {
+        "seconds": total,
+        "wall_seconds": wall,
+        "imports": imports,
+        "modules": set(process.stdout.split()),
+    }
+
+
+def run(modules=MODULES, repeat: int = REPEAT) -> dict:
+    results = {}
+    for module in modules:
+        profiles = [import_profile(module) for _ in range(repeat)]
+        last = profiles[-1]["imports"]
+        slowest = sorted((s, n) for n, s in last.items() if n != module)[-SLOWEST:]
+        results[module] = {
+            "import_seconds": describe([p["seconds"] for p in profiles]),
+            "wall_seconds": describe([p["wall_seconds"] for p in profiles]),
+            # Cumulative, so a package and the submodules it imports are both listed
+            "slowest": [{"module": n, "seconds": s} for s, n in reversed(slowest)],
+        }
+    return results
+
+
+def main() -> None:
+    results = run()
+    for module, result in results.items():
+        imports, wall = result["import_seconds"], result["wall_seconds"]
+        print(
+            f"{module:>5}: import median {imports['median'] * 1000:7.1f}ms  "
+            f"process median {wall['median'] * 1000:7.1f}ms"
+        )
+        for entry in result["slowest"]:
+            print(f"{'':>7}{entry['seconds'] * 1000:7.1f}ms  {entry['module']}")
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Local stand-ins for the Gmail, OpenAI and Slack APIs.
+
+Each server runs on its own thread, answers enough of the real API for the
+pipeline to run end to end, and sleeps `latency` seconds before every HTTP
+response (once per batch call, as the real batch endpoint does). `latency` may
+also be a function returning a number of seconds, drawn anew for each request.
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from email import message_from_bytes
+from email.message import Message
+from email.parser import BytesParser
+from email.policy import compat32
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeServer:
+    """Threaded HTTP server calling `self.handle(method, path, query, body)`.
+
+    `handle` returns (status, headers, body bytes). Subclasses set `prefix`, the
+    path clients should use as their base URL.
+    """
+
+    prefix = ""
+
+    def __init__(self, latency: float | Callable[[], float] = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so clients reuse connections as they would against the real APIs
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                with fake._lock:
+                    fake.requests += 1
+                latency = fake.latency() if callable(fake.latency) else fake.latency
+                if latency:
+                    time.sleep(latency)
+                url = urlsplit(self.path)
+                status, headers, data = fake.handle(
+                    self.command, url.path, parse_qs(url.query), body, self.headers
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, as a cancelled hedge does
+                    pass
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}{self.prefix}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def handle(self, method, path, query, body, headers) -> tuple[int, dict, bytes]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _json(status: int, payload) -> tuple[int, dict, bytes]:
+    if payload is None:
+        return status, {}, b""
+    return status, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+
+def _part_payload(part: Message, include_bodies: bool) -> dict:
+    payload = {
+        "mimeType": part.get_content_type(),
+        "headers": [{"name": name, "value": str(value)} for name, value in part.items()],
+    }
+    if part.is_multipart():
+        payload["parts"] = [_part_payload(p, include_bodies) for p in part.get_payload()]
+        return payload
+    data = part.get_payload(decode=True) or b""
+    payload["body"] = {"size": len(data)}
+    if part.get_filename():
+        # Like Gmail, attachments are left out of the payload
+        payload["body"]["attachmentId"] = f"att-{part.get_filename()}"
+    elif include_bodies:
+        payload["body"]["data"] = base64.urlsafe_b64encode(data).decode("ascii")
+    return payload
+
+
+class FakeGmail(FakeServer):
+    """Gmail API with a fixed mailbox; labels are never changed, so every run sees it unread.
+
+    Serves messages.list, messages.get (raw, metadata and full), messages.batchModify,
+    threads.modify, users.getProfile, the batch endpoint and an OAuth token endpoint.
+    """
+
+    def __init__(self, mailbox: list[dict] | None = None, latency: float = 0.0):
+        self.mailbox = mailbox or []
+        super().__init__(latency)
+
+    @property
+    def mailbox(self) -> list[dict]:
+        return self._mailbox
+
+    @mailbox.setter
+    def mailbox(self, messages: list[dict]) -> None:
+        self._mailbox = messages
+        self._by_id = {message["id"]: message for message in messages}
+
+    def handle(self, method, path, query, body, headers):
+        if path == "/token":
+            return _json(200, {"access_token": "fake-token", "expires_in": 3600})
+        if path in ("/batch", "/batch/gmail/v1"):
+            return self._batch(body, headers["Content-Type"])
+        return _json(*self._route(method, path, query, body))
+
+    def _route(self, method, path, query, body: bytes = b"") -> tuple[int, dict]:
+        user = "/gmail/v1/users/me"
+        if path == f"{user}/messages":
+            limit = min(int(query.get("maxResults", ["100"])[0]), 500)
+            start = int(query.get("pageToken", ["0"])[0])
+            page = self._mailbox[start : start + limit]
+            listing = {
+                "messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page],
+                "resultSizeEstimate": len(self._mailbox),
+            }
+            if start + limit < len(self._mailbox):
+                listing["nextPageToken"] = str(start + limit)
+            return 200, listing
+        if path == f"{user}/profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": "1"}
+        if path == f"{user}/messages/batchModify":
+            # As Gmail does, refuse more than 1000 IDs in one call
+            if len(json.loads(body or b"{}").get("ids", [])) > 1000:
+                return 400, {"error": {"code": 400, "message": "Too many ids"}}
+            return 204, None
+        match = re.fullmatch(rf"{user}/threads/([^/]+)/modify", path)
+        if match:
+            return 200, {"id": match.group(1)}
+        match = re.fullmatch(rf"{user}/messages/([^/]+)", path)
+        if match and match.group(1) in self._by_id:
+            return 200, self._message(self._by_id[match.group(1)], query)
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+    def _message(self, message: dict, query: dict) -> dict:
+        format = query.get("format", ["full"])[0]
+        if format == "raw":
+            return message
+        parsed = message_from_bytes(base64.urlsafe_b64decode(message["raw"]))
+        payload = _part_payload(parsed, include_bodies=format == "full")
+        if format == "metadata":
+            wanted = {name.lower() for name in query.get("metadataHeaders", [])}
+            payload = {
+                "mimeType": payload["mimeType"],
+                "headers": [h for h in payload["headers"] if h["name"].lower() in wanted],
+            }
+        fields = {k: v for k, v in message.items() if k != "raw"}
+        return {**fields, "payload": payload}
+
+    def _batch(self, body: bytes, content_type: str) -> tuple[int, dict, bytes]:
+        request = BytesParser(policy=compat32).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = "batch_fake_boundary"
+        out = []
+        for part in request.get_payload():
+            lines = part.get_payload().split("\n", 1)[0].split(" ")
+            url = urlsplit(lines[1])
+            status, payload = self._route(lines[0], url.path, parse_qs(url.query))
+            content_id = part["Content-ID"]
+            out.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        data = ("".join(out) + f"--{boundary}--\r\n").encode()
+        return 200, {"Content-Type": f"multipart/mixed; boundary={boundary}"}, data
+
+
+class FakeOpenAI(FakeServer):
+    """Chat Completions endpoint returning a canned briefing.
+
+    JSON-mode requests (the per-email digests) get one digest for every
+    "--- Email N ---" block in the prompt. `fail`, if set, is called with each
+    request and may return an HTTP status to answer with instead, such as 503.
+    Requests are counted per model in `models`.
+    """
+
+    prefix = "/v1"
+
+    def __init__(
+        self,
+        latency: float | Callable[[], float] = 0.0,
+        reply: str = "Nothing urgent today.",
+        fail: Callable[[dict], int | None] | None = None,
+    ):
+        self.reply = reply
+        self.fail = fail
+        self.models: Counter[str] = Counter()
+        super().__init__(latency)
+
+    def handle(self, method, path, query, body, headers):
+        if path != "/v1/chat/completions":
+            return _json(404, {"error": {"message": "Not Found"}})
+        request = json.loads(body)
+        with self._lock:
+            self.models[request["model"]] += 1
+        status = self.fail(request) if self.fail else None
+        if status:
+            return _json(status, {"error": {"message": "Injected failure", "code": status}})
+        prompt = "".join(m["content"] for m in request["messages"])
+        if request.get("response_format", {}).get("type") == "json_object":
+            numbers = re.findall(r"^--- Email (\d+) ---$", prompt, re.MULTILINE)
+            content = json.dumps(
+                {"digests": [{"email": int(n), "digest": self.reply} for n in numbers]}
+            )
+        else:
+            content = self.reply
+        # Roughly four characters per token, which is all the summariser's accounting needs
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return _json(
+            200,
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            },
+        )
+
+
+class FakeSlack(FakeServer):
+    """Slack Web API answering auth.test and chat.postMessage; counts posted messages."""
+
+    prefix = "/api"
+
+    def __init__(self, latency: float = 0.0):
+        self.messages = 0
+        super().__init__(latency)
+
+    def handle(self, method, path, query, body, headers):
+        if path == "/api/auth.test":
+            return _json(200, {"ok": True, "user_id": "U0FAKE"})
+        if path == "/api/chat.postMessage":
+            with self._lock:
+                self.messages += 1
+            return _json(200, {"ok": True, "ts": f"{time.time():.6f}"})
+        return _json(200, {"ok": False, "error": "unknown_method"})
+
+
+class Backends:
+    """All three fakes, plus the environment that points the app at them."""
+
+    def __init__(
+        self,
+        mailbox: list[dict] | None = None,
+        gmail_latency: float = 0.0,
+        openai_latency: float = 0.0,
+        slack_latency: float = 0.0,
+    ):
+        self.gmail = FakeGmail(mailbox, gmail_latency)
+        self.openai = FakeOpenAI(openai_latency)
+        self.slack = FakeSlack(slack_latency)
+
+    def environ(self) -> dict[str, str]:
+        return {
+            "GMAIL_API_URL": self.gmail.url,
+            "GOOGLE_TOKEN_URI": f"{self.gmail.url}/token",
+            "GOOGLE_CLIENT_ID": "fake-client",
+            "GOOGLE_CLIENT_SECRET": "fake-secret",
+            "GOOGLE_REFRESH_TOKEN": "fake-refresh",
+            "OPENAI_BASE_URL": self.openai.url,
+            "OPENAI_API_KEY": "fake-key",
+            "SLACK_API_URL": self.slack.url,
+            "SLACK_TOKEN": "xoxc-fake",
+            "SLACK_COOKIE": "fake-cookie",
+            # Set empty so a developer's .env can't switch on caches or sync state
+            "GMAIL_SYNC_STATE": "",
+            "GMAIL_MESSAGE_CACHE": "",
+            "GMAIL_TOKEN_CACHE": "",
+            "GMAIL_FETCH_MODE": "",
+            "GMAIL_BACKLOG": "",
+            "SUMMARY_CACHE": "",
+            "TIMING_REPORT": "",
+            "JOB_QUEUE": "",
+            "API_KEY": "",
+        }
+
+    def install(self) -> None:
+        os.environ.update(self.environ())
+
+    def close(self) -> None:
+        for server in (self.gmail, self.openai, self.slack):
+            server.close()
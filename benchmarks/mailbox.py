@@ -0,0 +1,95 @@
+"""Synthetic mailboxes for the benchmarks, built like the tests' _make_raw_email helpers."""
+
+import base64
+import random
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP
+
+CHARSETS = ("utf-8", "iso-8859-1", "shift_jis")
+
+# Text each charset can encode, so bodies round-trip without replacement characters
+_WORDS = {
+    "utf-8": "meeting invoice café résumé deadline ✓ update".split(),
+    "iso-8859-1": "meeting invoice café résumé deadline update".split(),
+    "shift_jis": "meeting invoice 会議 請求書 deadline update".split(),
+}
+_SENDERS = ["alice@example.com", "Bob <bob@example.com>", "news@example.org", "ci@example.net"]
+
+
+def _text(rng: random.Random, charset: str, chars: int) -> str:
+    words = _WORDS[charset]
+    out, length = [], 0
+    while length < chars:
+        word = rng.choice(words)
+        out.append(word)
+        length += len(word) + 1
+    return " ".join(out)
+
+
+def make_raw_email(
+    rng: random.Random,
+    index: int,
+    body_chars: int = 2000,
+    multipart: bool = False,
+    attachment_bytes: int = 0,
+    charset: str = "utf-8",
+) -> bytes:
+    body = _text(rng, charset, body_chars)
+    if multipart:
+        msg = MIMEMultipart("alternative")
+        msg.attach(MIMEText(body, "plain", charset))
+        msg.attach(MIMEText(f"<html><body><p>{body}</p></body></html>", "html", charset))
+    else:
+        msg = MIMEText(body, "plain", charset)
+    if attachment_bytes:
+        mixed = MIMEMultipart("mixed")
+        mixed.attach(msg)
+        mixed.attach(MIMEApplication(rng.randbytes(attachment_bytes), Name=f"file{index}.bin"))
+        msg = mixed
+    # RFC 2047-encoded, as non-ASCII subjects arrive from Gmail
+    msg["Subject"] = Header(f"Message {index}: {_text(rng, 'utf-8', 30)}", "utf-8").encode()
+    msg["From"] = rng.choice(_SENDERS)
+    msg["Date"] = "Mon, 1 Jan 2025 09:00:00 +0000"
+    return msg.as_bytes(policy=SMTP)
+
+
+def generate_mailbox(
+    count: int,
+    multipart_ratio: float = 0.5,
+    attachment_ratio: float = 0.1,
+    attachment_bytes: int = 256 * 1024,
+    body_chars: int = 2000,
+    charsets: tuple[str, ...] = CHARSETS,
+    seed: int = 0,
+) -> list[dict]:
+    """Return `count` Gmail messages in `format="raw"` shape.
+
+    `multipart_ratio` of them carry an HTML alternative, `attachment_ratio` carry a
+    binary attachment of `attachment_bytes`, and charsets cycle through `charsets`.
+    The same seed always produces the same mailbox.
+    """
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        raw = make_raw_email(
+            rng,
+            i,
+            body_chars=body_chars,
+            multipart=rng.random() < multipart_ratio,
+            attachment_bytes=attachment_bytes if rng.random() < attachment_ratio else 0,
+            charset=charsets[i % len(charsets)],
+        )
+        messages.append(
+            {
+                "id": f"msg{i:05d}",
+                "threadId": f"thread{i:05d}",
+                "labelIds": ["UNREAD", "INBOX"],
+                "snippet": "",
+                "sizeEstimate": len(raw),
+                "raw": base64.urlsafe_b64encode(raw).decode("ascii"),
+            }
+        )
+    return messages
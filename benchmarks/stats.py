@@ -0,0 +1,13 @@
+import statistics
+
+
+def describe(samples: list[float]) -> dict:
+    """Median, 95th and 99th percentiles, min and max of `samples`, in seconds."""
+    ordered = sorted(samples)
+    return {
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "p99": ordered[min(len(ordered) - 1, round(0.99 * (len(ordered) - 1)))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
@@ -0,0 +1,193 @@
+import heapq
+import re
+import zlib
+from email.utils import parseaddr
+
+from prompt_builder import clean_body
+
+# Bottom-k MinHash: each body is sketched by the SKETCH_SIZE smallest hashes of its
+# word shingles, and two bodies whose estimated Jaccard similarity reaches
+# NEAR_DUPLICATE_THRESHOLD are collapsed
+SKETCH_SIZE = 64
+SHINGLE_WORDS = 3
+NEAR_DUPLICATE_THRESHOLD = 0.7
+# Bodies with fewer shingles are too short to call near-duplicates
+MIN_SHINGLES = 8
+# Candidate pairs share one of their CANDIDATE_HASHES smallest hashes
+CANDIDATE_HASHES = 4
+# Lines from the other emails in a group appended to the representative's body
+DELTA_CHAR_LIMIT = 2000
+# Other subjects listed in a group's note
+SUBJECT_LIMIT = 10
+
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*(?:(?:re|fwd?|aw|sv)\s*(?:\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+# Run numbers, commit hashes, timestamps and links differ between otherwise identical
+# notifications
+_VOLATILE_RE = re.compile(r"https?://\S+|\b[0-9a-f]{7,40}\b|\d+")
+# Parts of a line that make repeated boilerplate look new: links, message IDs,
+# hashes and long ids. Short numbers (PR #12, 3m20s) are kept
+_NOISE_RE = re.compile(r"https?://\S+|<[^>\s]+@[^>\s]+>|\b[0-9a-f]{7,40}\b|\d{5,}")
+_WORD_RE = re.compile(r"\w+")
+_ANGLE_ADDR_RE = re.compile(r"<([^<>@\s]+@[^<>\s]+)>\s*$")
+
+
+def normalise_subject(subject: str) -> str:
+    return " ".join(_SUBJECT_PREFIX_RE.sub("", subject).lower().split())
+
+
+def sender_address(sender: str) -> str:
+    """The lower-cased address of a From header."""
+    # parseaddr gives up on unquoted specials such as "dependabot[bot] <...>"
+    match = _ANGLE_ADDR_RE.search(sender)
+    return (match.group(1) if match else parseaddr(sender)[1]).lower()
+
+
+def _sketch(body: str) -> list[int]:
+    words = _WORD_RE.findall(_VOLATILE_RE.sub("0", body.lower()))
+    shingles = {
+        " ".join(words[i : i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+    if len(shingles) < MIN_SHINGLES:
+        return []
+    # crc32 rather than hash(), so groups don't change with PYTHONHASHSEED
+    return heapq.nsmallest(SKETCH_SIZE, {zlib.crc32(s.encode()) for s in shingles})
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    """Estimated Jaccard similarity of two bodies from their sketches."""
+    if not a or not b:
+        return 0.0
+    both = set(a) & set(b)
+    union = heapq.nsmallest(SKETCH_SIZE, set(a) | set(b))
+    return sum(h in both for h in union) / len(union)
+
+
+class _Groups:
+    # Union-find over email indices
+    def __init__(self, count: int):
+        self.parent = list(range(count))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            # The earlier email stays the root, and so the representative
+            self.parent[max(i, j)] = min(i, j)
+
+
+def _join_on(groups: _Groups, keys: list) -> None:
+    first: dict = {}
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        if key in first:
+            groups.union(first[key], i)
+        else:
+            first[key] = i
+
+
+def _join_near_duplicates(groups: _Groups, kinds: list[tuple], sketches: list, threshold: float):
+    # Only emails of the same kind sharing one of their smallest hashes are compared,
+    # each against the first email of every group already seen in that bucket, so
+    # a flood of identical notifications costs one comparison each
+    buckets: dict[tuple, list[int]] = {}
+    for i, sketch in enumerate(sketches):
+        for h in sketch[:CANDIDATE_HASHES]:
+            bucket = buckets.setdefault((kinds[i], h), [])
+            for j in bucket:
+                if groups.find(i) == groups.find(j):
+                    break
+                if similarity(sketch, sketches[j]) >= threshold:
+                    groups.union(i, j)
+                    break
+            else:
+                bucket.append(i)
+
+
+def _line_key(line: str) -> str:
+    return " ".join(_NOISE_RE.sub("", line).lower().split())
+
+
+def _merge(members: list[dict], bodies: list[str]) -> dict:
+    representative = members[0]
+    seen = {_line_key(line) for line in bodies[0].split("\n")}
+    deltas, length = [], 0
+    for line in (line.strip() for body in bodies[1:] for line in body.split("\n")):
+        key = _line_key(line)
+        # A "... wrote:" line mid-body would make clean_body cut everything after it
+        if not key or key in seen or key.endswith("wrote:"):
+            continue
+        if length + len(line) > DELTA_CHAR_LIMIT:
+            break
+        seen.add(key)
+        deltas.append(line)
+        length += len(line)
+
+    notes = [f"[{len(members) - 1} more similar email(s) collapsed into this one]"]
+    subjects = dict.fromkeys(
+        m["subject"] for m in members[1:] if m["subject"] != members[0]["subject"]
+    )
+    if subjects:
+        listed = list(subjects)[:SUBJECT_LIMIT]
+        more = len(subjects) - len(listed)
+        notes.append("Other subjects: " + "; ".join(listed) + (f" and {more} more" if more else ""))
+    senders = dict.fromkeys(m["from"] for m in members[1:] if m["from"] != members[0]["from"])
+    if senders:
+        notes.append("Also sent by: " + "; ".join(senders))
+    notes.extend(deltas)
+    return {
+        **representative,
+        "body": bodies[0] + "\n\n" + "\n".join(notes),
+        "collapsed": len(members),
+    }
+
+
+def collapse_emails(emails: list[dict], threshold: float = NEAR_DUPLICATE_THRESHOLD) -> list[dict]:
+    """Collapse each group of related emails into one representative.
+
+    Emails are grouped when they share a Gmail thread, a normalised subject and
+    sender (or for bulk mail, see gmail_client._is_bulk, sender domain), or a
+    sender, a subject that differs only in numbers and ids
+    (e.g. CI run notifications) and a near-duplicate body. The first email of each
+    group represents it, with a note of how many emails it stands for, their other
+    subjects and senders, and the lines of their bodies it does not already
+    contain. Emails in no group are returned unchanged, in their original order.
+    """
+    if len(emails) < 2:
+        return emails
+    groups = _Groups(len(emails))
+    _join_on(groups, [e.get("threadId") or None for e in emails])
+    senders = [sender_address(e.get("from", "")) for e in emails]
+    subjects = [normalise_subject(e.get("subject", "")) for e in emails]
+    # Only bulk mail is matched by domain: two people at gmail.com asking a "Quick
+    # question" are different emails
+    _join_on(
+        groups,
+        [
+            (subject, sender.rpartition("@")[2] if e.get("bulk") else sender)
+            if subject and subject != "(no subject)"
+            else None
+            for e, subject, sender in zip(emails, subjects, senders, strict=True)
+        ],
+    )
+    bodies = [clean_body(e.get("body", "")) for e in emails]
+    kinds = [
+        (sender, _VOLATILE_RE.sub("0", subject))
+        for sender, subject in zip(senders, subjects, strict=True)
+    ]
+    _join_near_duplicates(groups, kinds, [_sketch(body) for body in bodies], threshold)
+
+    members: dict[int, list[int]] = {}
+    for i in range(len(emails)):
+        members.setdefault(groups.find(i), []).append(i)
+    return [
+        emails[root]
+        if len(indices) == 1
+        else _merge([emails[i] for i in indices], [bodies[i] for i in indices])
+        for root, indices in members.items()
+    ]
@@ -0,0 +1,239 @@
+import os
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import metrics
+from gmail_client import (
+    fetch_emails,
+    list_new_message_ids,
+    load_history_id,
+    mark_as_read,
+    save_history_id,
+    watch_mailbox,
+)
+from jobs import Pipeline
+from summariser import summarise_emails
+
+# New emails are summarised once DAEMON_BATCH_SIZE of them are waiting, or
+# DAEMON_BATCH_WINDOW seconds after the first of them arrived
+DAEMON_BATCH_SIZE = 20
+DAEMON_BATCH_WINDOW = 120.0
+# Without a push notification for this long, the daemon lists Gmail's history
+# itself; when nothing has changed that is a single history.list call
+DAEMON_POLL_INTERVAL = 60.0
+# users.watch lapses after seven days; Google recommends renewing it daily
+WATCH_RENEW_INTERVAL = 24 * 60 * 60
+# Emails whose batch has failed this many times are left unread for the daily run
+DAEMON_MAX_ATTEMPTS = 3
+
+
+class MicroBatcher:
+    """Message IDs waiting to be summarised, released together as one batch.
+
+    A batch is ready once `size` IDs are waiting or the first of them has waited
+    `window` seconds. An ID already waiting is not added twice. Not thread-safe;
+    the daemon uses it from its own thread only.
+    """
+
+    def __init__(
+        self,
+        size: int = DAEMON_BATCH_SIZE,
+        window: float = DAEMON_BATCH_WINDOW,
+        clock=time.monotonic,
+    ):
+        self.size = size
+        self.window = window
+        self._clock = clock
+        self._ids: dict[str, None] = {}
+        self._since: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, ids: list[str]) -> None:
+        self._ids.update(dict.fromkeys(ids))
+        if self._ids and self._since is None:
+            self._since = self._clock()
+
+    def deadline(self) -> float | None:
+        """When the waiting IDs become a batch however few they are; None if none wait."""
+        return None if self._since is None else self._since + self.window
+
+    def ready(self) -> bool:
+        deadline = self.deadline()
+        return len(self._ids) >= self.size or (deadline is not None and self._clock() >= deadline)
+
+    def take(self) -> list[str]:
+        # Everything waiting, so the history ID listed last covers the whole batch
+        ids, self._ids, self._since = list(self._ids), {}, None
+        return ids
+
+
+class Daemon:
+    """Summarises new mail into Slack in micro-batches, on one background thread.
+
+    New message IDs are listed from Gmail's history when `notify` is called (by
+    api.py's Pub/Sub push endpoint) or after `poll_interval` seconds without a
+    notification. With `topic`, users.watch is registered and renewed daily so
+    Gmail publishes those notifications. The history ID is saved to `sync_state`
+    after each batch, so a restarted daemon carries on where it stopped.
+    """
+
+    def __init__(
+        self,
+        sync_state: str | None = None,
+        topic: str | None = None,
+        batch_size: int = DAEMON_BATCH_SIZE,
+        batch_window: float = DAEMON_BATCH_WINDOW,
+        poll_interval: float = DAEMON_POLL_INTERVAL,
+        max_results: int = 20,
+        pipeline: Pipeline | None = None,
+    ):
+        self.sync_state = sync_state
+        self.topic = topic
+        self.poll_interval = poll_interval
+        self.max_results = max_results
+        self.batches = 0
+        self._batcher = MicroBatcher(batch_size, batch_window)
+        self._pipeline = pipeline
+        self._history_id: str | None = None
+        self._attempts: dict[str, int] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def notify(self, history_id: str | None = None) -> None:
+        """Note that the mailbox changed; the new mail is listed on the daemon's thread."""
+        metrics.inc("daemon_notifications_total")
+        current = self._history_id
+        # Gmail history IDs only grow; a notification for a change already listed
+        # needs no listing of its own
+        if history_id and current and int(history_id) <= int(current):
+            return
+        self._wake.set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="daemon", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self) -> None:
+        """Watch, list and summarise until stop() is called."""
+        if self.sync_state:
+            self._history_id = load_history_id(self.sync_state)
+        watched_at = last_poll = None
+        while not self._stop.is_set():
+            # Created on this thread, as Gmail services are per thread
+            try:
+                pipeline = self._pipeline = self._pipeline or Pipeline()
+            except Exception as e:
+                print(f"Daemon could not start: {type(e).__name__}: {e}", file=sys.stderr)
+                self._stop.wait(self.poll_interval)
+                continue
+            now = time.monotonic()
+            if self.topic and (watched_at is None or now - watched_at >= WATCH_RENEW_INTERVAL):
+                if self._watch(pipeline):
+                    watched_at = now
+            if self._wake.is_set() or last_poll is None or now - last_poll >= self.poll_interval:
+                self._wake.clear()
+                self._list_new(pipeline)
+                last_poll = now
+            if self._batcher.ready():
+                self._run_batch(pipeline, self._batcher.take())
+                continue
+            timeout = last_poll + self.poll_interval - time.monotonic()
+            deadline = self._batcher.deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+            self._wake.wait(max(timeout, 0.0))
+
+    def _watch(self, pipeline: Pipeline) -> bool:
+        try:
+            watch_mailbox(pipeline.service, self.topic)
+        except Exception as e:
+            # Retried on the next loop; polling covers the gap
+            print(f"Gmail watch failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def _list_new(self, pipeline: Pipeline) -> None:
+        try:
+            with metrics.timer("daemon_list"):
+                ids, self._history_id = list_new_message_ids(
+                    pipeline.service, self._history_id, self.max_results
+                )
+        except Exception as e:
+            print(f"Listing new mail failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return
+        self._batcher.add(ids)
+
+    def _run_batch(self, pipeline: Pipeline, ids: list[str]) -> None:
+        try:
+            with metrics.timer("daemon_batch"):
+                emails = fetch_emails(pipeline.service, ids, cache=pipeline.message_cache)
+                if emails:
+                    pipeline.slack.send(summarise_emails(emails, cache=pipeline.summary_cache))
+        except Exception as e:
+            print(f"Batch of {len(ids)} email(s) failed: {type(e).__name__}", file=sys.stderr)
+            metrics.inc("daemon_batch_failures_total")
+            # Retried with the next batch; the history ID is not saved meanwhile
+            for msg_id in ids:
+                self._attempts[msg_id] = self._attempts.get(msg_id, 0) + 1
+                if self._attempts[msg_id] >= DAEMON_MAX_ATTEMPTS:
+                    del self._attempts[msg_id]
+                else:
+                    self._batcher.add([msg_id])
+            return
+        for msg_id in ids:
+            self._attempts.pop(msg_id, None)
+        self.batches += 1
+        metrics.inc("daemon_batches_total")
+        metrics.inc("daemon_emails_total", len(emails))
+        if emails:
+            # Slack already has the summary, so a failure here is reported, not retried
+            try:
+                failures = mark_as_read(pipeline.service, emails)
+            except Exception as e:
+                print(f"Could not mark emails as read: {type(e).__name__}", file=sys.stderr)
+            else:
+                if failures:
+                    print(f"Could not mark {len(failures)} thread(s) as read.", file=sys.stderr)
+        if self.sync_state and self._history_id:
+            save_history_id(self._history_id, self.sync_state)
+
+
+def open_daemon(topic: str | None = None) -> Daemon:
+    """A Daemon configured from the DAEMON_* variables and GMAIL_SYNC_STATE."""
+    return Daemon(
+        sync_state=os.environ.get("GMAIL_SYNC_STATE") or None,
+        topic=topic,
+        batch_size=int(os.environ.get("DAEMON_BATCH_SIZE", DAEMON_BATCH_SIZE)),
+        batch_window=float(os.environ.get("DAEMON_BATCH_WINDOW", DAEMON_BATCH_WINDOW)),
+        poll_interval=float(os.environ.get("DAEMON_POLL_INTERVAL", DAEMON_POLL_INTERVAL)),
+        max_results=int(os.environ.get("GMAIL_MAX_RESULTS", 20)),
+    )
+
+
+def main():
+    # Push notifications are delivered to the API's /api/gmail/push (DAEMON=1 there),
+    # so on its own the daemon polls
+    daemon = open_daemon()
+    print(f"Polling for new mail every {daemon.poll_interval:g}s.")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
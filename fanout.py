@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from main import Account, Shared, run
+
+# Accounts allowed in each provider's stage at once; override with
+# FANOUT_GMAIL_CONCURRENCY, FANOUT_OPENAI_CONCURRENCY and FANOUT_SLACK_CONCURRENCY
+PROVIDER_LIMITS = {"gmail": 8, "openai": 4, "slack": 2}
+FANOUT_WORKERS = 16
+
+_ACCOUNT_FIELDS = ("google_refresh_token", "slack_token", "slack_cookie", "sync_state")
+
+
+def _resolve(value: str | None) -> str | None:
+    # "$NAME" reads the secret from the environment instead of the roster file
+    if value and value.startswith("$"):
+        return os.environ[value[1:]]
+    return value
+
+
+def load_roster(path: str) -> list[Account]:
+    """Read accounts from a JSON list of {"name", "google_refresh_token", ...} objects."""
+    with open(path) as f:
+        entries = json.load(f)
+    return [
+        Account(entry["name"], **{field: _resolve(entry.get(field)) for field in _ACCOUNT_FIELDS})
+        for entry in entries
+    ]
+
+
+def provider_limits() -> dict[str, int]:
+    return {
+        provider: int(os.environ.get(f"FANOUT_{provider.upper()}_CONCURRENCY", default))
+        for provider, default in PROVIDER_LIMITS.items()
+    }
+
+
+def run_accounts(
+    accounts: list[Account], shared: Shared, workers: int = FANOUT_WORKERS
+) -> list[dict]:
+    """Run every account concurrently; one account failing does not stop the others."""
+
+    def _run(account: Account) -> dict:
+        start = time.perf_counter()
+        try:
+            return {"name": account.name, "ok": True, **run(account, shared)}
+        except Exception as e:
+            return {
+                "name": account.name,
+                "ok": False,
+                "error": type(e).__name__,
+                "timings": {"total": time.perf_counter() - start},
+            }
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(accounts)))) as pool:
+        return list(pool.map(_run, accounts))
+
+
+def _report(result: dict) -> str:
+    timings = result["timings"]
+    stages = ", ".join(
+        f"{stage} {seconds:.2f}s" for stage, seconds in timings.items() if stage != "total"
+    )
+    if not result["ok"]:
+        return f"{result['name']}: failed ({result['error']}) after {timings['total']:.2f}s"
+    return f"{result['name']}: {result['emails']} email(s) in {timings['total']:.2f}s ({stages})"
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("FANOUT_ROSTER")
+    if not path:
+        print("Usage: python fanout.py ROSTER.json (or set FANOUT_ROSTER)", file=sys.stderr)
+        sys.exit(2)
+    accounts = load_roster(path)
+    shared = Shared(provider_limits())
+    start = time.perf_counter()
+    try:
+        results = run_accounts(
+            accounts, shared, int(os.environ.get("FANOUT_WORKERS", FANOUT_WORKERS))
+        )
+    finally:
+        shared.close()
+    for result in results:
+        print(_report(result))
+    failed = sum(not result["ok"] for result in results)
+    print(
+        f"{len(results) - failed}/{len(results)} account(s) done "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
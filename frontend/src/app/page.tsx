@@ -84,7 +84,8 @@ export default function Dashboard() {
   });
   const [error, setError] = useState("");
 
-  async function fetchEmails() {
+  // The API serves its last fetch until asked to refresh, so reloading the page is cheap
+  async function fetchEmails(refresh = false) {
     setLoading((l) => ({ ...l, emails: true }));
     setError("");
     try {
@@ -92,7 +93,7 @@ export default function Dashboard() {
         await sleep(600);
         setEmails(MOCK_EMAILS);
       } else {
-        const res = await fetch(`${API}/api/emails`);
+        const res = await fetch(`${API}/api/emails${refresh ? "?refresh=true" : ""}`);
         if (!res.ok) throw new Error((await res.json()).detail);
         const data = await res.json();
         setEmails(data.emails);
@@ -105,6 +106,16 @@ export default function Dashboard() {
     }
   }
 
+  // Opening an email tells the API's ranking what the reader cares about
+  function markOpened(id: string) {
+    if (mockMode) return;
+    fetch(`${API}/api/emails/opened`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ ids: [id] }),
+    }).catch(() => {});
+  }
+
   async function summariseEmails() {
     setLoading((l) => ({ ...l, summary: true }));
     setError("");
@@ -113,14 +124,29 @@ export default function Dashboard() {
         await sleep(1200);
         setSummary(MOCK_SUMMARY);
       } else {
-        const res = await fetch(`${API}/api/summarise`, {
+        const res = await fetch(`${API}/api/summarise/stream`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify({ emails }),
         });
-        if (!res.ok) throw new Error((await res.json()).detail);
-        const data = await res.json();
-        setSummary(data.summary);
+        if (!res.ok || !res.body) throw new Error((await res.json()).detail);
+        setSummary("");
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          // Events are separated by a blank line; keep any partial event for the next chunk
+          const events = buffer.split("\n\n");
+          buffer = events.pop() ?? "";
+          for (const raw of events) {
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? "{}");
+            if (event === "delta") setSummary((s) => s + data.text);
+            if (event === "error") throw new Error(data.detail);
+          }
+        }
       }
     } catch (e) {
       setError(e instanceof Error ? e.message : "Failed to summarise");
@@ -237,11 +263,11 @@ export default function Dashboard() {
         <div className="flex items-center gap-4 mb-4">
           <h2 className="text-lg font-semibold">1. Fetch Unread Emails</h2>
           <button
-            onClick={fetchEmails}
+            onClick={() => fetchEmails(hasFetched)}
             disabled={loading.emails}
             className="px-4 py-2 bg-blue-600 text-white rounded hover:bg-blue-700 disabled:opacity-50 text-sm"
           >
-            {loading.emails ? "Fetching..." : "Fetch Emails"}
+            {loading.emails ? "Fetching..." : hasFetched ? "Refresh" : "Fetch Emails"}
           </button>
           {emails.length > 0 && (
             <span className="text-sm text-gray-400">
@@ -259,6 +285,7 @@ export default function Dashboard() {
             {emails.map((email) => (
               <details
                 key={email.id}
+                onToggle={(e) => e.currentTarget.open && markOpened(email.id)}
                 className="border border-gray-700 rounded p-3"
               >
                 <summary className="cursor-pointer">
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+# The Google client libraries are imported on first use, as they take a noticeable
+# share of main.py's startup; see tests/test_startup.py
+
+API_TIMEOUT = 30
+SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
+
+# Refresh in the background once the access token has less than this left.
+# Larger than google-auth's own threshold (3m45s), past which every request
+# would refresh the token itself
+TOKEN_REFRESH_MARGIN = 10 * 60
+
+_discovery_doc: dict | None = None
+_discovery_lock = threading.Lock()
+
+
+def _discovery_document() -> dict:
+    # The Gmail discovery document bundled with google-api-python-client,
+    # parsed once per process
+    global _discovery_doc
+    with _discovery_lock:
+        if _discovery_doc is None:
+            from googleapiclient.discovery_cache import get_static_doc
+
+            _discovery_doc = json.loads(get_static_doc("gmail", "v1"))
+    return _discovery_doc
+
+
+def build_service(creds: "Credentials"):
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=API_TIMEOUT))
+    document = _discovery_document()
+    # GMAIL_API_URL points the client, batch endpoint included, at another server
+    api_url = os.environ.get("GMAIL_API_URL")
+    if api_url:
+        document = {**document, "rootUrl": api_url.rstrip("/") + "/"}
+    return build_from_document(document, http=http)
+
+
+class GmailAuth:
+    """Keeps one Gmail access token per process and refreshes it before it expires.
+
+    Callers get the same Credentials object from `credentials()`; the first caller
+    to find it expired refreshes it under a lock while the others wait, and a
+    token close to expiry is refreshed on a background thread. With `token_path`,
+    the token is also saved to and loaded from that file, so short-lived runs can
+    reuse a token that is still valid. `refresh_token` selects another mailbox
+    than GOOGLE_REFRESH_TOKEN's.
+    """
+
+    def __init__(
+        self,
+        token_path: str | None = None,
+        margin: float = TOKEN_REFRESH_MARGIN,
+        refresh_token: str | None = None,
+    ):
+        self.token_path = token_path
+        self.margin = margin
+        self.refreshes = 0
+        from google.oauth2.credentials import Credentials
+
+        self._creds = Credentials(
+            token=None,
+            refresh_token=refresh_token or os.environ["GOOGLE_REFRESH_TOKEN"],
+            token_uri=os.environ.get("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token"),
+            client_id=os.environ["GOOGLE_CLIENT_ID"],
+            client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
+            scopes=SCOPES,
+        )
+        self._lock = threading.Lock()
+        self._background: threading.Thread | None = None
+        if token_path:
+            self._load_token()
+
+    def _account(self) -> str:
+        # Ties a saved token to the account it was issued for
+        key = f"{self._creds.client_id}:{self._creds.refresh_token}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _load_token(self) -> None:
+        try:
+            with open(self.token_path) as f:
+                saved = json.load(f)
+            if saved["account"] != self._account():
+                return
+            self._creds.token = saved["token"]
+            # google-auth compares against naive UTC datetimes
+            self._creds.expiry = datetime.fromisoformat(saved["expiry"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_token(self) -> None:
+        data = {
+            "account": self._account(),
+            "token": self._creds.token,
+            "expiry": self._creds.expiry.isoformat(),
+        }
+        tmp_path = f"{self.token_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.token_path)
+
+    def _refresh(self) -> None:
+        from google.auth.transport.requests import Request
+
+        self._creds.refresh(Request())
+        self.refreshes += 1
+        if self.token_path:
+            self._save_token()
+
+    def _time_left(self) -> timedelta:
+        if self._creds.expiry is None:
+            return timedelta(0)
+        return self._creds.expiry - datetime.now(UTC).replace(tzinfo=None)
+
+    def _refresh_if_due(self, margin: timedelta) -> None:
+        with self._lock:
+            # Another thread may have refreshed while this one waited for the lock
+            if not self._creds.token or self._time_left() < margin:
+                self._refresh()
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            self._background = threading.Thread(
+                target=self._refresh_if_due,
+                args=(timedelta(seconds=self.margin),),
+                name="gmail-token-refresh",
+                daemon=True,
+            )
+            self._background.start()
+
+    def credentials(self) -> "Credentials":
+        if not self._creds.valid:
+            self._refresh_if_due(timedelta(seconds=self.margin))
+        elif self._time_left() < timedelta(seconds=self.margin):
+            self._refresh_in_background()
+        return self._creds
+
+
+_default_auth: GmailAuth | None = None
+_default_lock = threading.Lock()
+
+
+def default_auth() -> GmailAuth:
+    # GMAIL_TOKEN_CACHE names a file to keep the access token in between runs
+    global _default_auth
+    with _default_lock:
+        if _default_auth is None:
+            _default_auth = GmailAuth(os.environ.get("GMAIL_TOKEN_CACHE"))
+    return _default_auth
@@ -1,35 +1,121 @@
+import asyncio
 import base64
+import binascii
+import json
 import os
+import queue
+import quopri
+import re
+import threading
 import time
-from email import message_from_bytes
+import weakref
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from email.header import decode_header
 from email.message import Message
+from email.parser import BytesHeaderParser
 
-import google_auth_httplib2
-import httplib2
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+import metrics
+from gmail_auth import API_TIMEOUT, GmailAuth, build_service, default_auth
 
-API_TIMEOUT = 30
+# Gmail's batch endpoint accepts at most 100 sub-requests per call
+BATCH_SIZE = 100
+# messages.batchModify accepts at most this many IDs per call
+MODIFY_BATCH_SIZE = 1000
+BATCH_RETRIES = 3
+BATCH_RETRY_DELAY = 1.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
 
-SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
+# Truncate long bodies to keep the LLM context reasonable
+BODY_CHAR_LIMIT = 2000
+# Worst case encoded bytes per character (UTF-8, UTF-16 surrogate pairs, GB18030)
+_MAX_BYTES_PER_CHAR = 4
+_HEADER_LINE_RE = re.compile(rb"From |[\041-\071\073-\176]*:|[\t ]")
 
+# Mailing-list and automatic mail carries at least one of these (RFC 2369, RFC 3834)
+BULK_HEADERS = ["List-Unsubscribe", "List-Id", "Precedence", "Auto-Submitted"]
+METADATA_HEADERS = ["Subject", "From", "Date", *BULK_HEADERS]
 
-def get_gmail_service():
-    creds = Credentials(
-        token=None,
-        refresh_token=os.environ["GOOGLE_REFRESH_TOKEN"],
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=os.environ["GOOGLE_CLIENT_ID"],
-        client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
-        scopes=SCOPES,
-    )
+SYNC_STATE_PATH = ".gmail_sync_state.json"
+
+# Normal runs list unread mail from the last 24 hours; Gmail returns at most 500
+# message IDs per page
+LIST_WINDOW = 24 * 60 * 60
+LIST_PAGE_SIZE = 500
+
+# Backlog mode lists every unread email, up to these ceilings
+BACKLOG_MAX_EMAILS = 2000
+BACKLOG_MAX_BYTES = 200 * 1024 * 1024
+
+PIPELINE_FETCH_WORKERS = 4
+PIPELINE_PARSE_WORKERS = 2
+PIPELINE_CHUNK_SIZE = 25
+PIPELINE_QUEUE_SIZE = 50
+
+# Threads AsyncGmailClient runs blocking Gmail calls on
+ASYNC_GMAIL_WORKERS = 8
+
+
+class TransferStats:
+    """Bytes downloaded from Gmail, in total and per service.
+
+    Services are per mailbox and thread (see get_gmail_service), so per-service
+    counts keep concurrent accounts apart.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self._by_service: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def add(self, count: int, service=None) -> None:
+        with self._lock:
+            self.bytes += count
+            if service is not None:
+                self._by_service[service] = self._by_service.get(service, 0) + count
+        metrics.inc("gmail_bytes_total", count)
+
+    def bytes_for(self, service) -> int:
+        with self._lock:
+            return self._by_service.get(service, 0)
 
-    creds.refresh(Request())
+    def reset(self) -> None:
+        with self._lock:
+            self.bytes = 0
+            self._by_service.clear()
 
-    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=API_TIMEOUT))
-    return build("gmail", "v1", http=http)
+
+# Approximate bytes downloaded from Gmail by this process
+transfer_stats = TransferStats()
+
+
+_thread_state = threading.local()
+
+
+def get_gmail_service(auth: GmailAuth | None = None):
+    # Cached per thread and mailbox (httplib2 connections are not thread-safe); the
+    # GmailAuth refreshes the token only when it is about to expire
+    auth = auth or default_auth()
+    creds = auth.credentials()
+    services = _thread_state.__dict__.setdefault("services", {})
+    if auth not in services:
+        services[auth] = build_service(creds)
+    return services[auth]
+
+
+def _thread_http(service):
+    # httplib2.Http is not thread-safe, so each fetch worker gets its own connection
+    cached = getattr(_thread_state, "http", None)
+    if cached is None or cached[0] is not service:
+        import google_auth_httplib2
+        import httplib2
+
+        http = google_auth_httplib2.AuthorizedHttp(
+            service._http.credentials, http=httplib2.Http(timeout=API_TIMEOUT)
+        )
+        cached = _thread_state.http = (service, http)
+    return cached[1]
 
 
 def _decode_header_value(value: str) -> str:
@@ -43,92 +129,820 @@ def _decode_header_value(value: str) -> str:
     return "".join(result)
 
 
-def _extract_body(mime_msg: Message) -> str:
+def _line_end(data: bytes, pos: int, end: int) -> int:
+    newline = data.find(b"\n", pos, end)
+    return end if newline == -1 else newline + 1
+
 
-    if mime_msg.is_multipart():
-        for part in mime_msg.walk():
-            if part.get_content_type() == "text/plain":
-                payload = part.get_payload(decode=True)
-                if isinstance(payload, bytes):
-                    charset = part.get_content_charset() or "utf-8"
-                    return payload.decode(charset, errors="replace")
+def _parse_headers(
+    data: bytes, start: int, end: int, default_type: str = "text/plain"
+) -> tuple[Message, int]:
+    # Mirrors email.feedparser: headers run until a blank line (consumed) or the first
+    # line that is not a header or continuation (left for the body)
+    pos = start
+    while pos < end:
+        line_end = _line_end(data, pos, end)
+        if data[pos:line_end] in (b"\r\n", b"\n"):
+            headers = BytesHeaderParser().parsebytes(data[start:pos])
+            pos = line_end
+            break
+        if not _HEADER_LINE_RE.match(data, pos, line_end):
+            headers = BytesHeaderParser().parsebytes(data[start:pos])
+            break
+        pos = line_end
     else:
-        payload = mime_msg.get_payload(decode=True)
-        if isinstance(payload, bytes):
-            charset = mime_msg.get_content_charset() or "utf-8"
-            return payload.decode(charset, errors="replace")
-    return ""
+        headers = BytesHeaderParser().parsebytes(data[start:end])
+    headers.set_default_type(default_type)
+    return headers, pos
+
+
+def _find_delimiter(data: bytes, delimiter: bytes, start: int, end: int) -> tuple[int, int] | None:
+    # Span of the next "--boundary" or "--boundary--" line, as feedparser matches them
+    pos = start
+    while True:
+        pos = data.find(delimiter, pos, end)
+        if pos == -1:
+            return None
+        line_end = _line_end(data, pos, end)
+        rest = data[pos + len(delimiter) : line_end].rstrip(b"\r\n")
+        if rest.startswith(b"--"):
+            rest = rest[2:]
+        if (pos == start or data[pos - 1] in b"\r\n") and not rest.strip(b" \t"):
+            return pos, line_end
+        pos += len(delimiter)
+
+
+def _iter_parts(data: bytes, boundary: bytes, start: int, end: int) -> Iterator[tuple[int, int]]:
+    delimiter = b"--" + boundary
+    found = _find_delimiter(data, delimiter, start, end)
+    while found is not None:
+        pos, line_end = found
+        if data.startswith(b"--", pos + len(delimiter)):
+            return
+        found = _find_delimiter(data, delimiter, line_end, end)
+        part_end = end if found is None else found[0]
+        # The line break before a boundary belongs to the boundary
+        for eol in (b"\r\n", b"\n", b"\r"):
+            if found is not None and data.endswith(eol, line_end, part_end):
+                part_end -= len(eol)
+                break
+        yield line_end, part_end
+
+
+def _find_text_part(
+    data: bytes, headers: Message, start: int, end: int
+) -> tuple[Message, int, int] | None:
+    # Depth-first like Message.walk(), but only the headers of each part are parsed
+    content_type = headers.get_content_type()
+    if headers.get_content_maintype() == "multipart":
+        boundary = headers.get_boundary()
+        if boundary is None:
+            return None
+        default_type = "message/rfc822" if content_type == "multipart/digest" else "text/plain"
+        for part_start, part_end in _iter_parts(
+            data, boundary.encode("ascii", "surrogateescape"), start, end
+        ):
+            part_headers, body_start = _parse_headers(data, part_start, part_end, default_type)
+            found = _find_text_part(data, part_headers, body_start, part_end)
+            if found is not None:
+                return found
+        return None
+    if content_type == "message/delivery-status":
+        # Status blocks parse as header-only text/plain messages with an empty body
+        return headers, start, start
+    if headers.get_content_maintype() == "message":
+        inner_headers, body_start = _parse_headers(data, start, end)
+        return _find_text_part(data, inner_headers, body_start, end)
+    if content_type == "text/plain":
+        return headers, start, end
+    return None
+
+
+def _decode_base64(encoded: bytes) -> bytes:
+    # Same fallbacks the email package applies to malformed base64 payloads
+    missing_padding = b"==="[: -len(encoded) % 4] if len(encoded) % 4 else b""
+    try:
+        return base64.b64decode(encoded + missing_padding, validate=True)
+    except binascii.Error:
+        pass
+    for padding in (b"", b"=="):
+        try:
+            return base64.b64decode(encoded + padding, validate=False)
+        except binascii.Error:
+            continue
+    return encoded
+
+
+def _decode_transfer(payload: bytes, cte: str) -> bytes:
+    if cte == "quoted-printable":
+        return quopri.decodestring(payload)
+    if cte == "base64":
+        return _decode_base64(payload.replace(b"\r", b"").replace(b"\n", b""))
+    if cte in ("x-uuencode", "uuencode", "uue", "x-uue"):
+        part = Message()
+        part["Content-Transfer-Encoding"] = cte
+        part.set_payload(payload.decode("ascii", "surrogateescape"))
+        return part.get_payload(decode=True)
+    return payload
+
+
+def _decode_prefix(data: bytes, start: int, end: int, cte: str, needed: int) -> bytes:
+    # Decode just enough of the payload to yield `needed` bytes, growing the window
+    # only when the transfer encoding expands more than expected
+    window = needed * 2
+    while True:
+        stop = start + window
+        if stop >= end or cte not in ("base64", "quoted-printable", ""):
+            return _decode_transfer(data[start:end], cte)
+        chunk = data[start:stop]
+        if cte == "base64":
+            encoded = chunk.replace(b"\r", b"").replace(b"\n", b"")
+            encoded = encoded[: len(encoded) - len(encoded) % 4]
+            try:
+                decoded = base64.b64decode(encoded, validate=True)
+            except binascii.Error:
+                return _decode_transfer(data[start:end], cte)
+        elif cte == "quoted-printable":
+            # Only whole lines, so escapes and soft breaks are never split
+            decoded = quopri.decodestring(chunk[: chunk.rfind(b"\n") + 1])
+        else:
+            decoded = chunk
+        if len(decoded) >= needed:
+            return decoded
+        window *= 2
+
+
+def _decode_text(data: bytes, headers: Message, start: int, end: int, limit: int) -> str:
+    cte = str(headers.get("content-transfer-encoding", "")).lower()
+    if cte not in ("base64", "quoted-printable", "x-uuencode", "uuencode", "uue", "x-uue"):
+        cte = ""
+    # One spare character tells us whether truncation is needed; a partially decoded
+    # final character is always beyond it
+    payload = _decode_prefix(data, start, end, cte, (limit + 1) * _MAX_BYTES_PER_CHAR + 4)
+    charset = headers.get_content_charset() or "utf-8"
+    text = payload.decode(charset, errors="replace")
+    if len(text) > limit:
+        return text[:limit] + "..."
+    return text
+
+
+def _is_container(data: bytes, headers: Message, start: int, end: int) -> bool:
+    # Equivalent to Message.is_multipart() after a full parse
+    if headers.get_content_maintype() == "message":
+        return True
+    boundary = headers.get_boundary()
+    if headers.get_content_maintype() != "multipart" or boundary is None:
+        return False
+    delimiter = b"--" + boundary.encode("ascii", "surrogateescape")
+    return _find_delimiter(data, delimiter, start, end) is not None
+
+
+def _extract_body_at(
+    data: bytes, headers: Message, start: int, end: int, limit: int = BODY_CHAR_LIMIT
+) -> str:
+    if not _is_container(data, headers, start, end):
+        return _decode_text(data, headers, start, end, limit)
+
+    found = _find_text_part(data, headers, start, end)
+    if found is None:
+        return ""
+    return _decode_text(data, *found, limit)
+
+
+def _extract_body(raw: bytes, limit: int = BODY_CHAR_LIMIT) -> str:
+    """Return the first text/plain body of a raw RFC 822 message, truncated to `limit`.
+
+    Only header blocks are parsed: parts are located by scanning for boundaries,
+    non-text parts are never decoded, and the text part is decoded only as far as
+    the character budget needs.
+    """
+    headers, body_start = _parse_headers(raw, 0, len(raw))
+    return _extract_body_at(raw, headers, body_start, len(raw), limit)
+
+
+def _iter_message_ids(
+    service, max_results: int | None, since: int | None = LIST_WINDOW
+) -> Iterator[str]:
+    """Yield unread primary message IDs, following nextPageToken until `max_results`.
+
+    `since` limits the listing to mail from the last that many seconds; None lists
+    every unread email.
+    """
+    query = "category:primary"
+    if since is not None:
+        query += f" after:{int(time.time()) - since}"
+    remaining = max_results
+    page_token = None
+    while remaining is None or remaining > 0:
+        page_size = LIST_PAGE_SIZE if remaining is None else min(remaining, LIST_PAGE_SIZE)
+        with metrics.timer("gmail_list"):
+            response = (
+                service.users()
+                .messages()
+                .list(
+                    userId="me",
+                    labelIds=["UNREAD", "INBOX"],
+                    q=query,
+                    maxResults=page_size,
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+        msg_ids = [msg_ref["id"] for msg_ref in response.get("messages", [])]
+        yield from msg_ids
+        if remaining is not None:
+            remaining -= len(msg_ids)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _list_message_ids(
+    service, max_results: int | None, since: int | None = LIST_WINDOW
+) -> list[str]:
+    return list(_iter_message_ids(service, max_results, since))
+
+
+def _is_retryable(exception: Exception) -> bool:
+    # googleapiclient is imported on first use, like in gmail_auth
+    from googleapiclient.errors import HttpError
+
+    return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
+
+
+def _response_size(response: dict) -> int:
+    # Approximate wire size; raw payloads dominate, so avoid re-serialising them
+    if "raw" in response:
+        return len(response["raw"])
+    return len(json.dumps(response))
+
+
+def _execute_batched(
+    service, ids: list[str], make_request, http=None, raise_errors: bool = True
+) -> tuple[dict[str, dict], dict[str, Exception]]:
+    """Run one request per id through the batch endpoint.
+
+    Sub-requests that fail with a retryable status are re-sent on their own with
+    exponential backoff; ids that no longer exist (404) are skipped. Other failures
+    are raised, or with `raise_errors=False` returned alongside the results.
+    """
+    from googleapiclient.errors import HttpError
+
+    results: dict[str, dict] = {}
+    errors: dict[str, Exception] = {}
+    pending = list(ids)
+
+    for attempt in range(BATCH_RETRIES + 1):
+        failed: dict[str, Exception] = {}
+
+        def _callback(request_id, response, exception, failed=failed):
+            if exception is None:
+                results[request_id] = response
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                return
+            elif _is_retryable(exception):
+                failed[request_id] = exception
+            elif raise_errors:
+                raise exception
+            else:
+                errors[request_id] = exception
+
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=_callback)
+            for request_id in pending[start : start + BATCH_SIZE]:
+                batch.add(make_request(request_id), request_id=request_id)
+            batch.execute(http=http)
+
+        if not failed:
+            break
+        if attempt == BATCH_RETRIES:
+            if raise_errors:
+                raise next(iter(failed.values()))
+            errors.update(failed)
+            break
+        pending = [request_id for request_id in pending if request_id in failed]
+        time.sleep(BATCH_RETRY_DELAY * 2**attempt)
+
+    return results, errors
+
+
+def _fetch_messages(
+    service, msg_ids: list[str], http=None, format: str = "raw", **params
+) -> list[tuple[str, dict]]:
+    """Download messages through the batch endpoint, preserving msg_ids order.
+
+    Messages deleted since listing (404) are skipped.
+    """
+    with metrics.timer(f"gmail_get_{format}"):
+        results, _ = _execute_batched(
+            service,
+            msg_ids,
+            lambda msg_id: (
+                service.users().messages().get(userId="me", id=msg_id, format=format, **params)
+            ),
+            http=http,
+        )
+    transfer_stats.add(sum(_response_size(response) for response in results.values()), service)
+    metrics.inc("gmail_messages_fetched_total", len(results), format=format)
+    return [(msg_id, results[msg_id]) for msg_id in msg_ids if msg_id in results]
+
+
+def _is_bulk(header) -> bool:
+    # `header(name)` returns the header's value, or None when it is missing
+    if header("List-Unsubscribe") or header("List-Id"):
+        return True
+    if (header("Precedence") or "").strip().lower() in ("bulk", "list", "junk"):
+        return True
+    return (header("Auto-Submitted") or "no").strip().lower() != "no"
+
+
+def _parse_raw_message(msg_id: str, raw_msg: dict) -> dict:
+    with metrics.timer("mime_parse"):
+        decoded = base64.urlsafe_b64decode(raw_msg["raw"])
+        headers, body_start = _parse_headers(decoded, 0, len(decoded))
+
+        subject = _decode_header_value(headers.get("Subject", "(No Subject)"))
+        sender = _decode_header_value(headers.get("From", ""))
+        date = headers.get("Date", "")
+        body = _extract_body_at(decoded, headers, body_start, len(decoded))
+
+    return {
+        "id": msg_id,
+        "threadId": raw_msg.get("threadId", ""),
+        "subject": subject,
+        "from": sender,
+        "date": date,
+        "snippet": raw_msg.get("snippet", ""),
+        "bulk": _is_bulk(headers.get),
+        "body": body,
+    }
+
+
+class LazyEmail(dict):
+    """Email dict whose "body" is downloaded the first time it is read.
+
+    Until then "body" is absent from the dict, so serialising it returns headers only.
+    """
+
+    def __init__(self, data: dict, loader: "_BodyLoader"):
+        super().__init__(data)
+        self._loader = loader
+
+    def __missing__(self, key):
+        if key != "body":
+            raise KeyError(key)
+        self._loader.load()
+        # Not via self["body"], which would come straight back here
+        if not dict.__contains__(self, "body"):
+            raise KeyError(key)
+        return dict.__getitem__(self, "body")
+
+    def get(self, key, default=None):
+        if key == "body":
+            return self["body"]
+        return super().get(key, default)
 
 
-def fetch_unread_emails(service, max_results: int = 20) -> list[dict]:
-    twenty_four_hours_ago = int(time.time()) - (24 * 60 * 60)
-    response = (
+class _BodyLoader:
+    # Shared by every email from one fetch, so the first body access loads them all
+    # in a single batch rather than one request per email
+    def __init__(self, service, cache=None):
+        self._service = service
+        self._cache = cache
+        self._pending: dict[str, LazyEmail] = {}
+        self._lock = threading.Lock()
+
+    def add(self, email: dict) -> LazyEmail:
+        lazy = LazyEmail(email, self)
+        self._pending[lazy["id"]] = lazy
+        return lazy
+
+    def load(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                for msg_id, message in _fetch_messages(self._service, list(pending), format="full"):
+                    pending[msg_id]["body"] = _body_from_payload(
+                        self._service, msg_id, message.get("payload", {})
+                    )
+            except BaseException:
+                # Emails still without a body are fetched again on their next access
+                self._pending.update(
+                    {msg_id: e for msg_id, e in pending.items() if "body" not in e}
+                )
+                raise
+            for email in pending.values():
+                # Messages deleted before their body was requested
+                email.setdefault("body", "")
+            if self._cache is not None:
+                self._cache.put_many([dict(email) for email in pending.values()])
+
+
+def _find_text_payload(payload: dict) -> dict | None:
+    if payload.get("mimeType") == "text/plain":
+        return payload
+    for part in payload.get("parts", []):
+        found = _find_text_payload(part)
+        if found is not None:
+            return found
+    return None
+
+
+def _body_from_payload(service, msg_id: str, payload: dict, limit: int = BODY_CHAR_LIMIT) -> str:
+    # Same part selection as _extract_body, over the format="full" part tree
+    part = _find_text_payload(payload) if payload.get("parts") else payload
+    if part is None:
+        return ""
+
+    body = part.get("body", {})
+    data = body.get("data")
+    if data is None and body.get("attachmentId"):
+        # Large parts are skipped inline; fetch just this part
+        with metrics.timer("gmail_attachment"):
+            attachment = (
+                service.users()
+                .messages()
+                .attachments()
+                .get(userId="me", messageId=msg_id, id=body["attachmentId"])
+                .execute()
+            )
+        data = attachment.get("data", "")
+        transfer_stats.add(len(data), service)
+
+    headers = Message()
+    for header in part.get("headers", []):
+        headers[header["name"]] = header["value"]
+    charset = headers.get_content_charset() or "utf-8"
+    text = base64.urlsafe_b64decode(data or "").decode(charset, errors="replace")
+    if len(text) > limit:
+        return text[:limit] + "..."
+    return text
+
+
+def _email_from_metadata(msg_id: str, message: dict) -> dict:
+    headers = {h["name"].lower(): h["value"] for h in message.get("payload", {}).get("headers", [])}
+    return {
+        "id": msg_id,
+        "threadId": message.get("threadId", ""),
+        "subject": _decode_header_value(headers.get("subject", "(No Subject)")),
+        "from": _decode_header_value(headers.get("from", "")),
+        "date": headers.get("date", ""),
+        "snippet": message.get("snippet", ""),
+        "bulk": _is_bulk(lambda name: headers.get(name.lower())),
+    }
+
+
+def _fetch_emails(service, msg_ids: list[str], cache=None, lazy_bodies: bool = False) -> list[dict]:
+    # Cached messages skip their messages.get entirely
+    cached = cache.get_many(msg_ids) if cache is not None else {}
+    missing = [msg_id for msg_id in msg_ids if msg_id not in cached]
+
+    if lazy_bodies:
+        loader = _BodyLoader(service, cache)
+        fetched = {
+            msg_id: loader.add(_email_from_metadata(msg_id, message))
+            for msg_id, message in (
+                _fetch_messages(
+                    service, missing, format="metadata", metadataHeaders=METADATA_HEADERS
+                )
+                if missing
+                else []
+            )
+        }
+    else:
+        fetched = {
+            msg_id: _parse_raw_message(msg_id, raw_msg)
+            for msg_id, raw_msg in (_fetch_messages(service, missing) if missing else [])
+        }
+        if cache is not None and fetched:
+            cache.put_many(list(fetched.values()))
+
+    return [
+        cached[msg_id] if msg_id in cached else fetched[msg_id]
+        for msg_id in msg_ids
+        if msg_id in cached or msg_id in fetched
+    ]
+
+
+def fetch_unread_emails(
+    service, max_results: int = 20, cache=None, lazy_bodies: bool = False
+) -> list[dict]:
+    """List unread primary emails and download them.
+
+    With `lazy_bodies`, only Subject/From/Date are fetched up front (format="metadata")
+    and each email is a LazyEmail whose body is downloaded on first access.
+    """
+    msg_ids = _list_message_ids(service, max_results)
+    if not msg_ids:
+        return []
+
+    return _fetch_emails(service, msg_ids, cache, lazy_bodies)
+
+
+def attach_lazy_bodies(service, emails: list[dict]) -> list[dict]:
+    # For emails that arrived without a body, e.g. from a headers-only /api/emails
+    loader = _BodyLoader(service)
+    return [email if "body" in email else loader.add(email) for email in emails]
+
+
+class _PipelineError:
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+_PIPELINE_DONE = object()
+
+
+def _cached(email: dict, cache) -> dict:
+    if cache is not None:
+        cache.put_many([email])
+    return email
+
+
+def iter_unread_emails(
+    service,
+    max_results: int | None = 20,
+    fetch_workers: int = PIPELINE_FETCH_WORKERS,
+    parse_workers: int = PIPELINE_PARSE_WORKERS,
+    parse_mode: str = "thread",
+    chunk_size: int = PIPELINE_CHUNK_SIZE,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    cache=None,
+    max_bytes: int | None = None,
+    since: int | None = LIST_WINDOW,
+) -> Iterator[dict]:
+    """Yield parsed emails as soon as they are downloaded and parsed.
+
+    A pool of fetch workers downloads chunks of raw messages into a bounded queue,
+    and a thread or process pool (`parse_mode`) parses them. At most `queue_size`
+    raw messages wait in the queue and `queue_size` more are being parsed, so memory
+    stays capped no matter how many messages are listed. Emails are yielded in the
+    order their chunks finish downloading.
+
+    Every page of the listing is followed up to `max_results` (None for no limit),
+    and iteration stops before the downloaded raw messages would exceed `max_bytes`.
+    `since` is as for _iter_message_ids.
+    """
+    if parse_mode not in ("thread", "process"):
+        raise ValueError(f"Unknown parse_mode: {parse_mode}")
+
+    msg_ids = _list_message_ids(service, max_results, since)
+    if cache is not None:
+        cached = cache.get_many(msg_ids)
+        yield from (cached[msg_id] for msg_id in msg_ids if msg_id in cached)
+        msg_ids = [msg_id for msg_id in msg_ids if msg_id not in cached]
+    if not msg_ids:
+        return
+
+    raw_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def _put(item) -> None:
+        # Give up once the consumer has gone away so workers never block forever
+        while not stop.is_set():
+            try:
+                raw_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _download(chunk: list[str]) -> None:
+        if stop.is_set():
+            return
+        for item in _fetch_messages(service, chunk, http=_thread_http(service)):
+            _put(item)
+
+    def _produce() -> None:
+        with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool:
+            futures = [
+                fetch_pool.submit(_download, msg_ids[start : start + chunk_size])
+                for start in range(0, len(msg_ids), chunk_size)
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    _put(_PipelineError(e))
+                    stop.set()
+                    return
+        _put(_PIPELINE_DONE)
+
+    pool_cls = ProcessPoolExecutor if parse_mode == "process" else ThreadPoolExecutor
+    parse_pool = pool_cls(max_workers=parse_workers)
+    threading.Thread(target=_produce, daemon=True).start()
+
+    in_flight: deque = deque()
+    downloaded = 0
+    try:
+        while True:
+            item = raw_queue.get()
+            if item is _PIPELINE_DONE:
+                break
+            if isinstance(item, _PipelineError):
+                raise item.exception
+            downloaded += _response_size(item[1])
+            if max_bytes is not None and downloaded > max_bytes:
+                break
+            in_flight.append(parse_pool.submit(_parse_raw_message, *item))
+            while in_flight and (in_flight[0].done() or len(in_flight) >= queue_size):
+                yield _cached(in_flight.popleft().result(), cache)
+        while in_flight:
+            yield _cached(in_flight.popleft().result(), cache)
+    finally:
+        stop.set()
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_history_id(path: str = SYNC_STATE_PATH) -> str | None:
+    try:
+        with open(path) as f:
+            return json.load(f).get("historyId")
+    except FileNotFoundError:
+        return None
+
+
+def save_history_id(history_id: str, path: str = SYNC_STATE_PATH) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"historyId": history_id}, f)
+    os.replace(tmp_path, path)
+
+
+def _list_added_message_ids(service, start_history_id: str) -> tuple[list[str], str]:
+    msg_ids: list[str] = []
+    seen: set[str] = set()
+    page_token = None
+    while True:
+        with metrics.timer("gmail_history"):
+            response = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    labelId="INBOX",
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+        for record in response.get("history", []):
+            for added in record.get("messagesAdded", []):
+                message = added["message"]
+                labels = set(message.get("labelIds", []))
+                # CATEGORY_PERSONAL is the label behind the "category:primary" search
+                if {"UNREAD", "INBOX", "CATEGORY_PERSONAL"} <= labels and message["id"] not in seen:
+                    seen.add(message["id"])
+                    msg_ids.append(message["id"])
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return msg_ids, response["historyId"]
+
+
+def fetch_new_emails(
+    service,
+    history_id: str | None,
+    max_results: int = 20,
+    cache=None,
+    lazy_bodies: bool = False,
+) -> tuple[list[dict], str]:
+    """Fetch unread emails added since `history_id`, plus the history ID to resume from.
+
+    Without a history ID, or once Gmail has expired it (404), this falls back to the
+    same full listing as fetch_unread_emails. Callers should persist the returned ID
+    with save_history_id only after the emails have been handled.
+    """
+    msg_ids, new_history_id = list_new_message_ids(service, history_id, max_results)
+    if not msg_ids:
+        return [], new_history_id
+
+    return _fetch_emails(service, msg_ids, cache, lazy_bodies), new_history_id
+
+
+def list_new_message_ids(
+    service, history_id: str | None, max_results: int = 20
+) -> tuple[list[str], str]:
+    """IDs of unread emails added since `history_id`, plus the history ID to resume from.
+
+    Falls back to listing unread emails, like fetch_new_emails.
+    """
+    from googleapiclient.errors import HttpError
+
+    if history_id:
+        try:
+            return _list_added_message_ids(service, history_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+
+    # Read the profile before listing so mail arriving mid-listing is not skipped
+    new_history_id = service.users().getProfile(userId="me").execute()["historyId"]
+    return _list_message_ids(service, max_results), new_history_id
+
+
+def fetch_emails(service, msg_ids: list[str], cache=None, lazy_bodies: bool = False) -> list[dict]:
+    """Download the emails with these IDs, in order; IDs that no longer exist are skipped."""
+    if not msg_ids:
+        return []
+    return _fetch_emails(service, msg_ids, cache, lazy_bodies)
+
+
+def watch_mailbox(service, topic: str) -> dict:
+    """Ask Gmail to publish inbox changes to the Pub/Sub `topic` (users.watch).
+
+    Returns {"historyId", "expiration"}; the watch lapses after seven days unless
+    renewed by calling this again.
+    """
+    return (
         service.users()
-        .messages()
-        .list(
+        .watch(
             userId="me",
-            labelIds=["UNREAD", "INBOX"],
-            q=f"category:primary after:{twenty_four_hours_ago}",
-            maxResults=max_results,
+            body={"topicName": topic, "labelIds": ["INBOX"], "labelFilterBehavior": "INCLUDE"},
         )
         .execute()
     )
 
-    messages = response.get("messages", [])
-    if not messages:
-        return []
 
-    emails = []
-    for msg_ref in messages:
-        raw_msg = (
-            service.users()
-            .messages()
-            .get(
+def mark_as_read(service, emails: list[dict]) -> dict[str, str]:
+    """Remove UNREAD from `emails` and from every thread they belong to.
+
+    The messages are updated with one batchModify per MODIFY_BATCH_SIZE of them,
+    whose failure is raised. Thread updates go through the batch endpoint; threads
+    that still fail after retries are returned as {thread_id: error} rather than
+    raised.
+    """
+    msg_ids = [e["id"] for e in emails]
+    with metrics.timer("gmail_modify"):
+        for start in range(0, len(msg_ids), MODIFY_BATCH_SIZE):
+            service.users().messages().batchModify(
                 userId="me",
-                id=msg_ref["id"],
-                format="raw",
-            )
-            .execute()
+                body={
+                    "ids": msg_ids[start : start + MODIFY_BATCH_SIZE],
+                    "removeLabelIds": ["UNREAD"],
+                },
+            ).execute()
+
+        thread_ids = list(dict.fromkeys(e["threadId"] for e in emails if e.get("threadId")))
+        _, errors = _execute_batched(
+            service,
+            thread_ids,
+            lambda thread_id: (
+                service.users()
+                .threads()
+                .modify(userId="me", id=thread_id, body={"removeLabelIds": ["UNREAD"]})
+            ),
+            raise_errors=False,
         )
+    return {thread_id: str(error) for thread_id, error in errors.items()}
 
-        decoded = base64.urlsafe_b64decode(raw_msg["raw"])
-        mime_msg = message_from_bytes(decoded)
-
-        subject = _decode_header_value(mime_msg.get("Subject", "(No Subject)"))
-        sender = _decode_header_value(mime_msg.get("From", ""))
-        date = mime_msg.get("Date", "")
-        body = _extract_body(mime_msg)
-
-        # Truncate long bodies to keep Claude context reasonable
-        if len(body) > 2000:
-            body = body[:2000] + "..."
-
-        emails.append(
-            {
-                "id": msg_ref["id"],
-                "threadId": raw_msg.get("threadId", ""),
-                "subject": subject,
-                "from": sender,
-                "date": date,
-                "snippet": raw_msg.get("snippet", ""),
-                "body": body,
-            }
+
+class AsyncGmailClient:
+    """Async wrapper around the Gmail helpers above, created once per API process.
+
+    Calls run on a bounded thread pool. httplib2 connections are not thread-safe, so
+    each worker thread keeps its own service, all sharing one GmailAuth token.
+    """
+
+    def __init__(self, max_workers: int = ASYNC_GMAIL_WORKERS, auth: GmailAuth | None = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gmail")
+        self._local = threading.local()
+        self._auth = auth
+
+    def _service(self):
+        if self._auth is None:
+            self._auth = default_auth()
+        creds = self._auth.credentials()
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = build_service(creds)
+        return service
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: func(self._service(), *args, **kwargs)
         )
 
-    return emails
+    async def fetch_unread_emails(
+        self, max_results: int = 20, cache=None, lazy_bodies: bool = False
+    ) -> list[dict]:
+        return await self._run(
+            fetch_unread_emails, max_results, cache=cache, lazy_bodies=lazy_bodies
+        )
 
+    async def load_bodies(self, emails: list[dict]) -> list[dict]:
+        # Downloads any missing bodies on the pool, returning plain dicts, so that
+        # nothing touches the network from the event loop later
+        def _load(service) -> list[dict]:
+            return [dict(e, body=e["body"]) for e in attach_lazy_bodies(service, emails)]
 
-def mark_as_read(service, emails: list[dict]) -> None:
-    msg_ids = [e["id"] for e in emails]
-    service.users().messages().batchModify(
-        userId="me",
-        body={"ids": msg_ids, "removeLabelIds": ["UNREAD"]},
-    ).execute()
-
-    thread_ids = {e["threadId"] for e in emails if e.get("threadId")}
-    for thread_id in thread_ids:
-        service.users().threads().modify(
-            userId="me",
-            id=thread_id,
-            body={"removeLabelIds": ["UNREAD"]},
-        ).execute()
+        return await self._run(_load)
+
+    async def mark_as_read(self, emails: list[dict]) -> dict[str, str]:
+        return await self._run(mark_as_read, emails)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from gmail_client import fetch_unread_emails, get_gmail_service, mark_as_read
+from message_cache import open_message_cache
+from slack_notifier import SlackClient
+from summariser import summarise_emails
+from summary_cache import open_summary_cache
+
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30.0
+# A running job whose worker has not finished within this many seconds is
+# assumed dead and handed to another worker
+JOB_LEASE = 15 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Persistent queue of pipeline jobs in a SQLite file shared by API and workers.
+
+    Each job carries `checkpoints`, the output of every stage it has completed, so a
+    retried job resumes where it failed instead of re-sending to Slack.
+    """
+
+    def __init__(
+        self, path: str, max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY
+    ):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # Several worker processes write to the same file
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE, params TEXT NOT NULL, "
+                "status TEXT NOT NULL, stage TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "checkpoints TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT, "
+                "run_after REAL NOT NULL, lease_until REAL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after)")
+
+    def _row(self, job_id: str) -> dict | None:
+        cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([c[0] for c in cursor.description], row, strict=True))
+        for field in ("params", "checkpoints", "result"):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            return self._row(job_id)
+
+    def enqueue(self, params: dict, idempotency_key: str | None = None) -> dict:
+        """Add a job, or return the existing one enqueued with the same key."""
+        now = time.time()
+        with self._lock, self._conn:
+            if idempotency_key is not None:
+                existing = self._conn.execute(
+                    "SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if existing:
+                    return self._row(existing[0])
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, idempotency_key, params, status, run_after, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, idempotency_key, json.dumps(params), QUEUED, now, now, now),
+            )
+            return self._row(job_id)
+
+    def claim(self, lease: float = JOB_LEASE) -> dict | None:
+        """Take the oldest runnable job, including ones whose worker died mid-run.
+
+        A job whose lease ran out on its last attempt is failed instead, so one that
+        keeps killing its worker is not handed out forever.
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two workers can't claim one job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "Lease expired", now, RUNNING, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE (status = ? AND run_after <= ?) "
+                    "OR (status = ? AND lease_until < ?) ORDER BY run_after LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (RUNNING, now + lease, now, row[0]),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._row(row[0])
+
+    def checkpoint(self, job_id: str, stage: str, output) -> None:
+        with self._lock, self._conn:
+            checkpoints = self._row(job_id)["checkpoints"]
+            checkpoints[stage] = output
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, checkpoints = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(checkpoints), time.time(), job_id),
+            )
+
+    def succeed(self, job_id: str, result: dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (SUCCEEDED, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Requeue the job with exponential backoff, or fail it after max_attempts."""
+        now = time.time()
+        with self._lock, self._conn:
+            attempts = self._row(job_id)["attempts"]
+            if attempts >= self.max_attempts:
+                status, run_after = FAILED, now
+            else:
+                status, run_after = QUEUED, now + self.retry_delay * 2 ** (attempts - 1)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, run_after = ?, lease_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (status, error, run_after, now, job_id),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_job_queue() -> JobQueue | None:
+    path = os.environ.get("JOB_QUEUE")
+    if not path:
+        return None
+    return JobQueue(path)
+
+
+class Pipeline:
+    """Clients one worker process reuses for every job it runs."""
+
+    def __init__(self):
+        self.service = get_gmail_service()
+        self.slack = SlackClient()
+        self.message_cache = open_message_cache()
+        self.summary_cache = open_summary_cache()
+
+
+def run_job(queue: JobQueue, job: dict, pipeline: Pipeline) -> dict:
+    """Run fetch -> summarise -> Slack -> mark as read, skipping checkpointed stages."""
+    checkpoints = job["checkpoints"]
+    job_id = job["id"]
+
+    if "fetch" not in checkpoints:
+        emails = fetch_unread_emails(
+            pipeline.service,
+            max_results=job["params"].get("max_results", 20),
+            cache=pipeline.message_cache,
+        )
+        # Later stages work on this snapshot, not on whatever is unread at retry time
+        checkpoints["fetch"] = emails
+        queue.checkpoint(job_id, "fetch", emails)
+    emails = checkpoints["fetch"]
+
+    if "summarise" not in checkpoints:
+        summary = (
+            summarise_emails(emails, cache=pipeline.summary_cache) if emails else "Inbox is clear!"
+        )
+        checkpoints["summarise"] = summary
+        queue.checkpoint(job_id, "summarise", summary)
+
+    if "slack" not in checkpoints:
+        pipeline.slack.send(checkpoints["summarise"])
+        checkpoints["slack"] = True
+        queue.checkpoint(job_id, "slack", True)
+
+    failures = mark_as_read(pipeline.service, emails) if emails else {}
+    return {"count": len(emails), "mark_read_failures": sorted(failures)}
@@ -1,34 +1,275 @@
+import importlib
+import json
+import os
 import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from gmail_client import fetch_unread_emails, get_gmail_service, mark_as_read
-from slack_notifier import send_to_slack
-from summariser import summarise_emails
+import metrics
+from gmail_auth import GmailAuth
+from gmail_client import (
+    BACKLOG_MAX_BYTES,
+    BACKLOG_MAX_EMAILS,
+    fetch_new_emails,
+    fetch_unread_emails,
+    get_gmail_service,
+    iter_unread_emails,
+    load_history_id,
+    mark_as_read,
+    save_history_id,
+    transfer_stats,
+)
+from message_cache import open_message_cache
+from slack_notifier import SlackClient, send_to_slack
+from summariser import summarise_backlog, summarise_emails
+from summary_cache import open_summary_cache
 
 
-def main():
-    try:
-        service = get_gmail_service()
-        emails = fetch_unread_emails(service)
+class Account:
+    """One mailbox and the Slack user its summary is sent to.
+
+    Unset fields fall back to the GOOGLE_REFRESH_TOKEN, SLACK_TOKEN and SLACK_COOKIE
+    environment variables. `sync_state` does not: history IDs are per mailbox, so
+    only the single-account run() reads GMAIL_SYNC_STATE.
+    """
+
+    def __init__(
+        self,
+        name: str = "default",
+        google_refresh_token: str | None = None,
+        slack_token: str | None = None,
+        slack_cookie: str | None = None,
+        sync_state: str | None = None,
+    ):
+        self.name = name
+        self.google_refresh_token = google_refresh_token
+        self.slack_token = slack_token
+        self.slack_cookie = slack_cookie
+        self.sync_state = sync_state
+        self._auth: GmailAuth | None = None
+
+    @property
+    def auth(self) -> GmailAuth | None:
+        if self.google_refresh_token and self._auth is None:
+            self._auth = GmailAuth(refresh_token=self.google_refresh_token)
+        return self._auth
+
+
+class Shared:
+    """Clients and per-provider concurrency limits shared by every account in a process.
+
+    `limits` maps "gmail", "openai" and "slack" to the number of accounts that may
+    be in that provider's stage at once.
+    """
+
+    def __init__(self, limits: dict[str, int] | None = None):
+        from openai import OpenAI
 
-        if not emails:
-            send_to_slack("Inbox is clear!")
-            print("No unread emails found. Sent 'Inbox is clear!' to Slack.")
+        # Retries are left to request_executor
+        self.openai = OpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+        self.slack = SlackClient()
+        self.summary_cache = open_summary_cache()
+        self._limits = {
+            provider: threading.BoundedSemaphore(count)
+            for provider, count in (limits or {}).items()
+        }
+
+    @contextmanager
+    def limit(self, provider: str):
+        semaphore = self._limits.get(provider)
+        if semaphore is None:
+            yield
             return
+        with semaphore:
+            yield
+
+    def close(self) -> None:
+        self.slack.close()
+        self.openai.close()
+
+
+@contextmanager
+def _stage(timings: dict, name: str, shared: Shared | None, provider: str):
+    # Time spent waiting for a provider slot counts towards the stage
+    start = time.perf_counter()
+    with shared.limit(provider) if shared is not None else nullcontext():
+        yield
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _summarise_backlog(service, message_cache, summariser_options: dict) -> tuple[list[dict], str]:
+    # Summarises emails while they download; only IDs are kept, for marking as read.
+    # Bytes are counted for this run's service only, as fanout runs accounts at once
+    start_bytes = transfer_stats.bytes_for(service)
+    max_emails = int(os.environ.get("GMAIL_BACKLOG_MAX_EMAILS", BACKLOG_MAX_EMAILS))
+    max_bytes = int(os.environ.get("GMAIL_BACKLOG_MAX_BYTES", BACKLOG_MAX_BYTES))
+    refs: list[dict] = []
+    truncated = False
+
+    def _track(emails):
+        nonlocal truncated
+        for email in emails:
+            if len(refs) == max_emails:
+                # One more than the ceiling is listed only to tell whether any are left
+                truncated = True
+                return
+            refs.append({"id": email["id"], "threadId": email.get("threadId", "")})
+            yield email
+
+    emails = iter_unread_emails(
+        service, max_results=max_emails + 1, cache=message_cache, max_bytes=max_bytes, since=None
+    )
+    try:
+        summary = summarise_backlog(_track(emails), **summariser_options)
+    finally:
+        emails.close()
+    if truncated or transfer_stats.bytes_for(service) - start_bytes > max_bytes:
+        print(
+            f"Warning: backlog ceiling reached after {len(refs)} email(s); "
+            "the rest stay unread for the next run.",
+            file=sys.stderr,
+        )
+    return refs, summary
 
+
+def run(account: Account | None = None, shared: Shared | None = None) -> dict:
+    """Summarise one account's unread mail into a Slack DM.
+
+    Returns the number of emails and per-stage timings in seconds; raises on failure.
+    Without `shared`, clients are created for this run only.
+    """
+    account = account or Account(sync_state=os.environ.get("GMAIL_SYNC_STATE"))
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+    slack_options = {}
+    if account.slack_token:
+        slack_options = {"token": account.slack_token, "cookie": account.slack_cookie}
+    summariser_options = {}
+    if shared is not None:
+        slack_options["client"] = shared.slack
+        summariser_options = {"client": shared.openai}
+
+    summary = None
+    with _stage(timings, "fetch", shared, "gmail"):
+        service = get_gmail_service(account.auth)
+        start_bytes = transfer_stats.bytes_for(service)
+        # Message IDs are per mailbox, so the message cache is only used for one account
+        message_cache = open_message_cache() if shared is None else None
+        # "metadata" fetches headers first and only the text part of each body
+        lazy_bodies = os.environ.get("GMAIL_FETCH_MODE") == "metadata"
+        # Incremental sync is opt-in because the state file must survive between runs
+        sync_state_path = account.sync_state
+        # Backlog mode catches up on every unread email, not just the last 24 hours
+        backlog = not sync_state_path and os.environ.get("GMAIL_BACKLOG") == "1"
+        if sync_state_path:
+            emails, history_id = fetch_new_emails(
+                service,
+                load_history_id(sync_state_path),
+                cache=message_cache,
+                lazy_bodies=lazy_bodies,
+            )
+        elif not backlog:
+            emails = fetch_unread_emails(
+                service,
+                max_results=int(os.environ.get("GMAIL_MAX_RESULTS", 20)),
+                cache=message_cache,
+                lazy_bodies=lazy_bodies,
+            )
+    if backlog:
+        # Downloading overlaps with summarising, so both count towards "summarise"
+        with _stage(timings, "summarise", shared, "openai"):
+            emails, summary = _summarise_backlog(service, message_cache, summariser_options)
+    if message_cache is not None:
+        stats = message_cache.stats()
+        print(f"Message cache: {stats['hits']} hit(s), {stats['misses']} miss(es)")
+
+    if not emails and sync_state_path:
+        # Frequent incremental runs would otherwise DM "Inbox is clear!" every time
+        save_history_id(history_id, sync_state_path)
+        print("No new emails since last sync.")
+    elif not emails:
+        with _stage(timings, "slack", shared, "slack"):
+            send_to_slack("Inbox is clear!", **slack_options)
+        print("No unread emails found. Sent 'Inbox is clear!' to Slack.")
+    else:
         print(f"Found {len(emails)} unread email(s). Summarising...")
-        summary = summarise_emails(emails)
+        if summary is None:
+            with _stage(timings, "summarise", shared, "openai"):
+                summary_cache = open_summary_cache() if shared is None else shared.summary_cache
+                summary = summarise_emails(emails, cache=summary_cache, **summariser_options)
+
+        downloaded = transfer_stats.bytes_for(service) - start_bytes
+        print(f"Downloaded {downloaded} bytes from Gmail.")
+
+        with _stage(timings, "slack", shared, "slack"):
+            send_to_slack(summary, **slack_options)
+        with _stage(timings, "mark_read", shared, "gmail"):
+            failures = mark_as_read(service, emails)
+        if failures:
+            print(f"Warning: could not mark {len(failures)} thread(s) as read.", file=sys.stderr)
+        if sync_state_path:
+            save_history_id(history_id, sync_state_path)
+
+    timings["total"] = time.perf_counter() - start
+    return {"emails": len(emails), "timings": timings}
+
+
+# Imported on a background thread by main() while Gmail auth and the fetch wait on
+# the network; the modules importing them defer it until first use
+PRELOAD_MODULES = ("openai", "requests")
 
-        send_to_slack(summary)
-        mark_as_read(service, emails)
 
+def preload(modules=PRELOAD_MODULES) -> threading.Thread:
+    """Import `modules` on a daemon thread and return it.
+
+    Importing a module another thread is already importing waits for it, so a
+    stage that needs one before it is loaded just blocks until it is.
+    """
+
+    def _import():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                # Raised again, where it can be handled, by the stage that needs it
+                pass
+
+    thread = threading.Thread(target=_import, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def write_timing_report(path: str, result: dict | None) -> None:
+    """Write run() timings plus the metrics counters and stage timers as JSON."""
+    report = {"ok": result is not None, **(result or {}), **metrics.registry.report()}
+    if path == "-":
+        print(json.dumps(report, indent=2))
+        return
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def main():
+    # TIMING_REPORT is a file path, or "-" for stdout; it also turns metrics on
+    report_path = os.environ.get("TIMING_REPORT")
+    if report_path:
+        metrics.registry.enabled = True
+    result = None
+    preload()
+    try:
+        result = run()
         print("Done.")
     except Exception:
         print("Error: summariser failed", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if report_path:
+            write_timing_report(report_path, result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+# SQLite caps the number of bound parameters per statement
+_QUERY_CHUNK = 500
+
+
+class MessageCache:
+    """Persistent store of parsed email dicts keyed by Gmail message ID.
+
+    Entries older than `max_age` seconds are ignored and evicted, and only the
+    `max_entries` most recently stored messages are kept.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS messages_stored_at ON messages (stored_at)"
+            )
+
+    def get_many(self, msg_ids: list[str]) -> dict[str, dict]:
+        cutoff = time.time() - self.max_age
+        found: dict[str, dict] = {}
+        with self._lock:
+            for start in range(0, len(msg_ids), _QUERY_CHUNK):
+                chunk = msg_ids[start : start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM messages WHERE id IN ({placeholders}) "
+                    "AND stored_at >= ?",
+                    (*chunk, cutoff),
+                )
+                for msg_id, data in rows:
+                    found[msg_id] = json.loads(data)
+            self.hits += len(found)
+            self.misses += len(set(msg_ids)) - len(found)
+        metrics.inc("cache_hits_total", len(found), cache="message")
+        metrics.inc("cache_misses_total", len(set(msg_ids)) - len(found), cache="message")
+        return found
+
+    def put_many(self, emails: list[dict]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, data, stored_at) VALUES (?, ?, ?)",
+                [(e["id"], json.dumps(e), now) for e in emails],
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM messages WHERE stored_at < ?", (now - self.max_age,))
+        self._conn.execute(
+            "DELETE FROM messages WHERE id NOT IN "
+            "(SELECT id FROM messages ORDER BY stored_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_message_cache() -> MessageCache | None:
+    path = os.environ.get("GMAIL_MESSAGE_CACHE")
+    if not path:
+        return None
+    return MessageCache(path)
@@ -0,0 +1,150 @@
+import bisect
+import math
+import os
+import threading
+import time
+
+# Histogram buckets for stage durations, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "email_summariser_"
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_registry", "_key", "_start")
+
+    def __init__(self, registry: "Registry", key: tuple):
+        self._registry = registry
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry._observe(self._key, time.perf_counter() - self._start)
+        return False
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+class Registry:
+    """Process-wide counters and stage timers.
+
+    While disabled, `timer` returns a shared no-op context manager and `inc` returns
+    immediately, so instrumented code pays one attribute check per call.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: dict[tuple, float] = {}
+        # key -> [count, sum, per-bucket counts]
+        self._timers: dict[tuple, list] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, stage: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key("stage_seconds", {"stage": stage}))
+
+    def observe(self, stage: str, seconds: float) -> None:
+        # For stages a `with` block can't wrap, e.g. a stream consumed by a generator
+        if self.enabled:
+            self._observe(_key("stage_seconds", {"stage": stage}), seconds)
+
+    def _observe(self, key: tuple, seconds: float) -> None:
+        with self._lock:
+            entry = self._timers.get(key)
+            if entry is None:
+                entry = self._timers[key] = [0, 0.0, [0] * len(BUCKETS)]
+            entry[0] += 1
+            entry[1] += seconds
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                entry[2][index] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def report(self) -> dict:
+        """Counters and per-stage call counts and total seconds, for JSON output."""
+        with self._lock:
+            counters = {_name(key): value for key, value in sorted(self._counters.items())}
+            stages = {
+                dict(labels)["stage"]: {"count": count, "seconds": round(total, 6)}
+                for (_, labels), (count, total, _) in sorted(self._timers.items())
+            }
+        return {"counters": counters, "stages": stages}
+
+    def prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {_number(value)}")
+            if self._timers:
+                lines.append(f"# TYPE {PREFIX}stage_seconds histogram")
+            for (name, labels), (count, total, buckets) in sorted(self._timers.items()):
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, buckets, strict=True):
+                    cumulative += bucket
+                    le = (*labels, ("le", _number(bound)))
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(le)} {cumulative}")
+                le = (*labels, ("le", "+Inf"))
+                lines.append(f"{PREFIX}{name}_bucket{_labels(le)} {count}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _name(key: tuple) -> str:
+    name, labels = key
+    return name + _labels(labels)
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and math.isfinite(value) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# METRICS=1 turns instrumentation on for any entry point; the API enables it itself
+registry = Registry(enabled=os.environ.get("METRICS") == "1")
+inc = registry.inc
+timer = registry.timer
+observe = registry.observe
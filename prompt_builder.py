@@ -0,0 +1,162 @@
+import math
+import os
+import re
+import threading
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Input tokens shared by all email bodies in one summarisation run
+INPUT_TOKEN_BUDGET = 60000
+# Every email keeps at least this much body, however low its weight
+MIN_BODY_TOKENS = 30
+TOKENIZER_ENCODING = "o200k_base"
+
+_REPLY_HEADER_RE = re.compile(
+    r"^(On .{1,200}\n?.{0,200} wrote:|-----\s*Original Message\s*-----|From: .+\nSent: .+)$",
+    re.MULTILINE,
+)
+_SIGNATURE_RE = re.compile(r"^(-- ?|Sent from my \w+.*|Get Outlook for \w+.*)$", re.MULTILINE)
+_URL_RE = re.compile(r"https?://[^\s<>\"')\]]+")
+_TRACKING_PARAM_RE = re.compile(
+    r"^(utm_\w+|mc_[ce]id|fbclid|gclid|trk\w*|notification_referrer_id|ref_src|_hs\w+)$"
+)
+_LONG_URL = 120
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    # tiktoken downloads its vocabulary on first use; without it (not installed,
+    # offline), fall back to a character-based estimate
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception:
+                _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens]) + "..."
+    if len(text) <= max_tokens * 4:
+        return text
+    return text[: max_tokens * 4] + "..."
+
+
+def _clean_url(match: re.Match) -> str:
+    url = match.group(0)
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    kept = [(k, v) for k, v in params if not _TRACKING_PARAM_RE.match(k)]
+    if len(kept) != len(params):
+        url = urlunsplit(parts._replace(query=urlencode(kept)))
+    if len(url) > _LONG_URL:
+        # Click-tracking redirects: the host is the only readable part
+        return f"{parts.scheme}://{parts.netloc}/..."
+    return url
+
+
+def clean_body(body: str) -> str:
+    """Drop quoted reply chains, signatures and tracking noise from an email body."""
+    body = body.replace("\r\n", "\n")
+    # Only cut when something is left, e.g. not for a forwarded message with no note
+    for pattern in (_REPLY_HEADER_RE, _SIGNATURE_RE):
+        match = pattern.search(body)
+        if match and body[: match.start()].strip():
+            body = body[: match.start()]
+    body = "\n".join(line for line in body.split("\n") if not line.startswith(">"))
+    body = _URL_RE.sub(_clean_url, body)
+    return _BLANK_LINES_RE.sub("\n\n", body).strip()
+
+
+def important_senders() -> list[str]:
+    value = os.environ.get("IMPORTANT_SENDERS", "")
+    return [s.strip().lower() for s in value.split(",") if s.strip()]
+
+
+def email_weight(email: dict, now: datetime, important: list[str]) -> float:
+    # Newer mail and mail from important senders gets a larger share of the budget
+    weight = 1.0
+    try:
+        age_hours = (now - parsedate_to_datetime(email.get("date", ""))).total_seconds() / 3600
+        weight *= 0.5 + math.exp(-max(age_hours, 0) / 24)
+    except (TypeError, ValueError):
+        pass
+    sender = email.get("from", "").lower()
+    if any(s in sender for s in important):
+        weight *= 3
+    elif "noreply" in sender or "no-reply" in sender or "notifications@" in sender:
+        weight *= 0.5
+    return weight
+
+
+def allocate(needs: list[int], weights: list[float], budget: int) -> list[int]:
+    """Split `budget` in proportion to `weights`, capping each share at its need.
+
+    Whatever a capped email does not use is redistributed among the rest.
+    """
+    allocation = [0] * len(needs)
+    pending = {i for i, need in enumerate(needs) if need > 0}
+    remaining = budget
+    while pending:
+        total_weight = sum(weights[i] for i in pending)
+        shares = {i: remaining * weights[i] / total_weight for i in pending}
+        capped = {i for i in pending if needs[i] <= shares[i]}
+        if not capped:
+            for i in pending:
+                allocation[i] = int(shares[i])
+            break
+        for i in capped:
+            allocation[i] = needs[i]
+            remaining -= needs[i]
+        pending -= capped
+    return [max(a, min(MIN_BODY_TOKENS, need)) for a, need in zip(allocation, needs, strict=True)]
+
+
+def fit_emails(
+    emails: list[dict], budget: int = INPUT_TOKEN_BUDGET, now: datetime | None = None
+) -> list[dict]:
+    """Return copies of `emails` with cleaned bodies trimmed to fit `budget` tokens in total."""
+    now = now or datetime.now(UTC)
+    important = important_senders()
+    bodies = [clean_body(e["body"]) for e in emails]
+    needs = [count_tokens(body) for body in bodies]
+    weights = [email_weight(e, now, important) for e in emails]
+    shares = allocate(needs, weights, budget)
+    return [
+        {**e, "body": body if need <= share else truncate_to_tokens(body, share)}
+        for e, body, need, share in zip(emails, bodies, needs, shares, strict=True)
+    ]
+
+
+def format_email(i: int, e: dict) -> str:
+    return (
+        f"--- Email {i} ---\n"
+        f"From: {e['from']}\n"
+        f"Subject: {e['subject']}\n"
+        f"Date: {e['date']}\n"
+        f"Body:\n{e['body']}\n\n"
+    )
+
+
+def build_prompt(header: str, blocks: list[str]) -> str:
+    return header + "".join(blocks)
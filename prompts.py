@@ -22,3 +22,39 @@ SUMMARISE_SYSTEM = (
     "- List anything that needs follow-up.\n\n"
     "Keep it short and scannable. Don't repeat email content verbatim."
 )
+
+MAP_SYSTEM = (
+    "You are an email assistant. You are given one batch of emails from a larger inbox. "
+    "Another step will merge your notes with notes on the other batches into a daily "
+    "briefing, so do not write a title or a final summary.\n\n"
+    "For each email write one line: sender's first name, what happened, and any link "
+    "as Slack mrkdwn <url|text>. For GitHub notifications start the line with org/repo "
+    'and the PR or issue number and title, e.g. org/repo PR #123 "title".\n\n'
+    "Then list anything that needs follow-up under 'Action items:'.\n\n"
+    "Be terse. Keep every fact needed to write the briefing and drop everything else."
+)
+
+REDUCE_PREAMBLE = (
+    "The {count} unread emails were too many for one pass, so they were summarised "
+    "in batches. Merge the batch notes below into a single briefing, combining "
+    "updates to the same repo or thread.\n\n"
+)
+
+# Bump whenever DIGEST_SYSTEM changes so cached digests are not reused
+DIGEST_PROMPT_VERSION = 1
+
+DIGEST_SYSTEM = (
+    "You are an email assistant. For each email you are given, write a one-line digest "
+    "that another step will use to write a daily briefing without seeing the email.\n\n"
+    "Each digest must keep: who (first name) did what, any deadline or request for the "
+    "reader, and the single most useful link as Slack mrkdwn <url|text>. For GitHub "
+    "notifications start with org/repo and the PR or issue number and title, e.g. org/repo "
+    'PR #123 "title".\n\n'
+    'Reply with JSON only: {"digests": [{"email": <email number>, "digest": "<one line>"}]} '
+    "with one entry per email."
+)
+
+DIGEST_PREAMBLE = (
+    "Below is a one-line digest of each of the {count} unread emails. Write the briefing "
+    "from these digests, combining updates to the same repo or thread.\n\n"
+)
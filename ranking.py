@@ -0,0 +1,273 @@
+import json
+import math
+import os
+import re
+import string
+import threading
+import zlib
+from collections import Counter, defaultdict
+from itertools import count
+
+import numpy as np
+
+import metrics
+from collapse import sender_address
+from prompt_builder import important_senders
+
+# Emails scoring below RANK_THRESHOLD are counted rather than summarised, but the
+# RANK_MIN_KEEP best-scoring emails are always summarised
+RANK_THRESHOLD = 0.3
+RANK_MIN_KEEP = 5
+
+# Subject and snippet words are hashed into TERM_BUCKETS learned weights
+TERM_BUCKETS = 4096
+# Per-sender open counts kept in the model, most recently seen first
+MAX_SENDERS = 10000
+
+LEARNING_RATE = 0.5
+LEARNING_EPOCHS = 20
+L2_PENALTY = 0.01
+
+FEATURES = (
+    "sender_open_rate",
+    "sender_familiarity",
+    "thread_length",
+    "bulk",
+    "automated",
+    "important_sender",
+    "keywords",
+    "distinctiveness",
+)
+# Starting weights, before anything has been learned: bulk and automated mail scores
+# low, and a known sender, a conversation or an urgent subject scores high
+PRIOR_WEIGHTS = (1.0, 0.0, 0.8, -2.0, -1.0, 3.0, 0.7, 0.5)
+PRIOR_BIAS = 0.5
+
+_AUTOMATED_RE = re.compile(r"no-?reply|notifications?@|mailer-daemon|bounces?@")
+KEYWORDS = frozenset(
+    b"urgent asap required deadline due overdue invoice payment contract interview offer "
+    b"approval approve sign today tomorrow reminder question help".split()
+)
+# Digits and punctuation separate words, so ids and run numbers are not words. NUL,
+# joining one email's text to the next, becomes b"0", which no word can then contain
+_SEPARATORS = (string.punctuation + string.digits).encode()
+_TABLE = bytes.maketrans(b"\x00" + _SEPARATORS, b"0" + b" " * len(_SEPARATORS))
+
+
+def _terms(emails: list[dict]) -> tuple[np.ndarray, np.ndarray, list[bytes]]:
+    # (email index, word id) for every distinct word of every email, and the words.
+    # Subjects and snippets only, as a LazyEmail's body would be downloaded; they
+    # are split in one pass, as UTF-8 bytes, which is much faster than per email.
+    # A NUL inside a header would start an extra email, so it is blanked first
+    text = " \x00 ".join(
+        f"{e.get('subject', '')} {e.get('snippet', '')}".replace("\x00", " ") for e in emails
+    )
+    tokens = text.lower().encode().translate(_TABLE).split()
+    vocabulary: defaultdict[bytes, int] = defaultdict(count().__next__)
+    vocabulary[b"0"]  # noqa: B018 - the separator is word 0
+    ids = np.fromiter(map(vocabulary.__getitem__, tokens), np.int64, len(tokens))
+    separators = ids == 0
+    docs = np.cumsum(separators)[~separators]
+    # Each word counts once per email; sorting and comparing neighbours is faster
+    # than np.unique here
+    pairs = np.sort(docs * len(vocabulary) + ids[~separators])
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))] if len(pairs) else pairs
+    return pairs // len(vocabulary), pairs % len(vocabulary), list(vocabulary)
+
+
+class Ranker:
+    """Scores how much each email in a batch deserves the reader's attention.
+
+    A logistic model over features computed for the whole batch at once: how often
+    the reader has opened mail from the sender, thread length within the batch,
+    List-Unsubscribe/bulk headers (see gmail_client), automated and
+    IMPORTANT_SENDERS senders, urgent keywords, how rare the subject's words are
+    in the batch (IDF), and learned weights for those words (TF-IDF). `learn`
+    updates the model from the emails the reader opened; with `path`, the model is
+    loaded from and saved to that JSON file.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.weights = np.array(PRIOR_WEIGHTS, dtype=np.float64)
+        self.bias = PRIOR_BIAS
+        self.term_weights = np.zeros(TERM_BUCKETS, dtype=np.float64)
+        # Sender address -> [emails seen, emails opened], most recently seen last
+        self.senders: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path: str) -> None:
+        # A file that can't be read, or was saved with different features, leaves the
+        # priors in place
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("features") != list(FEATURES):
+                return
+            weights = np.array(state["weights"], dtype=np.float64)
+            term_weights = np.array(state["term_weights"], dtype=np.float64)
+            senders = {sender: list(counts) for sender, counts in state["senders"].items()}
+            bias = float(state["bias"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return
+        if weights.shape == (len(FEATURES),) and term_weights.shape == (TERM_BUCKETS,):
+            self.weights, self.term_weights = weights, term_weights
+            self.senders, self.bias = senders, bias
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            state = {
+                "features": list(FEATURES),
+                "weights": self.weights.tolist(),
+                "bias": self.bias,
+                "term_weights": self.term_weights.tolist(),
+                "senders": self.senders,
+            }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _features(self, emails: list[dict]) -> tuple[np.ndarray, tuple]:
+        size = len(emails)
+        # Per-sender work is done once for each distinct From header
+        froms: defaultdict[str, int] = defaultdict(count().__next__)
+        from_ids = np.fromiter((froms[e.get("from", "")] for e in emails), np.int64, size)
+        addresses = [sender_address(value) for value in froms]
+        important = important_senders()
+        history = np.array(
+            [self.senders.get(address, (0, 0)) for address in addresses], dtype=np.float64
+        ).reshape(len(addresses), 2)[from_ids]
+        seen, opened = history[:, 0], history[:, 1]
+        automated = np.array([bool(_AUTOMATED_RE.search(a)) for a in addresses])[from_ids]
+        vip = np.array([any(s in value.lower() for s in important) for value in froms])
+
+        threads: defaultdict[str, int] = defaultdict(count().__next__)
+        thread_ids = np.fromiter(
+            (threads[e.get("threadId") or e.get("id") or str(i)] for i, e in enumerate(emails)),
+            np.int64,
+            size,
+        )
+        thread_sizes = np.bincount(thread_ids)[thread_ids]
+
+        docs, words, vocabulary = _terms(emails)
+        keywords = np.array([word in KEYWORDS for word in vocabulary], dtype=np.float64)
+        # Inverse document frequency of each word within this batch, and each email's
+        # mean over its words, scaled to [0, 1)
+        idf = np.log((1 + size) / (1 + np.bincount(words, minlength=len(vocabulary))))
+        word_counts = np.maximum(np.bincount(docs, minlength=size), 1)
+        distinctiveness = np.bincount(docs, weights=idf[words], minlength=size) / word_counts
+        distinctiveness /= max(math.log(1 + size), 1.0)
+
+        features = np.column_stack(
+            [
+                np.log((opened + 1) / (seen - opened + 1)),
+                np.log1p(seen),
+                np.log(thread_sizes),
+                np.fromiter((bool(e.get("bulk")) for e in emails), bool, size),
+                automated,
+                vip[from_ids] if len(vip) else np.zeros(size, dtype=bool),
+                np.minimum(np.bincount(docs, weights=keywords[words], minlength=size), 3),
+                distinctiveness,
+            ]
+        ).astype(np.float64)
+        # TF-IDF of each (email, word) pair, with each email's vector of unit length.
+        # crc32 rather than hash(), so learned weights survive a restart
+        buckets = np.fromiter(
+            (zlib.crc32(word) % TERM_BUCKETS for word in vocabulary),
+            np.int64,
+            len(vocabulary),
+        )
+        tfidf = idf[words] + 1.0
+        norms = np.sqrt(np.bincount(docs, weights=tfidf**2, minlength=size))
+        tfidf /= np.maximum(norms[docs], 1e-12)
+        senders = [addresses[i] for i in from_ids]
+        return features, (docs, buckets[words], tfidf, senders)
+
+    def _logits(self, features: np.ndarray, terms: tuple) -> np.ndarray:
+        docs, buckets, tfidf, _ = terms
+        term_scores = np.bincount(
+            docs, weights=tfidf * self.term_weights[buckets], minlength=len(features)
+        )
+        return features @ self.weights + term_scores + self.bias
+
+    def score(self, emails: list[dict]) -> np.ndarray:
+        """Return each email's score between 0 and 1."""
+        if not emails:
+            return np.zeros(0)
+        with metrics.timer("rank"), self._lock:
+            features, terms = self._features(emails)
+            return 1 / (1 + np.exp(-self._logits(features, terms)))
+
+    def learn(self, emails: list[dict], opened: set[str]) -> None:
+        """Update the model with which of `emails` (by "id") the reader opened."""
+        if not emails:
+            return
+        labels = np.array([e.get("id") in opened for e in emails], dtype=np.float64)
+        with self._lock:
+            features, terms = self._features(emails)
+            docs, buckets, tfidf, senders = terms
+            # A few steps of gradient descent on the logistic loss, from where the
+            # model left off
+            for _ in range(LEARNING_EPOCHS):
+                errors = 1 / (1 + np.exp(-self._logits(features, terms))) - labels
+                step = LEARNING_RATE / len(emails)
+                self.weights -= step * (features.T @ errors + L2_PENALTY * self.weights)
+                self.bias -= step * errors.sum()
+                term_gradient = np.bincount(
+                    buckets, weights=errors[docs] * tfidf, minlength=TERM_BUCKETS
+                )
+                self.term_weights -= step * (term_gradient + L2_PENALTY * self.term_weights)
+            for sender, label in zip(senders, labels, strict=True):
+                counts = self.senders.pop(sender, [0, 0])
+                self.senders[sender] = [counts[0] + 1, counts[1] + int(label)]
+            while len(self.senders) > MAX_SENDERS:
+                del self.senders[next(iter(self.senders))]
+
+
+def rank_emails(
+    emails: list[dict],
+    ranker: Ranker,
+    threshold: float = RANK_THRESHOLD,
+    min_keep: int = RANK_MIN_KEEP,
+) -> tuple[list[dict], list[dict]]:
+    """Split emails into those worth summarising and low-priority ones, keeping order."""
+    if len(emails) <= min_keep:
+        return emails, []
+    scores = ranker.score(emails)
+    keep = scores >= threshold
+    # The min_keep best emails are kept even when every score is low
+    keep[np.argsort(-scores, kind="stable")[:min_keep]] = True
+    return (
+        [e for e, kept in zip(emails, keep, strict=True) if kept],
+        [e for e, kept in zip(emails, keep, strict=True) if not kept],
+    )
+
+
+def low_priority_note(skipped: list[dict], senders: int = 5) -> str:
+    """One line telling the model how many emails were left out, and from whom."""
+    if not skipped:
+        return ""
+    counts = Counter(sender_address(e.get("from", "")) or "unknown sender" for e in skipped)
+    top = ", ".join(f"{sender} ({n})" for sender, n in counts.most_common(senders))
+    return (
+        f"\n\nNot included above: {len(skipped)} low-priority email(s) such as newsletters "
+        f"and notifications, mostly from {top}. Mention them in one line at the end.\n"
+    )
+
+
+_ranker: Ranker | None = None
+_ranker_lock = threading.Lock()
+
+
+def get_ranker() -> Ranker:
+    """The process's ranker, loaded from RANKING_STATE when that is set."""
+    global _ranker
+    with _ranker_lock:
+        if _ranker is None:
+            _ranker = Ranker(os.environ.get("RANKING_STATE") or None)
+        return _ranker
@@ -0,0 +1,396 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+import metrics
+
+# Seconds a call may take, across all its attempts, retries and hedges
+OPENAI_DEADLINE = 120.0
+# Further attempts after a 429, a 5xx, a timeout or a connection error
+OPENAI_RETRIES = 3
+# Full jitter: each retry waits a random time up to RETRY_BASE_DELAY * 2**attempt,
+# capped at RETRY_MAX_DELAY, unless the API sent Retry-After
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# An attempt slower than this percentile of the stage's recent latencies gets a
+# duplicate, and the first of the two to answer wins. Until HEDGE_MIN_SAMPLES
+# latencies are known, nothing is hedged
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_SAMPLES = 100
+# Never hedge sooner than this, so a fast stage isn't sent twice for small jitter
+HEDGE_MIN_DELAY = 1.0
+# Threads running hedged sync attempts; each hedged call uses up to two
+HEDGE_WORKERS = 16
+
+# After BREAKER_THRESHOLD failed calls in a row, a model is skipped for
+# BREAKER_COOLDOWN seconds and FALLBACK_MODEL answers instead
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60.0
+FALLBACK_MODEL = "gpt-4.1-nano"
+# The fallback gets one attempt with its own, shorter deadline
+FALLBACK_DEADLINE = 30.0
+
+
+class ModelUnavailable(Exception):
+    """Neither the model nor its fallback answered, or their circuit breakers are open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a model after `threshold` failures in a row.
+
+    While open, `allow` returns False for `cooldown` seconds. Then one trial call
+    is let through: its success closes the breaker and its failure reopens it.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN,
+        clock=time.monotonic,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._clock() - self._opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+    def allow(self) -> str | None:
+        """The state a call was let through in, "closed" or "half_open" for the trial
+        call; None if it is rejected."""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or self._clock() - self._opened_at < self.cooldown:
+                return None
+            self._trial = True
+            return "half_open"
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures, self._opened_at, self._trial = 0, None, False
+
+    def release(self) -> None:
+        """Give back the trial, when the call `allow` let through as it ended without
+        an answer either way, e.g. was cancelled."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self) -> bool:
+        """Count a failed call; True if it opened the breaker."""
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.threshold):
+                self._opened_at, self._trial = self._clock(), False
+                return True
+            return False
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """A 429 or 5xx from the API, or a timeout or connection error on the way to it."""
+    status = getattr(exception, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(exception, TimeoutError | ConnectionError):
+        return True
+    from openai import APIConnectionError
+
+    # Includes APITimeoutError
+    return isinstance(exception, APIConnectionError)
+
+
+def _retry_delay(exception: BaseException, attempt: int) -> float:
+    response = getattr(exception, "response", None)
+    try:
+        return min(float(response.headers["retry-after"]), RETRY_MAX_DELAY)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+def _create(client, request: dict, timeout: float):
+    # A response, or for an AsyncOpenAI client a coroutine
+    return client.chat.completions.create(**request, timeout=timeout)
+
+
+class RequestExecutor:
+    """Runs chat.completions.create calls within a deadline.
+
+    Each call has `deadline` seconds for all its attempts; every attempt passes
+    the time left as the request timeout. An attempt still running after
+    `hedge_delay` seconds (by default `hedge_percentile` of the stage's recent
+    latencies) gets a duplicate, and the first to answer wins. Async losers are
+    cancelled; sync losers can't be, and are left to finish or time out on a
+    worker thread. 429s, 5xx, timeouts and connection errors are retried up to
+    `retries` times with jittered backoff.
+
+    Each model has a CircuitBreaker. A call that still fails, or whose model's
+    breaker is open, is sent once to `fallback_model`; if that fails too,
+    ModelUnavailable is raised. Other errors, such as a 400, are raised at once.
+    Thread-safe; one executor is shared by every call in the process.
+    """
+
+    def __init__(
+        self,
+        deadline: float = OPENAI_DEADLINE,
+        retries: int = OPENAI_RETRIES,
+        hedge_delay: float | None = None,
+        hedge_percentile: float | None = HEDGE_PERCENTILE,
+        hedge_min_delay: float = HEDGE_MIN_DELAY,
+        fallback_model: str | None = FALLBACK_MODEL,
+        fallback_deadline: float = FALLBACK_DEADLINE,
+        breaker_threshold: int = BREAKER_THRESHOLD,
+        breaker_cooldown: float = BREAKER_COOLDOWN,
+    ):
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.fallback_model = fallback_model
+        self.fallback_deadline = fallback_deadline
+        self._breaker_threshold = breaker_threshold
+        self._breaker_cooldown = breaker_cooldown
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: dict[str, deque[float]] = {}
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(
+                    self._breaker_threshold, self._breaker_cooldown
+                )
+            return self._breakers[model]
+
+    def hedge_after(self, stage: str) -> float | None:
+        """Seconds before an attempt at `stage` is hedged; None if it isn't."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(stage, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(samples[int(self.hedge_percentile * (len(samples) - 1))], self.hedge_min_delay)
+
+    def _record_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=HEDGE_SAMPLES)).append(seconds)
+
+    def _plans(self, model: str):
+        # (model, deadline, retries, hedged, trial): the model, then its fallback, each
+        # only if its breaker lets the call through, and whether that was the breaker's
+        # half-open trial. A generator, so the fallback's breaker is only asked (and a
+        # trial only taken) when the model failed
+        plans = [(model, self.deadline, self.retries, True)]
+        if self.fallback_model and self.fallback_model != model:
+            plans.append((self.fallback_model, self.fallback_deadline, 0, False))
+        for plan in plans:
+            allowed = self.breaker(plan[0]).allow()
+            if allowed:
+                yield (*plan, allowed == "half_open")
+            else:
+                metrics.inc("openai_breaker_rejections_total", model=plan[0])
+
+    def _succeeded(self, model: str, requested: str) -> None:
+        self.breaker(model).success()
+        if model != requested:
+            metrics.inc("openai_fallbacks_total", kind="model")
+
+    def _failed(self, model: str) -> None:
+        if self.breaker(model).failure():
+            metrics.inc("openai_breaker_opened_total", model=model)
+
+    def _gave_up(self, stage: str, end: float, delay: float = 0.0) -> bool:
+        if time.monotonic() + delay < end:
+            return False
+        metrics.inc("openai_deadline_exceeded_total", stage=stage)
+        return True
+
+    def complete(self, client, stage: str = "briefing", hedge: bool = True, **request):
+        """client.chat.completions.create(**request), with the policies above.
+
+        Pass hedge=False for streams, whose sync losers would keep generating.
+        """
+        error: BaseException | None = None
+        for model, deadline, retries, hedged, trial in self._plans(request["model"]):
+            attempt = partial(_create, client, {**request, "model": model})
+
+            try:
+                response = self._retry(attempt, stage, deadline, retries, hedge and hedged)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The model answered, if only to refuse the request
+                    self.breaker(model).success()
+                    raise
+                self._failed(model)
+                error = e
+                continue
+            except BaseException:
+                # Cancelled or interrupted: a half-open trial must not stay taken
+                if trial:
+                    self.breaker(model).release()
+                raise
+            self._succeeded(model, request["model"])
+            return response
+        raise ModelUnavailable(f"no model answered the {stage} call") from error
+
+    def _retry(self, attempt, stage: str, deadline: float, retries: int, hedged: bool):
+        end = time.monotonic() + deadline
+        for number in range(retries + 1):
+            try:
+                return self._attempt(attempt, stage, end, hedged)
+            except Exception as e:
+                delay = _retry_delay(e, number)
+                if not is_retryable(e) or number == retries or self._gave_up(stage, end, delay):
+                    raise
+                metrics.inc("openai_retries_total", stage=stage)
+                time.sleep(delay)
+
+    def _attempt(self, attempt, stage: str, end: float, hedged: bool):
+        hedge_after = self.hedge_after(stage) if hedged else None
+        start = time.monotonic()
+        if hedge_after is None:
+            response = attempt(end - start)
+            self._record_latency(stage, time.monotonic() - start)
+            return response
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(HEDGE_WORKERS, thread_name_prefix="openai")
+        first = self._pool.submit(attempt, end - start)
+        pending = {first}
+        done, _ = wait(pending, timeout=min(hedge_after, end - start))
+        if not done and not self._gave_up(stage, end):
+            metrics.inc("openai_hedges_total", stage=stage)
+            pending.add(self._pool.submit(attempt, end - time.monotonic()))
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=max(end - time.monotonic(), 0), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                self._gave_up(stage, end)
+                raise TimeoutError(f"{stage} call exceeded its deadline")
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is not first:
+                        metrics.inc("openai_hedge_wins_total", stage=stage)
+                    self._record_latency(stage, time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acomplete(self, client, stage: str = "briefing", hedge: bool = True, **request):
+        """Async complete, on an AsyncOpenAI client."""
+        error: BaseException | None = None
+        for model, deadline, retries, hedged, trial in self._plans(request["model"]):
+            attempt = partial(_create, client, {**request, "model": model})
+
+            try:
+                response = await self._aretry(attempt, stage, deadline, retries, hedge and hedged)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker(model).success()
+                    raise
+                self._failed(model)
+                error = e
+                continue
+            except BaseException:
+                # Cancelled or interrupted: a half-open trial must not stay taken
+                if trial:
+                    self.breaker(model).release()
+                raise
+            self._succeeded(model, request["model"])
+            return response
+        raise ModelUnavailable(f"no model answered the {stage} call") from error
+
+    async def _aretry(self, attempt, stage: str, deadline: float, retries: int, hedged: bool):
+        end = time.monotonic() + deadline
+        for number in range(retries + 1):
+            try:
+                return await self._aattempt(attempt, stage, end, hedged)
+            except Exception as e:
+                delay = _retry_delay(e, number)
+                if not is_retryable(e) or number == retries or self._gave_up(stage, end, delay):
+                    raise
+                metrics.inc("openai_retries_total", stage=stage)
+                await asyncio.sleep(delay)
+
+    async def _aattempt(self, attempt, stage: str, end: float, hedged: bool):
+        hedge_after = self.hedge_after(stage) if hedged else None
+        start = time.monotonic()
+        first = asyncio.ensure_future(attempt(end - start))
+        tasks = pending = {first}
+        try:
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(pending, timeout=min(hedge_after, end - start))
+                if not done and not self._gave_up(stage, end):
+                    metrics.inc("openai_hedges_total", stage=stage)
+                    hedge = asyncio.ensure_future(attempt(end - time.monotonic()))
+                    tasks = pending = {first, hedge}
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(end - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self._gave_up(stage, end)
+                    raise TimeoutError(f"{stage} call exceeded its deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            metrics.inc("openai_hedge_wins_total", stage=stage)
+                        self._record_latency(stage, time.monotonic() - start)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser, or every attempt when the deadline passed or the caller was cancelled
+            for task in tasks:
+                task.cancel()
+
+
+_executor: RequestExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> RequestExecutor:
+    """The process's executor, configured from OPENAI_DEADLINE, OPENAI_RETRIES,
+    OPENAI_HEDGE_DELAY and OPENAI_FALLBACK_MODEL."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Seconds, or "off"; unset hedges at the stage's p95 latency
+            hedge = os.environ.get("OPENAI_HEDGE_DELAY", "")
+            _executor = RequestExecutor(
+                deadline=float(os.environ.get("OPENAI_DEADLINE", OPENAI_DEADLINE)),
+                retries=int(os.environ.get("OPENAI_RETRIES", OPENAI_RETRIES)),
+                hedge_delay=float(hedge) if hedge not in ("", "off") else None,
+                hedge_percentile=None if hedge == "off" else HEDGE_PERCENTILE,
+                # Set empty to turn the fallback model off
+                fallback_model=os.environ.get("OPENAI_FALLBACK_MODEL", FALLBACK_MODEL) or None,
+            )
+        return _executor
@@ -1,6 +1,22 @@
+import asyncio
 import os
+import time
+from typing import TYPE_CHECKING
 
-import requests
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+SLACK_API = "https://slack.com/api"
+SLACK_TIMEOUT = 10
+# chat.postMessage truncates text beyond this many characters
+SLACK_MESSAGE_LIMIT = 40000
+SLACK_RETRIES = 3
+SLACK_RETRY_DELAY = 1.0
+# Longest Retry-After we are willing to sleep for
+SLACK_MAX_RETRY_AFTER = 60.0
 
 
 def _get_slack_config() -> tuple[str, str]:
@@ -9,37 +25,150 @@ def _get_slack_config() -> tuple[str, str]:
     return token, cookie
 
 
-def _get_self_user_id(token: str, cookie: str) -> str:
-    response = requests.post(
-        "https://slack.com/api/auth.test",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Cookie": f"d={cookie}",
-        },
-        timeout=10,
-    )
-    response.raise_for_status()
-    data = response.json()
-    if not data.get("ok"):
-        raise RuntimeError(f"Slack auth.test failed: {data.get('error')}")
-    return data["user_id"]
-
-
-def send_to_slack(summary: str) -> None:
-    token, cookie = _get_slack_config()
-    user_id = _get_self_user_id(token, cookie)
-
-    response = requests.post(
-        "https://slack.com/api/chat.postMessage",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Cookie": f"d={cookie}",
-            "Content-Type": "application/json",
-        },
-        json={"channel": user_id, "text": summary},
-        timeout=10,
-    )
-    response.raise_for_status()
-    data = response.json()
+def _api_url() -> str:
+    # SLACK_API_URL points the client at another server, e.g. a local fake in tests
+    return os.environ.get("SLACK_API_URL", SLACK_API).rstrip("/")
+
+
+def _headers(token: str, cookie: str) -> dict:
+    return {
+        "Authorization": f"Bearer {token}",
+        "Cookie": f"d={cookie}",
+    }
+
+
+def _check(data: dict, method: str) -> dict:
     if not data.get("ok"):
-        raise RuntimeError(f"Slack postMessage failed: {data.get('error')}")
+        raise RuntimeError(f"Slack {method} failed: {data.get('error')}")
+    return data
+
+
+def _retry_delay(headers, attempt: int) -> float:
+    try:
+        delay = float(headers.get("Retry-After", ""))
+    except ValueError:
+        delay = SLACK_RETRY_DELAY * 2**attempt
+    return min(max(delay, 0.0), SLACK_MAX_RETRY_AFTER)
+
+
+def split_message(text: str, limit: int = SLACK_MESSAGE_LIMIT) -> list[str]:
+    """Split `text` into chunks of at most `limit` characters, in order.
+
+    Splits at the last paragraph break before the limit, else the last line break,
+    else the last space, so a briefing section is only broken when it has to be.
+    """
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = max(window.rfind("\n\n"), 0) or max(window.rfind("\n"), 0) or window.rfind(" ")
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n ")
+    chunks.append(text)
+    return chunks
+
+
+class SlackClient:
+    """Sends DMs to yourself over one persistent requests.Session.
+
+    The user ID from auth.test is looked up once per token, 429 responses are
+    retried after Slack's Retry-After, and summaries longer than
+    SLACK_MESSAGE_LIMIT are posted as several messages in order.
+    """
+
+    def __init__(self, session: "requests.Session | None" = None):
+        # requests and httpx are imported when a client is created, not with the module
+        import requests
+
+        self._session = session or requests.Session()
+        self._user_ids: dict[str, str] = {}
+
+    def _post(self, method: str, token: str, cookie: str, **kwargs) -> dict:
+        for attempt in range(SLACK_RETRIES + 1):
+            with metrics.timer(f"slack_{method}"):
+                response = self._session.post(
+                    f"{_api_url()}/{method}",
+                    headers=_headers(token, cookie),
+                    timeout=SLACK_TIMEOUT,
+                    **kwargs,
+                )
+            if response.status_code != 429 or attempt == SLACK_RETRIES:
+                break
+            metrics.inc("slack_rate_limited_total")
+            time.sleep(_retry_delay(response.headers, attempt))
+        response.raise_for_status()
+        return _check(response.json(), method.removeprefix("chat."))
+
+    def _self_user_id(self, token: str, cookie: str) -> str:
+        if token not in self._user_ids:
+            self._user_ids[token] = self._post("auth.test", token, cookie)["user_id"]
+        return self._user_ids[token]
+
+    def send(self, summary: str, token: str | None = None, cookie: str | None = None) -> None:
+        # Credentials default to SLACK_TOKEN/SLACK_COOKIE; pass them to post as another user
+        if token is None:
+            token, cookie = _get_slack_config()
+        user_id = self._self_user_id(token, cookie)
+        for chunk in split_message(summary, SLACK_MESSAGE_LIMIT):
+            self._post("chat.postMessage", token, cookie, json={"channel": user_id, "text": chunk})
+
+    def close(self) -> None:
+        self._session.close()
+
+
+def send_to_slack(
+    summary: str,
+    token: str | None = None,
+    cookie: str | None = None,
+    client: SlackClient | None = None,
+) -> None:
+    # Without a client this is a one-off send; long-running callers pass their own
+    if client is not None:
+        client.send(summary, token, cookie)
+        return
+    client = SlackClient()
+    try:
+        client.send(summary, token, cookie)
+    finally:
+        client.close()
+
+
+class AsyncSlackClient:
+    """SlackClient for the API process, sharing one pooled httpx.AsyncClient."""
+
+    def __init__(self, http: "httpx.AsyncClient | None" = None):
+        import httpx
+
+        self._http = http or httpx.AsyncClient(timeout=SLACK_TIMEOUT)
+        self._user_ids: dict[str, str] = {}
+
+    async def _post(self, method: str, token: str, cookie: str, **kwargs) -> dict:
+        for attempt in range(SLACK_RETRIES + 1):
+            with metrics.timer(f"slack_{method}"):
+                response = await self._http.post(
+                    f"{_api_url()}/{method}", headers=_headers(token, cookie), **kwargs
+                )
+            if response.status_code != 429 or attempt == SLACK_RETRIES:
+                break
+            metrics.inc("slack_rate_limited_total")
+            await asyncio.sleep(_retry_delay(response.headers, attempt))
+        response.raise_for_status()
+        return _check(response.json(), method.removeprefix("chat."))
+
+    async def _self_user_id(self, token: str, cookie: str) -> str:
+        if token not in self._user_ids:
+            data = await self._post("auth.test", token, cookie)
+            self._user_ids[token] = data["user_id"]
+        return self._user_ids[token]
+
+    async def send(self, summary: str) -> None:
+        token, cookie = _get_slack_config()
+        user_id = await self._self_user_id(token, cookie)
+        for chunk in split_message(summary, SLACK_MESSAGE_LIMIT):
+            await self._post(
+                "chat.postMessage", token, cookie, json={"channel": user_id, "text": chunk}
+            )
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
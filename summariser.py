@@ -1,49 +1,592 @@
+import asyncio
+import json
 import os
+import re
+import sys
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from typing import TYPE_CHECKING
 
-from openai import OpenAI
+import metrics
+from collapse import collapse_emails
+from prompt_builder import (
+    INPUT_TOKEN_BUDGET,
+    build_prompt,
+    count_tokens,
+    fit_emails,
+    format_email,
+)
+from prompts import (
+    DIGEST_PREAMBLE,
+    DIGEST_PROMPT_VERSION,
+    DIGEST_SYSTEM,
+    MAP_SYSTEM,
+    REDUCE_PREAMBLE,
+    SUMMARISE_SYSTEM,
+)
+from request_executor import ModelUnavailable, get_executor
+from summary_cache import digest_key
 
-from prompts import SUMMARISE_SYSTEM
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
+MODEL = "gpt-4.1-mini"
+MAX_TOKENS = 2048
+MAP_MAX_TOKENS = 1024
+DIGEST_MAX_TOKENS = 2048
 
-def ping_ai() -> str:
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        max_tokens=50,
-        messages=[{"role": "user", "content": "Say hello in one sentence."}],
+# Inboxes whose prompt exceeds CHUNK_TOKEN_BUDGET are summarised map-reduce style:
+# chunks are summarised concurrently, then merged by one final call
+CHUNK_TOKEN_BUDGET = 12000
+MAP_CONCURRENCY = 4
+
+# summarise_backlog maps this many emails at a time into notes
+BACKLOG_WINDOW = 50
+
+# Heads the briefing sent when no model answers (see request_executor)
+EXTRACTIVE_HEADER = "_The AI summary is unavailable right now; these are the emails._\n\n"
+
+
+def _default_client() -> "OpenAI":
+    # openai is the slowest import in the pipeline, so it waits until a client is needed
+    from openai import OpenAI
+
+    # Retries are left to request_executor, which also hedges and falls back
+    return OpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+
+
+_PING_MESSAGES = [{"role": "user", "content": "Say hello in one sentence."}]
+
+
+def ping_ai(client: "OpenAI | None" = None) -> str:
+    client = client or _default_client()
+    response = get_executor().complete(
+        client, "ping", model=MODEL, max_tokens=50, messages=_PING_MESSAGES
     )
     return response.choices[0].message.content or ""
 
 
-def summarise_emails(emails: list[dict]) -> str:
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+async def aping_ai(client: "AsyncOpenAI") -> str:
+    response = await get_executor().acomplete(
+        client, "ping", model=MODEL, max_tokens=50, messages=_PING_MESSAGES
+    )
+    return response.choices[0].message.content or ""
 
+
+def _date_header() -> str:
     aest = timezone(timedelta(hours=10))
     today = datetime.now(aest).strftime("%b %d, %Y")
-    email_text = f"Today's date: {today}\n\n"
-    for i, e in enumerate(emails, 1):
-        email_text += (
-            f"--- Email {i} ---\n"
-            f"From: {e['from']}\n"
-            f"Subject: {e['subject']}\n"
-            f"Date: {e['date']}\n"
-            f"Body:\n{e['body']}\n\n"
-        )
+    return f"Today's date: {today}\n\n"
 
-    response = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        max_tokens=2048,
-        messages=[
-            {
-                "role": "system",
-                "content": SUMMARISE_SYSTEM,
-            },
-            {
-                "role": "user",
-                "content": email_text,
-            },
-        ],
+
+def _chunk_by_tokens(items: list, token_counts: list[int], token_budget: int) -> list[list]:
+    chunks: list[list] = []
+    current: list = []
+    current_tokens = 0
+    for item, tokens in zip(items, token_counts, strict=True):
+        if current and current_tokens + tokens > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _messages(system: str, content: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": system,
+        },
+        {
+            "role": "user",
+            "content": content,
+        },
+    ]
+
+
+def _record_usage(usage) -> None:
+    if usage is not None:
+        metrics.inc("openai_tokens_total", usage.prompt_tokens, kind="prompt")
+        metrics.inc("openai_tokens_total", usage.completion_tokens, kind="completion")
+
+
+def _complete(client, system: str, content: str, max_tokens: int, stage: str = "briefing") -> str:
+    try:
+        with metrics.timer(f"openai_{stage}"):
+            response = get_executor().complete(
+                client,
+                stage,
+                model=MODEL,
+                max_tokens=max_tokens,
+                messages=_messages(system, content),
+            )
+    except ModelUnavailable as e:
+        return _extractive_fallback(content, stage, e)
+    _record_usage(response.usage)
+    return response.choices[0].message.content or ""
+
+
+def _extractive_fallback(content: str, stage: str, error: ModelUnavailable) -> str:
+    cause = type(error.__cause__).__name__ if error.__cause__ else "breaker open"
+    print(f"No model answered the {stage} call ({cause}); listing emails.", file=sys.stderr)
+    metrics.inc("openai_fallbacks_total", kind="extractive")
+    return extractive_summary(content)
+
+
+_EMAIL_BLOCK_RE = re.compile(
+    r"^--- Email \d+ ---\nFrom: (.*)\nSubject: (.*)\n(?:Date: .*\n)?Body:\n(.*)", re.MULTILINE
+)
+_DIGEST_LINE_RE = re.compile(
+    r"^- Email \d+ \| From: (.*?) \| Subject: (.*?) \| (.*)$", re.MULTILINE
+)
+
+
+def extractive_summary(content: str, max_items: int = 50) -> str:
+    """A plain briefing cut from a prompt, for when no model answers.
+
+    Lists each email's sender, subject and first body line (or digest); for a
+    reduce prompt, the bullet lines of its notes.
+    """
+    items = _EMAIL_BLOCK_RE.findall(content) or _DIGEST_LINE_RE.findall(content)
+    if items:
+        lines = [
+            f"- *{sender}*: {subject}" + (f" — {text.strip()[:200]}" if text.strip() else "")
+            for sender, subject, text in items[:max_items]
+        ]
+        if len(items) > max_items:
+            lines.append(f"- …and {len(items) - max_items} more")
+    else:
+        lines = [line for line in content.splitlines() if line.startswith("- ")][:max_items]
+    return EXTRACTIVE_HEADER + "\n".join(lines)
+
+
+def summarise_emails(
+    emails: list[dict],
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    concurrency: int = MAP_CONCURRENCY,
+    cache=None,
+    input_budget: int = INPUT_TOKEN_BUDGET,
+    client: "OpenAI | None" = None,
+) -> str:
+    """Summarise emails into a Slack mrkdwn daily briefing.
+
+    With a summary `cache` (see summary_cache), each email is first reduced to a
+    one-line digest keyed by its content, model and prompt version; only emails
+    without a cached digest are sent to the model, and the briefing is written
+    from the digests.
+
+    With RANK_EMAILS=1, low-priority emails (see ranking) are only counted. Emails
+    in one thread, and near-identical notifications, are collapsed into one email
+    each (see collapse). Bodies are cleaned of quoted replies,
+    signatures and tracking URLs, then trimmed so all of them together fit
+    `input_budget` tokens (see prompt_builder).
+
+    Pass `client` to reuse one OpenAI client (and its connection pool) across calls.
+    """
+    client = client or _default_client()
+    content = _briefing_prompt(client, emails, chunk_tokens, concurrency, cache, input_budget)
+    return _complete(client, SUMMARISE_SYSTEM, content, MAX_TOKENS)
+
+
+def _windows(emails: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    emails = iter(emails)
+    while window := list(islice(emails, size)):
+        yield window
+
+
+def summarise_backlog(
+    emails: Iterable[dict],
+    window: int = BACKLOG_WINDOW,
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    concurrency: int = MAP_CONCURRENCY,
+    client: "OpenAI | None" = None,
+) -> str:
+    """Summarise a stream of emails of any length, e.g. from iter_unread_emails.
+
+    Emails are taken `window` at a time; each window is ranked, collapsed, trimmed to
+    `chunk_tokens` and reduced to notes by a map call while the next window is
+    read, with at most `concurrency` windows in flight. Only the notes are kept,
+    so memory does not grow with the number of emails. The notes are then merged
+    into one briefing. Emails fitting in one window are summarised as by
+    summarise_emails; no emails returns "" without calling the model.
+    """
+    client = client or _default_client()
+    windows = _windows(emails, window)
+    first = next(windows, None)
+    if first is None:
+        return ""
+    second = next(windows, None)
+    if second is None:
+        return summarise_emails(first, chunk_tokens, concurrency, client=client)
+
+    header = _date_header()
+
+    def _map(batch: list[dict]) -> tuple[list[str], list[dict]]:
+        kept, skipped = _rank(batch)
+        fitted = fit_emails(_collapse(kept), chunk_tokens)
+        _, chunks = _map_stage(fitted, chunk_tokens)
+        notes = [
+            _complete(client, MAP_SYSTEM, build_prompt(header, chunk), MAP_MAX_TOKENS, "map")
+            for chunk in chunks
+        ]
+        # Only the sender is needed to count a skipped email
+        return notes, [{"from": e.get("from", "")} for e in skipped]
+
+    count = 0
+    partials: list[str] = []
+    skipped: list[dict] = []
+
+    def _collect(future) -> None:
+        notes, batch_skipped = future.result()
+        partials.extend(notes)
+        skipped.extend(batch_skipped)
+
+    in_flight: deque = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch in chain([first, second], windows):
+            count += len(batch)
+            if len(in_flight) >= concurrency:
+                _collect(in_flight.popleft())
+            in_flight.append(pool.submit(_map, batch))
+        while in_flight:
+            _collect(in_flight.popleft())
+    content = _reduce_prompt(header, count - len(skipped), partials)
+    content += _low_priority_note(skipped)
+    return _complete(client, SUMMARISE_SYSTEM, content, MAX_TOKENS)
+
+
+def _stream_request(content: str) -> dict:
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "messages": _messages(SUMMARISE_SYSTEM, content),
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+
+def _usage(chunk) -> dict | None:
+    # Only the last chunk of a stream carries usage
+    if chunk.usage is None:
+        return None
+    return {
+        "prompt_tokens": chunk.usage.prompt_tokens,
+        "completion_tokens": chunk.usage.completion_tokens,
+        "total_tokens": chunk.usage.total_tokens,
+    }
+
+
+def _map_stage(fitted: list[dict], chunk_tokens: int) -> tuple[list[str], list]:
+    blocks = [format_email(i, e) for i, e in enumerate(fitted, 1)]
+    return blocks, _chunk_by_tokens(blocks, [count_tokens(b) for b in blocks], chunk_tokens)
+
+
+def _reduce_prompt(header: str, count: int, partials: list[str]) -> str:
+    notes = [
+        f"--- Notes, batch {i} of {len(partials)} ---\n{partial}\n\n"
+        for i, partial in enumerate(partials, 1)
+    ]
+    return build_prompt(header + REDUCE_PREAMBLE.format(count=count), notes)
+
+
+def ranking_enabled() -> bool:
+    # Opt-in, since bulk notifications that matter (CI, code review) rank low until
+    # the ranker has learned otherwise
+    return os.environ.get("RANK_EMAILS") == "1"
+
+
+def _rank(emails: list[dict]) -> tuple[list[dict], list[dict]]:
+    # With RANK_EMAILS=1, low-priority emails are left out of the prompt and only
+    # counted. ranking imports NumPy, so it is only imported then
+    if not ranking_enabled():
+        return emails, []
+    from ranking import get_ranker, rank_emails
+
+    kept, skipped = rank_emails(emails, get_ranker())
+    metrics.inc("emails_low_priority_total", len(skipped))
+    return kept, skipped
+
+
+def _low_priority_note(skipped: list[dict]) -> str:
+    if not skipped:
+        return ""
+    from ranking import low_priority_note
+
+    return low_priority_note(skipped)
+
+
+def _collapse(emails: list[dict]) -> list[dict]:
+    # Threads and near-duplicate notifications become one email each; COLLAPSE_EMAILS=0
+    # sends every email to the model as it is
+    if os.environ.get("COLLAPSE_EMAILS") == "0":
+        return emails
+    with metrics.timer("collapse"):
+        collapsed = collapse_emails(emails)
+    metrics.inc("emails_collapsed_total", len(emails) - len(collapsed))
+    return collapsed
+
+
+def _briefing_prompt(
+    client,
+    emails: list[dict],
+    chunk_tokens: int,
+    concurrency: int,
+    cache,
+    input_budget: int,
+) -> str:
+    # Runs any map or digest stage and returns the input for the final briefing call
+    emails, skipped = _rank(emails)
+    note = _low_priority_note(skipped)
+    count = len(emails)
+    emails = _collapse(emails)
+    fitted = fit_emails(emails, input_budget)
+    if cache is not None:
+        return _digest_prompt(client, emails, fitted, cache, chunk_tokens, concurrency) + note
+
+    header = _date_header()
+    blocks, chunks = _map_stage(fitted, chunk_tokens)
+    if len(chunks) == 1:
+        return build_prompt(header, blocks) + note
+
+    def _map(chunk: list[str]) -> str:
+        return _complete(client, MAP_SYSTEM, build_prompt(header, chunk), MAP_MAX_TOKENS, "map")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        partials = list(pool.map(_map, chunks))
+    return _reduce_prompt(header, count, partials) + note
+
+
+def _digest_request(chunk: list[tuple[int, dict]]) -> dict:
+    return {
+        "model": MODEL,
+        "max_tokens": DIGEST_MAX_TOKENS,
+        "response_format": {"type": "json_object"},
+        "messages": _messages(
+            DIGEST_SYSTEM, build_prompt("", [format_email(i, e) for i, e in chunk])
+        ),
+    }
+
+
+def _parse_digests(response) -> dict[int, str]:
+    try:
+        items = json.loads(response.choices[0].message.content or "{}")["digests"]
+        return {int(item["email"]): str(item["digest"]) for item in items}
+    except (ValueError, KeyError, TypeError):
+        # A malformed reply only costs these emails their cache entries
+        return {}
+
+
+def _digest_chunk(client, chunk: list[tuple[int, dict]]) -> dict[int, str]:
+    try:
+        with metrics.timer("openai_digest"):
+            response = get_executor().complete(client, "digest", **_digest_request(chunk))
+    except ModelUnavailable:
+        # These emails go without digests (and cache entries) this time
+        return {}
+    _record_usage(response.usage)
+    return _parse_digests(response)
+
+
+def _missing_chunks(fitted: list[dict], keys: list[str], digests: dict, chunk_tokens: int) -> list:
+    missing = [
+        (i, e) for i, (e, key) in enumerate(zip(fitted, keys, strict=True), 1) if key not in digests
+    ]
+    return _chunk_by_tokens(
+        missing, [count_tokens(format_email(i, e)) for i, e in missing], chunk_tokens
     )
 
+
+def _fresh_digests(keys: list[str], digests: dict, results: list[dict[int, str]]) -> dict:
+    return {
+        keys[i - 1]: digest
+        for result in results
+        for i, digest in result.items()
+        if 0 < i <= len(keys) and keys[i - 1] not in digests
+    }
+
+
+def _digest_lines_prompt(emails: list[dict], keys: list[str], digests: dict) -> str:
+    lines = [
+        f"- Email {i} | From: {e['from']} | Subject: {e['subject']} | "
+        f"{digests.get(key, '(no digest available)')}\n"
+        for i, (e, key) in enumerate(zip(emails, keys, strict=True), 1)
+    ]
+    return build_prompt(_date_header() + DIGEST_PREAMBLE.format(count=len(emails)), lines)
+
+
+def _digest_prompt(
+    client, emails: list[dict], fitted: list[dict], cache, chunk_tokens: int, concurrency: int
+) -> str:
+    # Keys use the original emails so they don't shift with the budget allocation
+    keys = [digest_key(e, MODEL, DIGEST_PROMPT_VERSION) for e in emails]
+    digests = cache.get_many(keys)
+
+    chunks = _missing_chunks(fitted, keys, digests, chunk_tokens)
+    if chunks:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda chunk: _digest_chunk(client, chunk), chunks))
+        fresh = _fresh_digests(keys, digests, results)
+        cache.put_many(fresh)
+        digests.update(fresh)
+    return _digest_lines_prompt(emails, keys, digests)
+
+
+# Async variants for the API: they take a shared AsyncOpenAI client and run the
+# map and digest calls concurrently on the event loop instead of in threads.
+# Tokenising and SQLite cache lookups are moved off the loop.
+
+
+async def _acomplete(
+    client: "AsyncOpenAI", system: str, content: str, max_tokens: int, stage: str = "briefing"
+) -> str:
+    try:
+        with metrics.timer(f"openai_{stage}"):
+            response = await get_executor().acomplete(
+                client,
+                stage,
+                model=MODEL,
+                max_tokens=max_tokens,
+                messages=_messages(system, content),
+            )
+    except ModelUnavailable as e:
+        return _extractive_fallback(content, stage, e)
+    _record_usage(response.usage)
     return response.choices[0].message.content or ""
+
+
+async def _gather_limited(concurrency: int, calls: list) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _limited(call):
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(_limited(call) for call in calls))
+
+
+async def _abriefing_prompt(
+    client: "AsyncOpenAI",
+    emails: list[dict],
+    chunk_tokens: int,
+    concurrency: int,
+    cache,
+    input_budget: int,
+) -> str:
+    emails, skipped = await asyncio.to_thread(_rank, emails)
+    note = _low_priority_note(skipped)
+    count = len(emails)
+    emails = await asyncio.to_thread(_collapse, emails)
+    fitted = await asyncio.to_thread(fit_emails, emails, input_budget)
+    if cache is not None:
+        digests = await _adigest_prompt(client, emails, fitted, cache, chunk_tokens, concurrency)
+        return digests + note
+
+    header = _date_header()
+    blocks, chunks = await asyncio.to_thread(_map_stage, fitted, chunk_tokens)
+    if len(chunks) == 1:
+        return build_prompt(header, blocks) + note
+
+    partials = await _gather_limited(
+        concurrency,
+        [
+            lambda chunk=chunk: _acomplete(
+                client, MAP_SYSTEM, build_prompt(header, chunk), MAP_MAX_TOKENS, "map"
+            )
+            for chunk in chunks
+        ],
+    )
+    return _reduce_prompt(header, count, partials) + note
+
+
+async def _adigest_chunk(client: "AsyncOpenAI", chunk: list[tuple[int, dict]]) -> dict[int, str]:
+    try:
+        with metrics.timer("openai_digest"):
+            response = await get_executor().acomplete(client, "digest", **_digest_request(chunk))
+    except ModelUnavailable:
+        return {}
+    _record_usage(response.usage)
+    return _parse_digests(response)
+
+
+async def _adigest_prompt(
+    client: "AsyncOpenAI",
+    emails: list[dict],
+    fitted: list[dict],
+    cache,
+    chunk_tokens: int,
+    concurrency: int,
+) -> str:
+    keys = [digest_key(e, MODEL, DIGEST_PROMPT_VERSION) for e in emails]
+    digests = await asyncio.to_thread(cache.get_many, keys)
+
+    chunks = await asyncio.to_thread(_missing_chunks, fitted, keys, digests, chunk_tokens)
+    if chunks:
+        results = await _gather_limited(
+            concurrency,
+            [lambda chunk=chunk: _adigest_chunk(client, chunk) for chunk in chunks],
+        )
+        fresh = _fresh_digests(keys, digests, results)
+        await asyncio.to_thread(cache.put_many, fresh)
+        digests.update(fresh)
+    return _digest_lines_prompt(emails, keys, digests)
+
+
+async def asummarise_emails(
+    emails: list[dict],
+    client: "AsyncOpenAI",
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    concurrency: int = MAP_CONCURRENCY,
+    cache=None,
+    input_budget: int = INPUT_TOKEN_BUDGET,
+) -> str:
+    """Async summarise_emails using a shared AsyncOpenAI client."""
+    content = await _abriefing_prompt(
+        client, emails, chunk_tokens, concurrency, cache, input_budget
+    )
+    return await _acomplete(client, SUMMARISE_SYSTEM, content, MAX_TOKENS)
+
+
+async def astream_summary(
+    emails: list[dict],
+    client: "AsyncOpenAI",
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    concurrency: int = MAP_CONCURRENCY,
+    cache=None,
+    input_budget: int = INPUT_TOKEN_BUDGET,
+) -> AsyncIterator[dict]:
+    """Like asummarise_emails, but yield the briefing as it is generated.
+
+    Yields {"type": "delta", "text": ...} events and finally {"type": "done",
+    "usage": ...}. Any map or digest calls run before the first delta. Closing the
+    generator closes the upstream response.
+    """
+    content = await _abriefing_prompt(
+        client, emails, chunk_tokens, concurrency, cache, input_budget
+    )
+    start = time.perf_counter()
+    try:
+        stream = await get_executor().acomplete(
+            client, "stream", hedge=False, **_stream_request(content)
+        )
+    except ModelUnavailable as e:
+        yield {"type": "delta", "text": _extractive_fallback(content, "stream", e)}
+        yield {"type": "done", "usage": None}
+        return
+    usage = None
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield {"type": "delta", "text": chunk.choices[0].delta.content}
+            _record_usage(chunk.usage)
+            usage = _usage(chunk) or usage
+    finally:
+        await stream.close()
+        metrics.observe("openai_stream", time.perf_counter() - start)
+    yield {"type": "done", "usage": usage}
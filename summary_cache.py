@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# SQLite caps the number of bound parameters per statement
+_QUERY_CHUNK = 500
+
+
+def digest_key(email: dict, model: str, prompt_version: int) -> str:
+    # Content-addressed: any change to the email, model or prompt gives a new key
+    content = json.dumps(
+        [
+            email.get("from", ""),
+            email.get("subject", ""),
+            email.get("date", ""),
+            email.get("body", ""),
+            model,
+            prompt_version,
+        ]
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class InMemorySummaryCache:
+    """LRU cache of per-email digests with a TTL, for a long-running API process."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        cutoff = time.time() - self.ttl
+        found: dict[str, str] = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] < cutoff:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        metrics.inc("cache_hits_total", len(found), cache="summary")
+        metrics.inc("cache_misses_total", len(set(keys)) - len(found), cache="summary")
+        return found
+
+    def put_many(self, digests: dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            for key, digest in digests.items():
+                self._entries[key] = (digest, now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+
+class SQLiteSummaryCache:
+    """Persistent digest cache, so separate main.py runs can share digests."""
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "key TEXT PRIMARY KEY, digest TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS digests_used_at ON digests (used_at)")
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        now = time.time()
+        found: dict[str, str] = {}
+        with self._lock, self._conn:
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[start : start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, digest FROM digests WHERE key IN ({placeholders}) "
+                    "AND used_at >= ?",
+                    (*chunk, now - self.ttl),
+                )
+                found.update(rows)
+            # Refresh recency so eviction is least-recently-used
+            self._conn.executemany(
+                "UPDATE digests SET used_at = ? WHERE key = ?", [(now, key) for key in found]
+            )
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        metrics.inc("cache_hits_total", len(found), cache="summary")
+        metrics.inc("cache_misses_total", len(set(keys)) - len(found), cache="summary")
+        return found
+
+    def put_many(self, digests: dict[str, str]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO digests (key, digest, used_at) VALUES (?, ?, ?)",
+                [(key, digest, now) for key, digest in digests.items()],
+            )
+            self._conn.execute("DELETE FROM digests WHERE used_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM digests WHERE key NOT IN "
+                "(SELECT key FROM digests ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_summary_cache() -> InMemorySummaryCache | SQLiteSummaryCache | None:
+    # SUMMARY_CACHE is "memory" or a SQLite file path; unset disables the cache
+    setting = os.environ.get("SUMMARY_CACHE")
+    if not setting:
+        return None
+    if setting == "memory":
+        return InMemorySummaryCache()
+    return SQLiteSummaryCache(setting)
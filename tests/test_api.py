@@ -0,0 +1,360 @@
+import asyncio
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import SummaryMemo, app
+
+EMAILS = [{"from": "a@b.com", "subject": "Hi", "date": "", "body": "Hey"}]
+
+
+@pytest.fixture
+def client():
+    # Entering the client runs the lifespan, which creates the shared clients
+    with TestClient(app) as client:
+        yield client
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], lines["data"]))
+    return events
+
+
+def test_summarise_reuses_the_shared_openai_client(client):
+    with patch("api.asummarise_emails", new=AsyncMock(return_value="Daily summary")) as summarise:
+        first = client.post("/api/summarise", json={"emails": EMAILS})
+        client.post("/api/summarise", json={"emails": [{**EMAILS[0], "subject": "Other"}]})
+
+    assert first.json() == {"summary": "Daily summary"}
+    assert summarise.call_args_list[0].args[1] is app.state.openai
+    assert summarise.call_args_list[1].args[1] is app.state.openai
+
+
+def test_summarise_memoises_identical_requests(client):
+    with patch("api.asummarise_emails", new=AsyncMock(return_value="Daily summary")) as summarise:
+        responses = [client.post("/api/summarise", json={"emails": EMAILS}) for _ in range(3)]
+
+    assert [r.json() for r in responses] == [{"summary": "Daily summary"}] * 3
+    summarise.assert_awaited_once()
+
+
+def test_summarise_memo_shares_calls_in_flight_and_forgets_failures():
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise RuntimeError("upstream failed")
+        return "summary"
+
+    async def scenario():
+        memo = SummaryMemo()
+        first = await asyncio.gather(
+            memo.get_or_create("k", create), memo.get_or_create("k", create), return_exceptions=True
+        )
+        return first, await memo.get_or_create("k", create)
+
+    first, retried = asyncio.run(scenario())
+
+    assert all(isinstance(result, RuntimeError) for result in first)
+    assert retried == "summary"
+    assert len(calls) == 2
+
+
+def test_summarise_loads_missing_bodies_through_gmail_client(client):
+    headers_only = [{k: v for k, v in EMAILS[0].items() if k != "body"}]
+    with (
+        patch.object(app.state.gmail, "load_bodies", new=AsyncMock(return_value=EMAILS)),
+        patch("api.asummarise_emails", new=AsyncMock(return_value="Daily summary")) as summarise,
+    ):
+        client.post("/api/summarise", json={"emails": headers_only})
+
+    assert summarise.call_args.args[0] == EMAILS
+
+
+def test_summarise_stream_forwards_deltas_and_usage(client):
+    async def fake_stream(emails, openai, cache=None):
+        yield {"type": "delta", "text": "Daily "}
+        yield {"type": "delta", "text": "summary"}
+        yield {"type": "done", "usage": {"total_tokens": 42}}
+
+    with patch("api.astream_summary", side_effect=fake_stream):
+        response = client.post("/api/summarise/stream", json={"emails": EMAILS})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _parse_sse(response.text) == [
+        ("delta", '{"text": "Daily "}'),
+        ("delta", '{"text": "summary"}'),
+        ("done", '{"usage": {"total_tokens": 42}}'),
+    ]
+
+
+def test_summarise_stream_memoises_identical_requests(client):
+    calls = []
+
+    async def fake_stream(emails, openai, cache=None):
+        calls.append(emails)
+        yield {"type": "delta", "text": "Daily "}
+        yield {"type": "delta", "text": "summary"}
+        yield {"type": "done", "usage": {"total_tokens": 42}}
+
+    with (
+        patch("api.astream_summary", side_effect=fake_stream),
+        patch("api.asummarise_emails", new=AsyncMock()) as summarise,
+    ):
+        first = client.post("/api/summarise/stream", json={"emails": EMAILS})
+        second = client.post("/api/summarise/stream", json={"emails": EMAILS})
+        plain = client.post("/api/summarise", json={"emails": EMAILS})
+
+    assert len(calls) == 1
+    summarise.assert_not_awaited()
+    assert _parse_sse(second.text) == [
+        ("delta", '{"text": "Daily summary"}'),
+        ("done", '{"usage": null}'),
+    ]
+    assert len(_parse_sse(first.text)) == 3
+    assert plain.json() == {"summary": "Daily summary"}
+
+
+def test_concurrent_stream_requests_share_one_body_load_and_summary(client):
+    headers_only = [{k: v for k, v in EMAILS[0].items() if k != "body"}]
+    calls = []
+
+    async def slow_load_bodies(emails):
+        await asyncio.sleep(0.2)
+        return EMAILS
+
+    async def fake_stream(emails, openai, cache=None):
+        calls.append(emails)
+        yield {"type": "delta", "text": "Daily summary"}
+        yield {"type": "done", "usage": {"total_tokens": 42}}
+
+    with (
+        patch.object(app.state.gmail, "load_bodies", side_effect=slow_load_bodies) as load,
+        patch("api.astream_summary", side_effect=fake_stream),
+        ThreadPoolExecutor(2) as pool,
+    ):
+        responses = list(
+            pool.map(
+                lambda _: client.post("/api/summarise/stream", json={"emails": headers_only}),
+                range(2),
+            )
+        )
+
+    assert calls == [EMAILS]
+    load.assert_called_once()
+    for response in responses:
+        assert _parse_sse(response.text)[0] == ("delta", '{"text": "Daily summary"}')
+
+
+def test_summary_stream_is_shared_by_requests_in_flight():
+    release = asyncio.Event()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        yield {"type": "delta", "text": "Daily "}
+        await release.wait()
+        yield {"type": "delta", "text": "summary"}
+        yield {"type": "done", "usage": {"total_tokens": 42}}
+
+    async def _collect(events):
+        return [event async for event in events]
+
+    async def scenario():
+        memo = SummaryMemo()
+        first = asyncio.ensure_future(_collect(memo.start_stream("k", upstream())))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(_collect(memo.stream("k")))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await first, await second
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second
+    assert [e.get("text") for e in first] == ["Daily ", "summary", None]
+    assert len(calls) == 1
+
+
+def test_summarise_stream_reports_errors_as_events(client):
+    async def failing_stream(emails, openai, cache=None):
+        yield {"type": "delta", "text": "Daily"}
+        raise RuntimeError("upstream failed")
+
+    with patch("api.astream_summary", side_effect=failing_stream):
+        response = client.post("/api/summarise/stream", json={"emails": EMAILS})
+
+    assert _parse_sse(response.text)[-1] == ("error", '{"detail": "Failed to summarise emails"}')
+
+
+def test_summarise_stream_rejects_empty_request(client):
+    response = client.post("/api/summarise/stream", json={"emails": []})
+    assert response.status_code == 400
+
+
+def test_send_slack_uses_shared_slack_client(client):
+    with patch.object(app.state.slack, "send", new=AsyncMock()) as send:
+        response = client.post("/api/send-slack", json={"summary": "Hello"})
+
+    assert response.json() == {"status": "sent"}
+    send.assert_awaited_once_with("Hello")
+
+
+def test_get_emails_reports_threads_not_marked_read(client):
+    gmail = app.state.gmail
+    with (
+        patch.object(gmail, "fetch_unread_emails", new=AsyncMock(return_value=EMAILS)),
+        patch.object(gmail, "mark_as_read", new=AsyncMock(return_value={"t2": "403", "t1": "403"})),
+    ):
+        response = client.get("/api/emails")
+
+    assert response.json()["mark_read_failures"] == ["t1", "t2"]
+
+
+def test_get_emails_can_defer_mark_as_read(client):
+    gmail = app.state.gmail
+    with (
+        patch.object(gmail, "fetch_unread_emails", new=AsyncMock(return_value=EMAILS)),
+        patch.object(gmail, "mark_as_read", new=AsyncMock(return_value={"t1": "403"})) as mark,
+    ):
+        response = client.get("/api/emails", params={"defer_mark_read": "true"})
+
+    assert response.json() == {"emails": EMAILS, "count": 1}
+    # Ran as a background task once the response was sent
+    mark.assert_awaited_once_with(EMAILS)
+
+
+def test_get_emails_serves_snapshot_until_refresh(client):
+    gmail = app.state.gmail
+    fresh = [{**EMAILS[0], "subject": "New"}]
+    with (
+        patch.object(
+            gmail, "fetch_unread_emails", new=AsyncMock(side_effect=[EMAILS, fresh])
+        ) as fetch,
+        patch.object(gmail, "mark_as_read", new=AsyncMock(return_value={})) as mark,
+    ):
+        first = client.get("/api/emails")
+        again = client.get("/api/emails")
+        refreshed = client.get("/api/emails", params={"refresh": "true"})
+
+    assert first.json()["emails"] == again.json()["emails"] == EMAILS
+    assert refreshed.json()["emails"] == fresh
+    assert fetch.await_count == 2
+    assert mark.await_count == 2
+    assert first.headers["etag"] == again.headers["etag"] != refreshed.headers["etag"]
+
+
+def test_get_emails_answers_matching_etag_with_304(client):
+    gmail = app.state.gmail
+    with (
+        patch.object(gmail, "fetch_unread_emails", new=AsyncMock(return_value=EMAILS)),
+        patch.object(gmail, "mark_as_read", new=AsyncMock(return_value={})),
+    ):
+        etag = client.get("/api/emails").headers["etag"]
+        unchanged = client.get("/api/emails", headers={"If-None-Match": etag})
+        other = client.get("/api/emails", headers={"If-None-Match": 'W/"other"'})
+
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert other.status_code == 200
+
+
+def test_refresh_teaches_the_ranker_which_emails_were_opened(client, monkeypatch):
+    monkeypatch.setenv("RANK_EMAILS", "1")
+    gmail = app.state.gmail
+    emails = [{**EMAILS[0], "id": "m1"}, {**EMAILS[0], "id": "m2", "subject": "Sale"}]
+    ranker = MagicMock()
+    with (
+        patch.object(gmail, "fetch_unread_emails", new=AsyncMock(side_effect=[emails, []])),
+        patch.object(gmail, "mark_as_read", new=AsyncMock(return_value={})),
+        patch("ranking.get_ranker", return_value=ranker),
+    ):
+        client.get("/api/emails")
+        opened = client.post("/api/emails/opened", json={"ids": ["m1", "unknown"]})
+        client.get("/api/emails", params={"refresh": "true"})
+
+    assert opened.json() == {"status": "recorded"}
+    ranker.learn.assert_called_once_with(emails, {"m1"})
+    ranker.save.assert_called_once()
+    assert app.state.snapshots.opened == set()
+
+
+def _push(history_id):
+    notification = {"emailAddress": "me@example.com", "historyId": history_id}
+    data = base64.b64encode(json.dumps(notification).encode())
+    return {"message": {"data": data.decode(), "messageId": "1"}, "subscription": "s"}
+
+
+def test_gmail_push_requires_daemon_mode(client):
+    response = client.post("/api/gmail/push", json=_push(1))
+    assert response.status_code == 503
+
+
+def test_gmail_push_notifies_the_daemon(client, monkeypatch):
+    daemon = MagicMock()
+    monkeypatch.setattr(app.state, "daemon", daemon)
+
+    accepted = client.post("/api/gmail/push", json=_push(12345))
+    invalid = client.post("/api/gmail/push", json={"message": {"data": "not base64!"}})
+
+    assert accepted.json() == {"status": "accepted"}
+    daemon.notify.assert_called_once_with("12345")
+    assert invalid.status_code == 400
+
+
+def test_gmail_push_accepts_verification_token_instead_of_api_key(client, monkeypatch):
+    monkeypatch.setattr("api.API_KEY", "secret")
+    monkeypatch.setenv("PUBSUB_VERIFICATION_TOKEN", "push-token")
+    monkeypatch.setattr(app.state, "daemon", MagicMock())
+
+    with_token = client.post("/api/gmail/push?token=push-token", json=_push(1))
+    wrong_token = client.post("/api/gmail/push?token=other", json=_push(1))
+    with_key = client.post(
+        "/api/gmail/push", json=_push(1), headers={"Authorization": "Bearer secret"}
+    )
+
+    assert with_token.status_code == 200
+    assert wrong_token.status_code == 401
+    assert with_key.status_code == 200
+
+
+def test_jobs_endpoints_enqueue_and_report_status(tmp_path, monkeypatch):
+    monkeypatch.setenv("JOB_QUEUE", str(tmp_path / "jobs.db"))
+    with TestClient(app) as client:
+        created = client.post(
+            "/api/jobs", json={"max_results": 5}, headers={"Idempotency-Key": "abc"}
+        )
+        repeated = client.post("/api/jobs", json={}, headers={"Idempotency-Key": "abc"})
+        status = client.get(f"/api/jobs/{created.json()['job_id']}")
+        missing = client.get("/api/jobs/unknown")
+
+    assert created.status_code == 202
+    assert repeated.json()["job_id"] == created.json()["job_id"]
+    assert status.json()["status"] == "queued"
+    assert missing.status_code == 404
+
+
+def test_jobs_endpoint_requires_a_configured_queue(client):
+    response = client.post("/api/jobs", json={})
+    assert response.status_code == 503
+
+
+def test_metrics_endpoint_serves_prometheus_text(client):
+    import metrics
+
+    metrics.inc("cache_hits_total", 3, cache="summary")
+    response = client.get("/api/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'email_summariser_cache_hits_total{cache="summary"} 3' in response.text
+    metrics.registry.reset()
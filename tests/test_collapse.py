@@ -0,0 +1,132 @@
+import random
+import time
+
+from collapse import collapse_emails, normalise_subject
+from prompt_builder import count_tokens, format_email
+
+
+def _email(i, subject="Hello", sender="alice@example.com", body="Hi there", thread=None):
+    return {
+        "id": f"msg{i}",
+        "threadId": thread or f"thread{i}",
+        "from": sender,
+        "subject": subject,
+        "date": "Mon, 1 Jan 2025 09:00:00 +0000",
+        "body": body,
+    }
+
+
+def _ci_failure(i, rng):
+    sha = f"{rng.getrandbits(28):07x}"
+    return _email(
+        i,
+        subject=f"[org/repo] Run failed: CI - main ({sha})",
+        sender="GitHub <notifications@github.com>",
+        body=(
+            f"Run failed for main ({sha})\n\n"
+            f"Repository: org/repo\nWorkflow: CI\nDuration: {rng.randint(1, 9)}m\n"
+            f"Job test failed in step Run pytest after {rng.randint(100, 999)} seconds.\n\n"
+            f"View workflow run: https://github.com/org/repo/actions/runs/{rng.randint(1, 10**9)}\n"
+            "You are receiving this because you are subscribed to this repository."
+        ),
+    )
+
+
+def test_normalise_subject_strips_reply_prefixes():
+    assert normalise_subject("RE: Fwd:  Re[2]: Quarterly  Plan") == "quarterly plan"
+
+
+def test_unrelated_emails_are_returned_unchanged():
+    emails = [
+        _email(1, "Lunch?", "alice@example.com", "Want to grab lunch at noon today?"),
+        _email(2, "Invoice 42", "billing@vendor.com", "Your invoice for January is attached."),
+    ]
+    assert collapse_emails(emails) == emails
+
+
+def test_thread_is_collapsed_into_first_email_with_new_lines():
+    emails = [
+        _email(1, "Re: Launch plan", "Bob <bob@example.com>", "Moving launch to Friday.", "t1"),
+        _email(2, "Launch plan", "Alice <alice@example.com>", "Launch is on Thursday.", "t1"),
+        _email(3, "Other", "carol@example.com", "Unrelated note."),
+    ]
+
+    collapsed = collapse_emails(emails)
+
+    assert [e["id"] for e in collapsed] == ["msg1", "msg3"]
+    assert collapsed[0]["collapsed"] == 2
+    assert collapsed[0]["body"].startswith("Moving launch to Friday.")
+    assert "Launch is on Thursday." in collapsed[0]["body"]
+    assert "Also sent by: Alice <alice@example.com>" in collapsed[0]["body"]
+    assert collapsed[1] is emails[2]
+
+
+def test_same_subject_from_other_domain_is_kept_apart():
+    emails = [
+        {**_email(1, "Weekly update", "team@example.com", "Shipped the parser."), "bulk": True},
+        {**_email(2, "Re: Weekly update", "eng@example.com", "Fixed the cache."), "bulk": True},
+        {**_email(3, "Weekly update", "news@other.org", "Our newsletter."), "bulk": True},
+    ]
+    collapsed = collapse_emails(emails)
+    assert [e.get("collapsed", 1) for e in collapsed] == [2, 1]
+
+
+def test_same_subject_from_different_people_is_kept_apart():
+    emails = [
+        _email(1, "Quick question", "Alice <alice@gmail.com>", "Are you free on Friday?"),
+        _email(2, "Quick question", "Bob <bob@gmail.com>", "Can you review my draft?"),
+        _email(3, "Re: Quick question", "Alice <alice@gmail.com>", "Or Saturday?"),
+    ]
+
+    collapsed = collapse_emails(emails)
+
+    assert [e["id"] for e in collapsed] == ["msg1", "msg2"]
+    assert collapsed[0]["collapsed"] == 2
+    assert "Also sent by" not in collapsed[0]["body"]
+    assert collapsed[1] is emails[1]
+
+
+def test_near_duplicate_notifications_are_collapsed():
+    rng = random.Random(0)
+    emails = [_ci_failure(i, rng) for i in range(20)]
+
+    collapsed = collapse_emails(emails)
+
+    assert len(collapsed) == 1
+    assert collapsed[0]["collapsed"] == 20
+    # Repeated boilerplate with a different link each time is not repeated
+    assert collapsed[0]["body"].count("View workflow run") == 1
+
+
+def test_near_duplicate_bodies_from_different_senders_are_kept_apart():
+    rng = random.Random(0)
+    emails = [_ci_failure(i, rng) for i in range(2)]
+    emails[1]["from"] = "ci@other.example"
+    assert len(collapse_emails(emails)) == 2
+
+
+def test_collapse_is_fast_and_cuts_prompt_tokens_on_notification_heavy_days():
+    rng = random.Random(1)
+    emails = [_ci_failure(i, rng) for i in range(1500)]
+    titles = ["Fix retry loop", "Bump httpx", "Add metrics endpoint"]
+    for i, title in enumerate(titles * 500):
+        emails.append(
+            _email(
+                2000 + i,
+                f"Re: [org/repo] {title} (PR #{i % 3})",
+                f"user{i % 7} <notifications@github.com>",
+                f"user{i % 7} commented on this pull request.\n\nLooks good to me ({i % 5}).",
+                f"pr{i % 3}",
+            )
+        )
+
+    start = time.perf_counter()
+    collapsed = collapse_emails(emails)
+    elapsed = time.perf_counter() - start
+
+    def tokens(items):
+        return sum(count_tokens(format_email(i, e)) for i, e in enumerate(items, 1))
+
+    assert len(collapsed) == 4
+    assert tokens(collapsed) < tokens(emails) / 20
+    assert elapsed < 2.0
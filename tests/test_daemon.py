@@ -0,0 +1,152 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import daemon
+from daemon import Daemon, MicroBatcher
+from gmail_client import load_history_id, save_history_id
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_batcher_releases_a_full_batch_at_once():
+    batcher = MicroBatcher(size=3, window=60, clock=FakeClock())
+    batcher.add(["m1", "m2"])
+    assert not batcher.ready()
+
+    batcher.add(["m2", "m3"])
+
+    assert batcher.ready()
+    assert batcher.take() == ["m1", "m2", "m3"]
+    assert len(batcher) == 0
+    assert batcher.deadline() is None
+
+
+def test_batcher_releases_a_partial_batch_after_the_window():
+    clock = FakeClock()
+    batcher = MicroBatcher(size=10, window=60, clock=clock)
+    batcher.add([])
+    assert batcher.deadline() is None
+
+    clock.now = 5
+    batcher.add(["m1"])
+    clock.now = 30
+    batcher.add(["m2"])
+    assert batcher.deadline() == 65
+    assert not batcher.ready()
+
+    clock.now = 65
+    assert batcher.ready()
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = MagicMock()
+    pipeline.message_cache = pipeline.summary_cache = None
+    return pipeline
+
+
+def _emails(ids):
+    return [{"id": msg_id, "threadId": msg_id} for msg_id in ids]
+
+
+@patch("daemon.mark_as_read", return_value={})
+@patch("daemon.summarise_emails", return_value="Summary")
+@patch("daemon.fetch_emails", side_effect=lambda service, ids, cache: _emails(ids))
+@patch("daemon.list_new_message_ids")
+def test_notification_wakes_daemon_and_batch_reaches_slack(
+    mock_list, mock_fetch, mock_summarise, mock_mark_read, pipeline, tmp_path
+):
+    state = str(tmp_path / "state.json")
+    save_history_id("100", state)
+    mock_list.side_effect = [([], "100"), (["m1", "m2"], "110")]
+    worker = Daemon(
+        sync_state=state, batch_size=2, batch_window=60, poll_interval=60, pipeline=pipeline
+    )
+    worker.start()
+    try:
+        _wait_for(lambda: mock_list.call_count == 1)
+        # Already listed up to 100, so this needs no listing
+        worker.notify("100")
+        worker.notify("110")
+        _wait_for(lambda: worker.batches == 1)
+    finally:
+        worker.stop(timeout=5)
+
+    assert mock_list.call_args_list[0].args[1:] == ("100", 20)
+    assert mock_list.call_count == 2
+    mock_fetch.assert_called_once_with(pipeline.service, ["m1", "m2"], cache=None)
+    pipeline.slack.send.assert_called_once_with("Summary")
+    mock_mark_read.assert_called_once_with(pipeline.service, _emails(["m1", "m2"]))
+    assert load_history_id(state) == "110"
+
+
+@patch("daemon.mark_as_read", return_value={})
+@patch("daemon.summarise_emails", return_value="Summary")
+@patch("daemon.fetch_emails", side_effect=lambda service, ids, cache: _emails(ids))
+@patch("daemon.list_new_message_ids")
+def test_polling_batches_by_time_window(
+    mock_list, mock_fetch, mock_summarise, mock_mark_read, pipeline
+):
+    mock_list.side_effect = [(["m1"], "2")] + [([], "2")] * 1000
+    worker = Daemon(batch_size=20, batch_window=0.1, poll_interval=0.02, pipeline=pipeline)
+    worker.start()
+    try:
+        _wait_for(lambda: worker.batches == 1)
+    finally:
+        worker.stop(timeout=5)
+
+    mock_fetch.assert_called_once_with(pipeline.service, ["m1"], cache=None)
+    # Polls kept going while the batch waited for its window
+    assert mock_list.call_count > 2
+
+
+@patch("daemon.mark_as_read", return_value={})
+@patch("daemon.fetch_emails", side_effect=lambda service, ids, cache: _emails(ids))
+@patch("daemon.list_new_message_ids")
+def test_failed_batch_is_retried_then_dropped(
+    mock_list, mock_fetch, mock_mark_read, pipeline, monkeypatch
+):
+    monkeypatch.setattr(daemon, "DAEMON_MAX_ATTEMPTS", 2)
+    mock_list.side_effect = [(["m1"], "2")] + [([], "2")] * 1000
+    pipeline.slack.send.side_effect = RuntimeError("Slack is down")
+    worker = Daemon(batch_size=1, batch_window=0.05, poll_interval=0.02, pipeline=pipeline)
+    with patch("daemon.summarise_emails", return_value="Summary"):
+        worker.start()
+        try:
+            _wait_for(lambda: mock_fetch.call_count == 2)
+            time.sleep(0.2)
+        finally:
+            worker.stop(timeout=5)
+
+    assert mock_fetch.call_count == 2
+    assert worker.batches == 0
+    mock_mark_read.assert_not_called()
+
+
+@patch("daemon.watch_mailbox")
+@patch("daemon.list_new_message_ids", return_value=([], "1"))
+def test_topic_registers_gmail_watch(mock_list, mock_watch, pipeline):
+    worker = Daemon(topic="projects/p/topics/gmail", poll_interval=60, pipeline=pipeline)
+    worker.start()
+    try:
+        _wait_for(lambda: mock_list.called)
+    finally:
+        worker.stop(timeout=5)
+
+    mock_watch.assert_called_once_with(pipeline.service, "projects/p/topics/gmail")
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from fanout import load_roster, provider_limits, run_accounts
+from main import Account, Shared
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    shared = Shared({"gmail": 4, "openai": 1, "slack": 2})
+    yield shared
+    shared.close()
+
+
+def test_load_roster_reads_secrets_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("ALICE_SLACK_TOKEN", "xoxc-alice")
+    path = tmp_path / "roster.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "name": "alice",
+                    "google_refresh_token": "refresh-alice",
+                    "slack_token": "$ALICE_SLACK_TOKEN",
+                    "slack_cookie": "cookie-alice",
+                },
+                {"name": "bob", "sync_state": "bob.json"},
+            ]
+        )
+    )
+
+    alice, bob = load_roster(str(path))
+
+    assert alice.name == "alice"
+    assert alice.google_refresh_token == "refresh-alice"
+    assert alice.slack_token == "xoxc-alice"
+    assert bob.slack_token is None
+    assert bob.sync_state == "bob.json"
+
+
+def test_roster_accounts_do_not_share_the_sync_state(tmp_path, monkeypatch):
+    # Each mailbox has its own history ID, so GMAIL_SYNC_STATE is for the single account
+    monkeypatch.setenv("GMAIL_SYNC_STATE", "state.json")
+    path = tmp_path / "roster.json"
+    path.write_text(json.dumps([{"name": "alice"}, {"name": "bob", "sync_state": "bob.json"}]))
+
+    alice, bob = load_roster(str(path))
+
+    assert alice.sync_state is None
+    assert bob.sync_state == "bob.json"
+
+
+def test_provider_limits_can_be_overridden(monkeypatch):
+    monkeypatch.setenv("FANOUT_OPENAI_CONCURRENCY", "9")
+    assert provider_limits() == {"gmail": 8, "openai": 9, "slack": 2}
+
+
+def _account(name):
+    return Account(name, slack_token=f"xoxc-{name}", slack_cookie=f"cookie-{name}")
+
+
+@patch("main.mark_as_read", return_value={})
+@patch("main.send_to_slack")
+@patch("main.fetch_unread_emails")
+@patch("main.get_gmail_service")
+def test_accounts_run_concurrently_within_provider_limits(
+    mock_service, mock_fetch, mock_slack, mock_mark_read, shared
+):
+    mock_fetch.side_effect = lambda *args, **kwargs: (
+        time.sleep(0.05) or [{"id": "m1", "threadId": "t1", "body": "Hey"}]
+    )
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def fake_summarise(emails, cache=None, client=None):
+        nonlocal active, max_active
+        with lock:
+            active += 1
+            max_active = max(max_active, active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+        return "Daily summary"
+
+    accounts = [_account(name) for name in ("alice", "bob", "carol", "dave")]
+    start = time.perf_counter()
+    with patch("main.summarise_emails", side_effect=fake_summarise):
+        results = run_accounts(accounts, shared)
+    elapsed = time.perf_counter() - start
+
+    assert [r["name"] for r in results] == ["alice", "bob", "carol", "dave"]
+    assert all(r["ok"] and r["emails"] == 1 for r in results)
+    assert set(results[0]["timings"]) == {"fetch", "summarise", "slack", "mark_read", "total"}
+    # Fetches overlap (4 x 50ms serially), summaries respect the OpenAI limit of 1
+    assert elapsed < 0.15
+    assert max_active == 1
+    # Every account posts as its own Slack user over the shared client
+    sent = {call.kwargs["token"] for call in mock_slack.call_args_list}
+    assert sent == {"xoxc-alice", "xoxc-bob", "xoxc-carol", "xoxc-dave"}
+    assert all(call.kwargs["client"] is shared.slack for call in mock_slack.call_args_list)
+
+
+@patch("main.send_to_slack")
+@patch("main.fetch_unread_emails", return_value=[])
+@patch("main.get_gmail_service")
+def test_one_failing_account_does_not_stop_the_others(mock_service, mock_fetch, mock_slack, shared):
+    def fake_send(summary, token, cookie, client):
+        if token == "xoxc-bob":
+            raise RuntimeError("invalid_auth")
+
+    mock_slack.side_effect = fake_send
+
+    results = run_accounts([_account("alice"), _account("bob")], shared)
+
+    assert results[0]["ok"]
+    assert results[1] == {
+        "name": "bob",
+        "ok": False,
+        "error": "RuntimeError",
+        "timings": results[1]["timings"],
+    }
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+import gmail_auth
+from gmail_auth import GmailAuth, build_service
+
+GOOGLE_ENV = {
+    "GOOGLE_REFRESH_TOKEN": "refresh-token",
+    "GOOGLE_CLIENT_ID": "client-id",
+    "GOOGLE_CLIENT_SECRET": "client-secret",
+}
+
+
+@pytest.fixture(autouse=True)
+def google_env(monkeypatch):
+    for key, value in GOOGLE_ENV.items():
+        monkeypatch.setenv(key, value)
+
+
+def _now():
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def _fake_refresh(auth, lifetime=timedelta(hours=1), delay=0.0):
+    """Replace the token endpoint round trip; returns a list of refresh times."""
+    calls = []
+
+    def refresh(request):
+        time.sleep(delay)
+        calls.append(time.monotonic())
+        auth._creds.token = f"token-{len(calls)}"
+        auth._creds.expiry = _now() + lifetime
+
+    auth._creds.refresh = refresh
+    return calls
+
+
+def test_credentials_refreshes_once_then_reuses_token():
+    auth = GmailAuth()
+    calls = _fake_refresh(auth)
+
+    first = auth.credentials()
+    second = auth.credentials()
+
+    assert len(calls) == 1
+    assert first is second
+    assert second.token == "token-1"
+
+
+def test_concurrent_callers_share_one_refresh():
+    auth = GmailAuth()
+    calls = _fake_refresh(auth, delay=0.05)
+
+    threads = [threading.Thread(target=auth.credentials) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+
+
+def test_token_close_to_expiry_is_refreshed_in_background():
+    auth = GmailAuth(margin=600)
+    calls = _fake_refresh(auth)
+    auth._creds.token = "old-token"
+    auth._creds.expiry = _now() + timedelta(minutes=5)
+
+    # Still valid, so the caller gets it without waiting
+    assert auth.credentials().token == "old-token"
+    auth._background.join(timeout=5)
+
+    assert len(calls) == 1
+    assert auth.credentials().token == "token-1"
+
+
+def test_token_is_persisted_and_reused(tmp_path):
+    path = str(tmp_path / "token.json")
+    auth = GmailAuth(path)
+    _fake_refresh(auth)
+    auth.credentials()
+
+    assert oct(os.stat(path).st_mode & 0o777) == "0o600"
+
+    reloaded = GmailAuth(path)
+    calls = _fake_refresh(reloaded)
+    assert reloaded.credentials().token == "token-1"
+    assert calls == []
+
+
+def test_saved_token_for_another_account_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "token.json"
+    auth = GmailAuth(str(path))
+    _fake_refresh(auth)
+    auth.credentials()
+
+    monkeypatch.setenv("GOOGLE_REFRESH_TOKEN", "other-refresh-token")
+    other = GmailAuth(str(path))
+    calls = _fake_refresh(other)
+    other.credentials()
+
+    assert len(calls) == 1
+    assert json.loads(path.read_text())["account"] == other._account()
+
+
+def test_build_service_uses_bundled_discovery_document(monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("discovery document fetched over the network")
+
+    monkeypatch.setattr("httplib2.Http.request", no_network)
+    service = build_service(GmailAuth()._creds)
+
+    assert hasattr(service.users(), "messages")
+    assert gmail_auth._discovery_document() is gmail_auth._discovery_document()
+
+
+def test_build_service_honours_api_and_token_urls(monkeypatch):
+    monkeypatch.setenv("GMAIL_API_URL", "http://127.0.0.1:8080")
+    monkeypatch.setenv("GOOGLE_TOKEN_URI", "http://127.0.0.1:8080/token")
+    auth = GmailAuth()
+    service = build_service(auth._creds)
+
+    request = service.users().messages().list(userId="me")
+    assert request.uri.startswith("http://127.0.0.1:8080/gmail/v1/users/me/messages")
+    assert service.new_batch_http_request()._batch_uri.startswith("http://127.0.0.1:8080/")
+    assert auth._creds.token_uri == "http://127.0.0.1:8080/token"
+    # The cached document itself is left untouched
+    assert gmail_auth._discovery_document()["rootUrl"] == "https://gmail.googleapis.com/"
@@ -1,10 +1,35 @@
+import asyncio
 import base64
-import email
+import json
+import quopri
+from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.policy import SMTP
 from unittest.mock import MagicMock
 
-from gmail_client import _decode_header_value, _extract_body, fetch_unread_emails
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import gmail_client
+from gmail_client import (
+    AsyncGmailClient,
+    LazyEmail,
+    _decode_header_value,
+    _extract_body,
+    attach_lazy_bodies,
+    fetch_new_emails,
+    fetch_unread_emails,
+    iter_unread_emails,
+    list_new_message_ids,
+    load_history_id,
+    mark_as_read,
+    save_history_id,
+    transfer_stats,
+    watch_mailbox,
+)
+from message_cache import MessageCache
 
 
 def _make_raw_email(subject="Test", sender="alice@example.com", body="Hello world"):
@@ -25,6 +50,48 @@ def _make_raw_multipart_email(text_body="Plain text", html_body="<p>HTML</p>"):
     return base64.urlsafe_b64encode(msg.as_bytes()).decode("ascii")
 
 
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+class FakeBatchTransport:
+    """Stands in for the Gmail batch endpoint.
+
+    Responses come from `responses` by request ID when present, otherwise from the
+    sub-request itself. `failures` maps a request ID to errors raised on successive
+    attempts before it succeeds.
+    """
+
+    def __init__(self, responses=None, failures=None):
+        self.responses = responses or {}
+        self.failures = {k: list(v) for k, v in (failures or {}).items()}
+        self.batches = []
+
+    def new_batch(self, callback):
+        transport = self
+        requests = []
+
+        class _Batch:
+            def add(self, request, request_id):
+                requests.append((request_id, request))
+
+            def execute(self, http=None):
+                transport.batches.append([request_id for request_id, _ in requests])
+                for request_id, request in requests:
+                    if transport.failures.get(request_id):
+                        callback(request_id, None, transport.failures[request_id].pop(0))
+                    elif request_id in transport.responses:
+                        callback(request_id, transport.responses[request_id], None)
+                    else:
+                        callback(request_id, request.execute(), None)
+
+        return _Batch()
+
+    def install(self, service):
+        service.new_batch_http_request.side_effect = self.new_batch
+        return self
+
+
 def test_decode_header_value_plain():
     assert _decode_header_value("Hello World") == "Hello World"
 
@@ -36,23 +103,53 @@ def test_decode_header_value_encoded():
 
 def test_extract_body_plain():
     msg = MIMEText("Simple body", "plain", "utf-8")
-    mime_msg = email.message_from_bytes(msg.as_bytes())
-    assert _extract_body(mime_msg) == "Simple body"
+    assert _extract_body(msg.as_bytes()) == "Simple body"
 
 
 def test_extract_body_multipart():
     msg = MIMEMultipart("alternative")
     msg.attach(MIMEText("Plain version", "plain", "utf-8"))
     msg.attach(MIMEText("<p>HTML version</p>", "html", "utf-8"))
-    mime_msg = email.message_from_bytes(msg.as_bytes())
-    assert _extract_body(mime_msg) == "Plain version"
+    assert _extract_body(msg.as_bytes()) == "Plain version"
 
 
 def test_extract_body_empty():
     msg = MIMEMultipart("alternative")
     msg.attach(MIMEText("<p>Only HTML</p>", "html", "utf-8"))
-    mime_msg = email.message_from_bytes(msg.as_bytes())
-    assert _extract_body(mime_msg) == ""
+    assert _extract_body(msg.as_bytes()) == ""
+
+
+def test_extract_body_finds_nested_text_after_attachment():
+    inner = MIMEMultipart("alternative")
+    inner.attach(MIMEText("Nested plain", "plain", "utf-8"))
+    msg = MIMEMultipart("mixed")
+    msg.attach(MIMEApplication(b"\x00" * 10_000, Name="blob.bin"))
+    msg.attach(inner)
+    assert _extract_body(msg.as_bytes(policy=SMTP)) == "Nested plain"
+
+
+@pytest.mark.parametrize("charset", ["utf-8", "iso-8859-1", "utf-16"])
+@pytest.mark.parametrize("cte", ["base64", "quoted-printable", "8bit"])
+def test_extract_body_truncates_to_limit(charset, cte):
+    body = "caf\u00e9 " * 2000
+    msg = MIMEText("", "plain", charset)
+    del msg["Content-Transfer-Encoding"]
+    payload = body.encode(charset)
+    if cte == "base64":
+        msg.set_payload(base64.encodebytes(payload).decode("ascii"))
+    elif cte == "quoted-printable":
+        msg.set_payload(quopri.encodestring(payload).decode("ascii"))
+    else:
+        msg.set_payload(payload.decode("ascii", "surrogateescape"))
+    msg["Content-Transfer-Encoding"] = cte
+
+    assert _extract_body(msg.as_bytes(), limit=100) == body[:100] + "..."
+    assert _extract_body(msg.as_bytes(), limit=20_000) == body
+
+
+def test_extract_body_non_multipart_returns_any_content_type():
+    msg = MIMEText("<p>Only HTML</p>", "html", "utf-8")
+    assert _extract_body(msg.as_bytes()) == "<p>Only HTML</p>"
 
 
 def test_fetch_unread_emails():
@@ -68,6 +165,7 @@ def test_fetch_unread_emails():
         "raw": raw,
         "snippet": "Let's meet",
     }
+    FakeBatchTransport().install(service)
 
     result = fetch_unread_emails(service, max_results=10)
 
@@ -86,6 +184,35 @@ def test_fetch_unread_emails_none():
     assert result == []
 
 
+@pytest.mark.parametrize(
+    ("headers", "bulk"),
+    [
+        ({}, False),
+        ({"List-Unsubscribe": "<mailto:unsubscribe@example.com>"}, True),
+        ({"List-Id": "Team <team.example.com>"}, True),
+        ({"Precedence": "Bulk"}, True),
+        ({"Precedence": "first-class"}, False),
+        ({"Auto-Submitted": "auto-generated"}, True),
+        ({"Auto-Submitted": "no"}, False),
+    ],
+)
+def test_parse_raw_message_flags_bulk_mail(headers, bulk):
+    msg = MIMEText("Hello", "plain", "utf-8")
+    for name, value in headers.items():
+        msg[name] = value
+    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("ascii")
+
+    assert gmail_client._parse_raw_message("m1", {"raw": raw})["bulk"] is bulk
+
+
+def test_metadata_emails_flag_bulk_mail():
+    message = _metadata("Deals")
+    message["payload"]["headers"].append({"name": "list-unsubscribe", "value": "<https://x>"})
+
+    assert gmail_client._email_from_metadata("m1", message)["bulk"] is True
+    assert gmail_client._email_from_metadata("m2", _metadata("Hi"))["bulk"] is False
+
+
 def test_fetch_unread_emails_truncates_long_body():
     long_body = "x" * 3000
     raw = _make_raw_email(body=long_body)
@@ -98,7 +225,558 @@ def test_fetch_unread_emails_truncates_long_body():
         "raw": raw,
         "snippet": "xxx",
     }
+    FakeBatchTransport().install(service)
 
     result = fetch_unread_emails(service)
     assert len(result[0]["body"]) == 2003
     assert result[0]["body"].endswith("...")
+
+
+def _service_listing(msg_ids):
+    service = MagicMock()
+    service.users().messages().list().execute.return_value = {
+        "messages": [{"id": msg_id} for msg_id in msg_ids],
+    }
+    return service
+
+
+def test_fetch_unread_emails_batches_in_chunks_and_keeps_order(monkeypatch):
+    monkeypatch.setattr(gmail_client, "BATCH_SIZE", 2)
+    msg_ids = ["m1", "m2", "m3", "m4", "m5"]
+    service = _service_listing(msg_ids)
+    transport = FakeBatchTransport(
+        responses={
+            msg_id: {"raw": _make_raw_email(subject=msg_id), "threadId": f"t-{msg_id}"}
+            for msg_id in msg_ids
+        }
+    ).install(service)
+
+    result = fetch_unread_emails(service)
+
+    assert [e["id"] for e in result] == msg_ids
+    assert [e["subject"] for e in result] == msg_ids
+    assert transport.batches == [["m1", "m2"], ["m3", "m4"], ["m5"]]
+
+
+def test_fetch_unread_emails_retries_only_failed_subrequests(monkeypatch):
+    monkeypatch.setattr(gmail_client, "BATCH_RETRY_DELAY", 0)
+    msg_ids = ["m1", "m2", "m3"]
+    service = _service_listing(msg_ids)
+    transport = FakeBatchTransport(
+        responses={msg_id: {"raw": _make_raw_email(subject=msg_id)} for msg_id in msg_ids},
+        failures={"m2": [_http_error(429), _http_error(503)]},
+    ).install(service)
+
+    result = fetch_unread_emails(service)
+
+    assert [e["subject"] for e in result] == msg_ids
+    assert transport.batches == [["m1", "m2", "m3"], ["m2"], ["m2"]]
+
+
+def test_fetch_unread_emails_skips_deleted_messages():
+    service = _service_listing(["m1", "m2"])
+    FakeBatchTransport(
+        responses={"m2": {"raw": _make_raw_email(subject="kept")}},
+        failures={"m1": [_http_error(404)]},
+    ).install(service)
+
+    result = fetch_unread_emails(service)
+
+    assert [e["id"] for e in result] == ["m2"]
+
+
+def test_fetch_unread_emails_raises_after_exhausting_retries(monkeypatch):
+    monkeypatch.setattr(gmail_client, "BATCH_RETRY_DELAY", 0)
+    service = _service_listing(["m1"])
+    FakeBatchTransport(failures={"m1": [_http_error(500)] * 10}).install(service)
+
+    with pytest.raises(HttpError):
+        fetch_unread_emails(service)
+
+
+def test_fetch_unread_emails_raises_on_non_retryable_error():
+    service = _service_listing(["m1"])
+    transport = FakeBatchTransport(failures={"m1": [_http_error(403)]}).install(service)
+
+    with pytest.raises(HttpError):
+        fetch_unread_emails(service)
+    assert len(transport.batches) == 1
+
+
+def _pipeline_service(msg_ids, failures=None):
+    service = _service_listing(msg_ids)
+    transport = FakeBatchTransport(
+        responses={msg_id: {"raw": _make_raw_email(subject=msg_id)} for msg_id in msg_ids},
+        failures=failures,
+    ).install(service)
+    return service, transport
+
+
+@pytest.mark.parametrize("parse_mode", ["thread", "process"])
+def test_iter_unread_emails_yields_every_message(parse_mode):
+    msg_ids = [f"m{i}" for i in range(12)]
+    service, transport = _pipeline_service(msg_ids)
+
+    result = list(iter_unread_emails(service, parse_mode=parse_mode, chunk_size=5, queue_size=3))
+
+    assert sorted(e["id"] for e in result) == sorted(msg_ids)
+    assert all(e["subject"] == e["id"] for e in result)
+    assert sorted(len(batch) for batch in transport.batches) == [2, 5, 5]
+
+
+def test_iter_unread_emails_none():
+    service = MagicMock()
+    service.users().messages().list().execute.return_value = {}
+
+    assert list(iter_unread_emails(service)) == []
+
+
+def test_iter_unread_emails_is_lazy():
+    service, _ = _pipeline_service([f"m{i}" for i in range(20)])
+
+    emails = iter_unread_emails(service, chunk_size=2, queue_size=2)
+    first = next(emails)
+    emails.close()
+
+    assert first["id"].startswith("m")
+
+
+def test_iter_unread_emails_propagates_fetch_errors():
+    service, _ = _pipeline_service(["m1", "m2"], failures={"m2": [_http_error(403)]})
+
+    with pytest.raises(HttpError):
+        list(iter_unread_emails(service, chunk_size=1))
+
+
+def test_iter_unread_emails_rejects_unknown_parse_mode():
+    with pytest.raises(ValueError, match="parse_mode"):
+        list(iter_unread_emails(MagicMock(), parse_mode="fiber"))
+
+
+def test_iter_unread_emails_follows_every_page():
+    service, _ = _pipeline_service([])
+    pages = [
+        {"messages": [{"id": "m1"}, {"id": "m2"}], "nextPageToken": "p2"},
+        {"messages": [{"id": "m3"}], "nextPageToken": "p3"},
+        {"messages": [{"id": "m4"}]},
+    ]
+    FakeBatchTransport(
+        responses={f"m{i}": {"raw": _make_raw_email(subject=f"m{i}")} for i in range(1, 5)}
+    ).install(service)
+    messages = service.users().messages()
+    messages.list().execute.side_effect = pages
+    messages.list.reset_mock()
+
+    result = list(iter_unread_emails(service, max_results=None, since=None))
+
+    assert sorted(e["id"] for e in result) == ["m1", "m2", "m3", "m4"]
+    calls = messages.list.call_args_list
+    assert [c.kwargs["pageToken"] for c in calls] == [None, "p2", "p3"]
+    assert all(c.kwargs["q"] == "category:primary" for c in calls)
+
+
+def test_iter_unread_emails_stops_listing_at_max_results():
+    service, _ = _pipeline_service([])
+    messages = service.users().messages()
+    messages.list().execute.side_effect = [
+        {"messages": [{"id": f"m{i}"} for i in range(500)], "nextPageToken": "p2"},
+        {"messages": [{"id": f"m{i}"} for i in range(500, 700)], "nextPageToken": "p3"},
+    ]
+    messages.list.reset_mock()
+    FakeBatchTransport(
+        responses={f"m{i}": {"raw": _make_raw_email()} for i in range(700)}
+    ).install(service)
+
+    result = list(iter_unread_emails(service, max_results=700))
+
+    assert len(result) == 700
+    assert [c.kwargs["maxResults"] for c in messages.list.call_args_list] == [500, 200]
+    assert "after:" in messages.list.call_args.kwargs["q"]
+
+
+def test_iter_unread_emails_stops_at_max_bytes():
+    msg_ids = [f"m{i}" for i in range(10)]
+    service, _ = _pipeline_service(msg_ids)
+    size = len(_make_raw_email(subject="m0"))
+
+    result = list(iter_unread_emails(service, chunk_size=1, max_bytes=size * 3))
+
+    assert len(result) == 3
+
+
+def _history_record(msg_id, labels=("UNREAD", "INBOX", "CATEGORY_PERSONAL")):
+    return {"messagesAdded": [{"message": {"id": msg_id, "labelIds": list(labels)}}]}
+
+
+def test_fetch_new_emails_uses_history_since_last_sync():
+    service = MagicMock()
+    service.users().history().list().execute.side_effect = [
+        {
+            "history": [_history_record("m1"), _history_record("promo", ("UNREAD", "INBOX"))],
+            "nextPageToken": "page2",
+            "historyId": "105",
+        },
+        {"history": [_history_record("m2"), _history_record("m1")], "historyId": "110"},
+    ]
+    FakeBatchTransport(
+        responses={msg_id: {"raw": _make_raw_email(subject=msg_id)} for msg_id in ["m1", "m2"]}
+    ).install(service)
+
+    emails, history_id = fetch_new_emails(service, "100")
+
+    assert [e["id"] for e in emails] == ["m1", "m2"]
+    assert history_id == "110"
+    service.users().messages().list.assert_not_called()
+    history_calls = service.users().history().list.call_args_list
+    assert history_calls[-2].kwargs["startHistoryId"] == "100"
+    assert history_calls[-1].kwargs["pageToken"] == "page2"
+
+
+def test_fetch_new_emails_falls_back_to_full_list_when_history_expired():
+    service = _service_listing(["m1"])
+    service.users().history().list().execute.side_effect = _http_error(404)
+    service.users().getProfile().execute.return_value = {"historyId": "200"}
+    FakeBatchTransport(responses={"m1": {"raw": _make_raw_email()}}).install(service)
+
+    emails, history_id = fetch_new_emails(service, "1")
+
+    assert [e["id"] for e in emails] == ["m1"]
+    assert history_id == "200"
+
+
+def test_fetch_new_emails_without_history_does_full_list():
+    service = _service_listing([])
+    service.users().getProfile().execute.return_value = {"historyId": "300"}
+
+    assert fetch_new_emails(service, None) == ([], "300")
+    service.users().history().list().execute.assert_not_called()
+
+
+def test_fetch_new_emails_raises_other_history_errors():
+    service = MagicMock()
+    service.users().history().list().execute.side_effect = _http_error(500)
+
+    with pytest.raises(HttpError):
+        fetch_new_emails(service, "1")
+
+
+def test_list_new_message_ids_returns_ids_without_fetching():
+    service = MagicMock()
+    service.users().history().list().execute.return_value = {
+        "history": [_history_record("m1"), _history_record("m2")],
+        "historyId": "120",
+    }
+
+    assert list_new_message_ids(service, "100") == (["m1", "m2"], "120")
+    service.new_batch_http_request.assert_not_called()
+
+
+def test_watch_mailbox_registers_inbox_with_topic():
+    service = MagicMock()
+    service.users().watch().execute.return_value = {"historyId": "1", "expiration": "2"}
+
+    response = watch_mailbox(service, "projects/p/topics/gmail")
+
+    assert response == {"historyId": "1", "expiration": "2"}
+    body = service.users().watch.call_args.kwargs["body"]
+    assert body["topicName"] == "projects/p/topics/gmail"
+    assert body["labelIds"] == ["INBOX"]
+
+
+def test_history_id_round_trip(tmp_path):
+    path = str(tmp_path / "state.json")
+
+    assert load_history_id(path) is None
+    save_history_id("12345", path)
+    assert load_history_id(path) == "12345"
+
+
+def test_fetch_unread_emails_skips_get_for_cached_messages(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache.db"))
+    service = _service_listing(["m1", "m2"])
+    transport = FakeBatchTransport(
+        responses={msg_id: {"raw": _make_raw_email(subject=msg_id)} for msg_id in ["m1", "m2"]}
+    ).install(service)
+
+    first = fetch_unread_emails(service, cache=cache)
+    second = fetch_unread_emails(service, cache=cache)
+
+    assert first == second
+    assert transport.batches == [["m1", "m2"]]
+    assert cache.stats() == {"hits": 2, "misses": 2, "entries": 2}
+
+
+def test_iter_unread_emails_yields_cached_messages_first(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache.db"))
+    cache.put_many([{"id": "m2", "subject": "cached"}])
+    service, transport = _pipeline_service(["m1", "m2", "m3"])
+
+    result = list(iter_unread_emails(service, cache=cache))
+
+    assert result[0] == {"id": "m2", "subject": "cached"}
+    assert sorted(e["id"] for e in result) == ["m1", "m2", "m3"]
+    assert transport.batches == [["m1", "m3"]]
+    assert len(cache) == 3
+
+
+def _b64(text, charset="utf-8"):
+    return base64.urlsafe_b64encode(text.encode(charset)).decode("ascii")
+
+
+def _metadata(subject):
+    return {
+        "threadId": f"t-{subject}",
+        "snippet": "snip",
+        "payload": {
+            "headers": [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": "alice@example.com"},
+                {"name": "Date", "value": "Mon, 1 Jan 2025 09:00:00 +0000"},
+            ]
+        },
+    }
+
+
+def _full(*parts):
+    return {"payload": {"mimeType": "multipart/mixed", "parts": list(parts)}}
+
+
+def _part(mime_type, body, charset="utf-8"):
+    return {
+        "mimeType": mime_type,
+        "headers": [{"name": "Content-Type", "value": f"{mime_type}; charset={charset}"}],
+        "body": body,
+    }
+
+
+class _FormatAwareTransport(FakeBatchTransport):
+    # Answers each sub-request according to the format it asked for
+    def __init__(self, by_format, **kwargs):
+        super().__init__(**kwargs)
+        self.by_format = by_format
+        self.formats = []
+
+    def new_batch(self, callback):
+        batch = super().new_batch(callback)
+        add = batch.add
+
+        def _add(request, request_id):
+            fmt = request.kwargs["format"]
+            self.formats.append(fmt)
+            self.responses[request_id] = self.by_format[fmt][request_id]
+            add(request, request_id)
+
+        batch.add = _add
+        return batch
+
+
+def _lazy_service(by_format):
+    service = _service_listing(list(by_format["metadata"]))
+
+    class _Get:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    service.users().messages().get.side_effect = lambda **kwargs: _Get(**kwargs)
+    transport = _FormatAwareTransport(by_format).install(service)
+    return service, transport
+
+
+def test_fetch_unread_emails_lazy_bodies_fetches_headers_first():
+    service, transport = _lazy_service(
+        {
+            "metadata": {"m1": _metadata("One"), "m2": _metadata("Two")},
+            "full": {
+                "m1": _full(
+                    _part("text/html", {"data": _b64("<p>x</p>")}),
+                    _part("text/plain", {"data": _b64("Body one")}),
+                ),
+                "m2": {
+                    "payload": _part(
+                        "text/plain", {"data": _b64("caf\u00e9", "latin-1")}, charset="iso-8859-1"
+                    )
+                },
+            },
+        }
+    )
+
+    emails = fetch_unread_emails(service, lazy_bodies=True)
+
+    assert [e["subject"] for e in emails] == ["One", "Two"]
+    assert all(isinstance(e, LazyEmail) for e in emails)
+    assert "body" not in json.loads(json.dumps(emails))[0]
+    assert transport.formats == ["metadata", "metadata"]
+
+    assert emails[1]["body"] == "caf\u00e9"
+    assert emails[0].get("body") == "Body one"
+    assert transport.formats == ["metadata", "metadata", "full", "full"]
+
+
+def test_lazy_body_downloads_inline_skipped_text_part():
+    service, _ = _lazy_service(
+        {
+            "metadata": {"m1": _metadata("Big")},
+            "full": {
+                "m1": _full(
+                    _part("text/plain", {"attachmentId": "att1", "size": 500000}),
+                    _part("application/pdf", {"attachmentId": "att2", "size": 9000000}),
+                )
+            },
+        }
+    )
+    service.users().messages().attachments().get().execute.return_value = {"data": _b64("y" * 3000)}
+
+    [email] = fetch_unread_emails(service, lazy_bodies=True)
+
+    assert email["body"] == "y" * 2000 + "..."
+    service.users().messages().attachments().get.assert_called_with(
+        userId="me", messageId="m1", id="att1"
+    )
+
+
+def test_attach_lazy_bodies_only_wraps_emails_without_body():
+    service, _ = _lazy_service(
+        {"metadata": {}, "full": {"m2": {"payload": _part("text/plain", {"data": _b64("Two")})}}}
+    )
+
+    emails = attach_lazy_bodies(service, [{"id": "m1", "body": "One"}, {"id": "m2"}])
+
+    assert [e["body"] for e in emails] == ["One", "Two"]
+
+
+def test_failed_body_fetch_is_retried_on_next_access(monkeypatch):
+    service, _ = _lazy_service(
+        {"metadata": {}, "full": {"m1": {"payload": _part("text/plain", {"data": _b64("One")})}}}
+    )
+    fetch_messages = gmail_client._fetch_messages
+    failures = [_http_error(503)]
+
+    def _flaky_fetch(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return fetch_messages(*args, **kwargs)
+
+    monkeypatch.setattr(gmail_client, "_fetch_messages", _flaky_fetch)
+    [email] = attach_lazy_bodies(service, [{"id": "m1"}])
+
+    with pytest.raises(HttpError):
+        email["body"]
+
+    assert "body" not in email
+    assert email["body"] == "One"
+
+
+def test_async_gmail_client_returns_plain_emails_with_bodies(monkeypatch):
+    service, _ = _lazy_service(
+        {"metadata": {}, "full": {"m2": {"payload": _part("text/plain", {"data": _b64("Two")})}}}
+    )
+    auth = MagicMock()
+    monkeypatch.setattr(gmail_client, "build_service", lambda creds: service)
+    gmail = AsyncGmailClient(max_workers=2, auth=auth)
+
+    async def _load_twice():
+        first = await gmail.load_bodies([{"id": "m1", "body": "One"}, {"id": "m2"}])
+        await gmail.load_bodies([{"id": "m1", "body": "One"}])
+        return first
+
+    emails = asyncio.run(_load_twice())
+    gmail.close()
+
+    assert emails == [{"id": "m1", "body": "One"}, {"id": "m2", "body": "Two"}]
+    assert all(type(e) is dict for e in emails)
+    # Every call checks the shared token, which refreshes only when due
+    assert auth.credentials.call_count == 2
+
+
+def test_transfer_stats_counts_downloaded_bytes():
+    raw = _make_raw_email(body="z" * 100)
+    service = _service_listing(["m1"])
+    FakeBatchTransport(responses={"m1": {"raw": raw}}).install(service)
+    transfer_stats.reset()
+
+    fetch_unread_emails(service)
+
+    assert transfer_stats.bytes == len(raw)
+    assert transfer_stats.bytes_for(service) == len(raw)
+
+
+def test_transfer_stats_keeps_services_apart():
+    raw = _make_raw_email(body="z" * 100)
+    first, second = _service_listing(["m1"]), _service_listing(["m1", "m2"])
+    FakeBatchTransport(responses={"m1": {"raw": raw}, "m2": {"raw": raw}}).install(first)
+    FakeBatchTransport(responses={"m1": {"raw": raw}, "m2": {"raw": raw}}).install(second)
+    transfer_stats.reset()
+
+    fetch_unread_emails(first)
+    fetch_unread_emails(second)
+
+    assert transfer_stats.bytes_for(first) == len(raw)
+    assert transfer_stats.bytes_for(second) == 2 * len(raw)
+    assert transfer_stats.bytes == 3 * len(raw)
+
+
+def _emails_in_threads(count, threads):
+    return [{"id": f"m{i}", "threadId": f"t{i % threads}"} for i in range(count)]
+
+
+def test_mark_as_read_batches_thread_modifications(monkeypatch):
+    monkeypatch.setattr(gmail_client, "BATCH_SIZE", 3)
+    service = MagicMock()
+    transport = FakeBatchTransport(responses={f"t{i}": {} for i in range(5)}).install(service)
+
+    failures = mark_as_read(service, _emails_in_threads(8, threads=5))
+
+    assert failures == {}
+    batch_modify = service.users().messages().batchModify.call_args.kwargs
+    assert batch_modify["body"]["ids"] == [f"m{i}" for i in range(8)]
+    # One batch call per BATCH_SIZE threads instead of one call per thread
+    assert transport.batches == [["t0", "t1", "t2"], ["t3", "t4"]]
+
+
+def test_mark_as_read_splits_messages_into_batch_modify_calls(monkeypatch):
+    monkeypatch.setattr(gmail_client, "MODIFY_BATCH_SIZE", 3)
+    service = MagicMock()
+    FakeBatchTransport(responses={"t0": {}}).install(service)
+
+    mark_as_read(service, _emails_in_threads(8, threads=1))
+
+    calls = service.users().messages().batchModify.call_args_list
+    assert [call.kwargs["body"]["ids"] for call in calls] == [
+        ["m0", "m1", "m2"],
+        ["m3", "m4", "m5"],
+        ["m6", "m7"],
+    ]
+
+
+def test_mark_as_read_stays_under_gmails_id_limit(monkeypatch):
+    from google.oauth2.credentials import Credentials
+
+    from benchmarks.fakes import FakeGmail
+    from gmail_auth import build_service
+
+    fake = FakeGmail()
+    monkeypatch.setenv("GMAIL_API_URL", fake.url)
+    emails = [{"id": f"m{i}"} for i in range(2500)]
+    try:
+        service = build_service(Credentials("fake-token"))
+        mark_as_read(service, emails)
+        # The fake refuses what Gmail refuses
+        monkeypatch.setattr(gmail_client, "MODIFY_BATCH_SIZE", len(emails))
+        with pytest.raises(HttpError):
+            mark_as_read(service, emails)
+    finally:
+        fake.close()
+
+
+def test_mark_as_read_reports_threads_that_fail(monkeypatch):
+    monkeypatch.setattr(gmail_client.time, "sleep", lambda s: None)
+    service = MagicMock()
+    FakeBatchTransport(
+        responses={"t0": {}, "t1": {}, "t2": {}},
+        failures={"t1": [_http_error(403)], "t2": [_http_error(503)]},
+    ).install(service)
+
+    failures = mark_as_read(service, _emails_in_threads(3, threads=3))
+
+    # 503 is retried and succeeds; 403 is reported, not raised
+    assert list(failures) == ["t1"]
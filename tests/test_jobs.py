@@ -0,0 +1,165 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import jobs
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, run_job
+from worker import work
+
+EMAILS = [{"id": "m1", "threadId": "t1", "from": "a@b.com", "subject": "Hi", "body": "Hey"}]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), retry_delay=0)
+    yield queue
+    queue.close()
+
+
+def test_enqueue_with_same_idempotency_key_returns_existing_job(queue):
+    first = queue.enqueue({"max_results": 5}, idempotency_key="daily-2025-01-01")
+    second = queue.enqueue({"max_results": 9}, idempotency_key="daily-2025-01-01")
+    other = queue.enqueue({"max_results": 5})
+
+    assert second["id"] == first["id"]
+    assert second["params"] == {"max_results": 5}
+    assert other["id"] != first["id"]
+
+
+def test_each_job_is_claimed_by_one_worker(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    JobQueue(path).enqueue({})
+    claimed = []
+
+    def _claim():
+        # Separate connections, as in separate worker processes
+        claimed.append(JobQueue(path).claim())
+
+    threads = [threading.Thread(target=_claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([job for job in claimed if job is not None]) == 1
+
+
+def test_failed_job_is_retried_then_marked_failed(queue):
+    job_id = queue.enqueue({})["id"]
+
+    for _ in range(queue.max_attempts - 1):
+        queue.fail(queue.claim()["id"], "RuntimeError: boom")
+        assert queue.get(job_id)["status"] == QUEUED
+
+    queue.fail(queue.claim()["id"], "RuntimeError: boom")
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["attempts"] == queue.max_attempts
+    assert queue.claim() is None
+
+
+def test_job_with_expired_lease_is_reclaimed(queue):
+    job_id = queue.enqueue({})["id"]
+    assert queue.claim(lease=-1)["id"] == job_id
+    assert queue.get(job_id)["status"] == RUNNING
+
+    # The first worker died without finishing
+    assert queue.claim()["id"] == job_id
+
+
+def test_job_whose_lease_expires_on_its_last_attempt_is_failed(queue):
+    job_id = queue.enqueue({})["id"]
+    for _ in range(queue.max_attempts):
+        assert queue.claim(lease=-1)["id"] == job_id
+
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["attempts"] == queue.max_attempts
+    assert job["error"] == "Lease expired"
+
+
+def _pipeline():
+    return MagicMock(message_cache=None, summary_cache=None)
+
+
+@patch("jobs.mark_as_read", return_value={})
+@patch("jobs.summarise_emails", return_value="Daily summary")
+@patch("jobs.fetch_unread_emails", return_value=EMAILS)
+def test_retried_job_skips_completed_stages(mock_fetch, mock_summarise, mock_mark_read, queue):
+    pipeline = _pipeline()
+    pipeline.slack.send.side_effect = [RuntimeError("Slack down"), None]
+    queue.enqueue({"max_results": 5})
+
+    job = queue.claim()
+    with pytest.raises(RuntimeError):
+        run_job(queue, job, pipeline)
+    queue.fail(job["id"], "RuntimeError: Slack down")
+
+    result = run_job(queue, queue.claim(), pipeline)
+
+    assert result == {"count": 1, "mark_read_failures": []}
+    mock_fetch.assert_called_once()
+    assert mock_fetch.call_args.kwargs["max_results"] == 5
+    mock_summarise.assert_called_once()
+    assert pipeline.slack.send.call_count == 2
+    mock_mark_read.assert_called_once_with(pipeline.service, EMAILS)
+
+
+@patch("jobs.mark_as_read")
+@patch("jobs.summarise_emails", return_value="Daily summary")
+@patch("jobs.fetch_unread_emails", return_value=EMAILS)
+def test_slack_is_not_resent_when_mark_as_read_fails(
+    mock_fetch, mock_summarise, mock_mark_read, queue
+):
+    mock_mark_read.side_effect = [RuntimeError("Gmail down"), {"t1": "403"}]
+    pipeline = _pipeline()
+    queue.enqueue({})
+
+    job = queue.claim()
+    with pytest.raises(RuntimeError):
+        run_job(queue, job, pipeline)
+    queue.fail(job["id"], "RuntimeError: Gmail down")
+    result = run_job(queue, queue.claim(), pipeline)
+
+    pipeline.slack.send.assert_called_once_with("Daily summary")
+    assert result["mark_read_failures"] == ["t1"]
+
+
+@patch("jobs.summarise_emails")
+@patch("jobs.fetch_unread_emails", return_value=[])
+def test_empty_inbox_sends_inbox_is_clear(mock_fetch, mock_summarise, queue):
+    pipeline = _pipeline()
+    queue.enqueue({})
+
+    assert run_job(queue, queue.claim(), pipeline) == {"count": 0, "mark_read_failures": []}
+    mock_summarise.assert_not_called()
+    pipeline.slack.send.assert_called_once_with("Inbox is clear!")
+
+
+def test_worker_runs_queued_jobs_until_stopped(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    job_id = queue.enqueue({})["id"]
+    stop = threading.Event()
+
+    def fake_run_job(job_queue, job, pipeline):
+        stop.set()
+        return {"count": 0, "mark_read_failures": []}
+
+    monkeypatch.setattr("worker.Pipeline", MagicMock)
+    monkeypatch.setattr("worker.run_job", fake_run_job)
+    work(path, stop, poll_interval=0.01)
+
+    job = queue.get(job_id)
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"count": 0, "mark_read_failures": []}
+
+
+def test_open_job_queue_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv("JOB_QUEUE", raising=False)
+    assert jobs.open_job_queue() is None
+
+    monkeypatch.setenv("JOB_QUEUE", str(tmp_path / "jobs.db"))
+    assert isinstance(jobs.open_job_queue(), JobQueue)
@@ -1,5 +1,7 @@
 from unittest.mock import patch
 
+import pytest
+
 
 @patch("main.mark_as_read")
 @patch("main.send_to_slack")
@@ -38,3 +40,160 @@ def test_main_no_emails(mock_service, mock_fetch, mock_summarise, mock_slack, mo
     mock_summarise.assert_not_called()
     mock_slack.assert_called_once_with("Inbox is clear!")
     mock_mark_read.assert_not_called()
+
+
+@patch.dict("os.environ", {"GMAIL_SYNC_STATE": "state.json"})
+@patch("main.save_history_id")
+@patch("main.load_history_id", return_value="100")
+@patch("main.mark_as_read")
+@patch("main.send_to_slack")
+@patch("main.summarise_emails", return_value="Daily summary")
+@patch("main.fetch_new_emails")
+@patch("main.get_gmail_service")
+def test_main_incremental_sync(
+    mock_service, mock_fetch, mock_summarise, mock_slack, mock_mark_read, mock_load, mock_save
+):
+    mock_fetch.return_value = (
+        [{"id": "msg1", "from": "a@b.com", "subject": "Hi", "date": "", "body": "Hey"}],
+        "110",
+    )
+
+    from main import main
+
+    main()
+
+    mock_fetch.assert_called_once_with(
+        mock_service.return_value, "100", cache=None, lazy_bodies=False
+    )
+    mock_mark_read.assert_called_once()
+    mock_save.assert_called_once_with("110", "state.json")
+
+
+@patch.dict("os.environ", {"GMAIL_SYNC_STATE": "state.json"})
+@patch("main.save_history_id")
+@patch("main.load_history_id", return_value="100")
+@patch("main.send_to_slack")
+@patch("main.fetch_new_emails", return_value=([], "120"))
+@patch("main.get_gmail_service")
+def test_main_incremental_sync_no_new_emails(
+    mock_service, mock_fetch, mock_slack, mock_load, mock_save
+):
+    from main import main
+
+    main()
+
+    mock_slack.assert_not_called()
+    mock_save.assert_called_once_with("120", "state.json")
+
+
+@patch.dict("os.environ", {"GMAIL_SYNC_STATE": "state.json"})
+@patch("main.save_history_id")
+@patch("main.load_history_id", return_value="100")
+@patch("main.send_to_slack", side_effect=RuntimeError("slack down"))
+@patch("main.summarise_emails", return_value="Daily summary")
+@patch("main.fetch_new_emails")
+@patch("main.get_gmail_service")
+def test_main_incremental_sync_keeps_state_on_failure(
+    mock_service, mock_fetch, mock_summarise, mock_slack, mock_load, mock_save
+):
+    mock_fetch.return_value = ([{"id": "msg1", "body": "Hey"}], "110")
+
+    from main import main
+
+    with pytest.raises(SystemExit):
+        main()
+
+    mock_save.assert_not_called()
+
+
+@patch.dict("os.environ", {"GMAIL_BACKLOG": "1", "GMAIL_BACKLOG_MAX_EMAILS": "5000"})
+@patch("main.mark_as_read", return_value={})
+@patch("main.send_to_slack")
+@patch("main.summarise_backlog")
+@patch("main.iter_unread_emails")
+@patch("main.fetch_unread_emails")
+@patch("main.get_gmail_service")
+def test_main_backlog_mode_streams_emails_into_summariser(
+    mock_service, mock_fetch, mock_iter, mock_summarise, mock_slack, mock_mark_read
+):
+    mock_iter.return_value = iter(
+        {"id": f"msg{i}", "threadId": f"t{i}", "body": "x" * 1000} for i in range(3)
+    )
+    mock_summarise.side_effect = lambda emails, **kwargs: f"{len(list(emails))} summarised"
+
+    from main import main
+
+    main()
+
+    mock_fetch.assert_not_called()
+    assert mock_iter.call_args.kwargs["max_results"] == 5001
+    assert mock_iter.call_args.kwargs["since"] is None
+    mock_slack.assert_called_once_with("3 summarised")
+    refs = mock_mark_read.call_args[0][1]
+    assert refs == [{"id": f"msg{i}", "threadId": f"t{i}"} for i in range(3)]
+
+
+@pytest.mark.parametrize("unread, truncated", [(3, False), (4, True)])
+@patch.dict("os.environ", {"GMAIL_BACKLOG": "1", "GMAIL_BACKLOG_MAX_EMAILS": "3"})
+@patch("main.mark_as_read", return_value={})
+@patch("main.send_to_slack")
+@patch("main.summarise_backlog")
+@patch("main.iter_unread_emails")
+@patch("main.get_gmail_service")
+def test_main_backlog_warns_only_when_emails_are_left_unread(
+    mock_service, mock_iter, mock_summarise, mock_slack, mock_mark_read, unread, truncated, capsys
+):
+    mock_iter.side_effect = lambda *args, **kwargs: (
+        {"id": f"msg{i}", "threadId": f"t{i}"} for i in range(min(unread, kwargs["max_results"]))
+    )
+    mock_summarise.side_effect = lambda emails, **kwargs: f"{len(list(emails))} summarised"
+
+    from main import main
+
+    main()
+
+    mock_slack.assert_called_once_with("3 summarised")
+    assert len(mock_mark_read.call_args[0][1]) == 3
+    assert ("backlog ceiling reached" in capsys.readouterr().err) is truncated
+
+
+@patch("main.mark_as_read", return_value={})
+@patch("main.send_to_slack")
+@patch("main.summarise_emails", return_value="Daily summary")
+@patch("main.fetch_unread_emails")
+@patch("main.get_gmail_service")
+def test_main_writes_timing_report(
+    mock_service, mock_fetch, mock_summarise, mock_slack, mock_mark_read, tmp_path, monkeypatch
+):
+    import json
+
+    import metrics
+
+    mock_fetch.return_value = [
+        {"id": "msg1", "from": "a@b.com", "subject": "Hi", "date": "", "body": "Hey"}
+    ]
+    report_path = tmp_path / "report.json"
+    monkeypatch.setenv("TIMING_REPORT", str(report_path))
+    monkeypatch.setattr(metrics.registry, "enabled", False)
+
+    from main import main
+
+    main()
+
+    report = json.loads(report_path.read_text())
+    assert report["ok"] is True
+    assert report["emails"] == 1
+    assert set(report["timings"]) == {"fetch", "summarise", "slack", "mark_read", "total"}
+    assert {"counters", "stages"} <= set(report)
+    metrics.registry.reset()
+
+
+def test_preload_imports_modules_and_skips_missing_ones():
+    import sys
+
+    from main import preload
+
+    sys.modules.pop("colorsys", None)
+    preload(("no_such_module", "colorsys")).join(timeout=5)
+
+    assert "colorsys" in sys.modules
@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+from message_cache import MessageCache, open_message_cache
+
+
+def _email(msg_id, subject="Hi"):
+    return {"id": msg_id, "threadId": "t1", "subject": subject, "from": "a@b.com", "body": "Hey"}
+
+
+def test_get_many_returns_stored_emails_and_counts(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache.db"))
+    cache.put_many([_email("m1"), _email("m2")])
+
+    found = cache.get_many(["m1", "m2", "m3"])
+
+    assert found == {"m1": _email("m1"), "m2": _email("m2")}
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 2}
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    MessageCache(path).put_many([_email("m1", subject="Persisted")])
+
+    assert MessageCache(path).get_many(["m1"])["m1"]["subject"] == "Persisted"
+
+
+def test_evicts_oldest_entries_beyond_max_entries(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache.db"), max_entries=2)
+    with patch("message_cache.time.time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+        cache.put_many([_email("m1")])
+        cache.put_many([_email("m2")])
+        cache.put_many([_email("m3")])
+        assert set(cache.get_many(["m1", "m2", "m3"])) == {"m2", "m3"}
+
+    assert len(cache) == 2
+
+
+def test_ignores_and_evicts_expired_entries(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache.db"), max_age=60)
+    with patch("message_cache.time.time", return_value=1000.0):
+        cache.put_many([_email("old")])
+
+    with patch("message_cache.time.time", return_value=1100.0):
+        assert cache.get_many(["old"]) == {}
+        cache.put_many([_email("new")])
+
+    assert len(cache) == 1
+
+
+def test_open_message_cache_is_disabled_without_env():
+    with patch.dict("os.environ", {}, clear=True):
+        assert open_message_cache() is None
+
+
+def test_open_message_cache_uses_env_path(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with patch.dict("os.environ", {"GMAIL_MESSAGE_CACHE": path}):
+        assert isinstance(open_message_cache(), MessageCache)
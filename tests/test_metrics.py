@@ -0,0 +1,88 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+@pytest.fixture
+def enabled_metrics():
+    previous = metrics.registry.enabled
+    metrics.registry.enabled = True
+    metrics.registry.reset()
+    yield metrics.registry
+    metrics.registry.enabled = previous
+    metrics.registry.reset()
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry()
+
+    with registry.timer("gmail_list"):
+        pass
+    registry.inc("gmail_bytes_total", 10)
+    registry.observe("openai_stream", 1.0)
+
+    assert registry.timer("gmail_list") is metrics._NULL_TIMER
+    assert registry.report() == {"counters": {}, "stages": {}}
+    assert registry.prometheus() == "\n"
+
+
+def test_report_sums_counters_and_stage_timings():
+    registry = Registry(enabled=True)
+    registry.inc("cache_hits_total", 2, cache="message")
+    registry.inc("cache_hits_total", 3, cache="message")
+    registry.observe("gmail_list", 0.25)
+    registry.observe("gmail_list", 0.5)
+
+    assert registry.report() == {
+        "counters": {'cache_hits_total{cache="message"}': 5},
+        "stages": {"gmail_list": {"count": 2, "seconds": 0.75}},
+    }
+
+
+def test_prometheus_exposition_format():
+    registry = Registry(enabled=True)
+    registry.inc("openai_tokens_total", 120, kind="prompt")
+    registry.inc("slack_rate_limited_total")
+    registry.observe("slack_chat.postMessage", 0.03)
+    registry.observe("slack_chat.postMessage", 120.0)
+
+    lines = registry.prometheus().splitlines()
+
+    assert "# TYPE email_summariser_openai_tokens_total counter" in lines
+    assert 'email_summariser_openai_tokens_total{kind="prompt"} 120' in lines
+    assert "email_summariser_slack_rate_limited_total 1" in lines
+    assert "# TYPE email_summariser_stage_seconds histogram" in lines
+    stage = 'stage="slack_chat.postMessage"'
+    assert f'email_summariser_stage_seconds_bucket{{{stage},le="0.025"}} 0' in lines
+    assert f'email_summariser_stage_seconds_bucket{{{stage},le="0.05"}} 1' in lines
+    assert f'email_summariser_stage_seconds_bucket{{{stage},le="60"}} 1' in lines
+    assert f'email_summariser_stage_seconds_bucket{{{stage},le="+Inf"}} 2' in lines
+    assert f"email_summariser_stage_seconds_count{{{stage}}} 2" in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry(enabled=True)
+    registry.inc("errors_total", kind='bad "quote"\\')
+    assert 'email_summariser_errors_total{kind="bad \\"quote\\"\\\\"} 1' in registry.prometheus()
+
+
+def test_summariser_records_openai_timing_and_tokens(enabled_metrics, monkeypatch):
+    from summariser import summarise_emails
+
+    client = MagicMock()
+    response = client.chat.completions.create.return_value
+    response.choices[0].message.content = "Daily summary"
+    response.usage.prompt_tokens = 100
+    response.usage.completion_tokens = 20
+
+    summarise_emails(
+        [{"from": "a@b.com", "subject": "Hi", "date": "", "body": "Hey"}], client=client
+    )
+
+    report = enabled_metrics.report()
+    assert report["stages"]["openai_briefing"]["count"] == 1
+    assert report["counters"]['openai_tokens_total{kind="prompt"}'] == 100
+    assert report["counters"]['openai_tokens_total{kind="completion"}'] == 20
@@ -0,0 +1,98 @@
+from datetime import UTC, datetime
+from unittest.mock import patch
+
+import pytest
+
+import prompt_builder
+from prompt_builder import allocate, clean_body, count_tokens, fit_emails
+
+NOW = datetime(2025, 1, 2, 9, 0, tzinfo=UTC)
+
+
+@pytest.fixture
+def char_tokens():
+    # Deterministic counting whether or not tiktoken's vocabulary is available
+    with patch.object(prompt_builder, "_encoding", False):
+        yield
+
+
+def test_clean_body_drops_quoted_reply_chain():
+    body = (
+        "Sounds good, see you then.\n\n"
+        "On Mon, 1 Jan 2025 at 09:00, Alice <alice@example.com> wrote:\n"
+        "> Shall we meet at 3?\n"
+        "> Thanks"
+    )
+    assert clean_body(body) == "Sounds good, see you then."
+
+
+def test_clean_body_drops_inline_quotes_and_signature():
+    body = "> earlier point\nMy answer\n\n-- \nBob Smith\nCEO, Example"
+    assert clean_body(body) == "My answer"
+
+
+def test_clean_body_keeps_body_that_starts_with_a_reply_header():
+    body = "-----Original Message-----\nForwarded content"
+    assert clean_body(body) == body
+
+
+def test_clean_body_strips_tracking_params_and_long_redirects():
+    redirect = "https://click.mail.example.com/ls/click?upn=" + "a" * 200
+    body = (
+        "PR: https://github.com/org/repo/pull/1?notification_referrer_id=abc&tab=files\n"
+        f"Read more: {redirect}\n"
+        "Docs: https://example.com/docs?utm_source=mail&utm_medium=email"
+    )
+
+    assert clean_body(body) == (
+        "PR: https://github.com/org/repo/pull/1?tab=files\n"
+        "Read more: https://click.mail.example.com/...\n"
+        "Docs: https://example.com/docs"
+    )
+
+
+def test_allocate_gives_small_emails_what_they_need_and_splits_the_rest():
+    assert allocate([10, 1000, 1000], [1, 1, 1], 410) == [10, 200, 200]
+
+
+def test_allocate_follows_weights():
+    assert allocate([1000, 1000], [3, 1], 400) == [300, 100]
+
+
+def test_allocate_everything_fits():
+    assert allocate([5, 0, 7], [1, 1, 1], 100) == [5, 0, 7]
+
+
+def _email(body, sender="someone@example.com", date="Thu, 2 Jan 2025 08:00:00 +0000"):
+    return {"from": sender, "subject": "s", "date": date, "body": body}
+
+
+def test_fit_emails_respects_budget(char_tokens):
+    emails = [_email("x" * 40_000), _email("short note"), _email("y" * 8_000)]
+
+    fitted = fit_emails(emails, budget=1000, now=NOW)
+
+    assert sum(count_tokens(e["body"]) for e in fitted) <= 1000 + 2
+    assert fitted[1]["body"] == "short note"
+    assert fitted[0]["body"].endswith("...")
+
+
+def test_fit_emails_prefers_recent_and_important_senders(char_tokens):
+    emails = [
+        _email("a" * 8000, date="Mon, 30 Dec 2024 08:00:00 +0000"),
+        _email("b" * 8000),
+        _email("c" * 8000, sender="Boss <boss@example.com>"),
+        _email("d" * 8000, sender="notifications@github.com"),
+    ]
+
+    with patch.dict("os.environ", {"IMPORTANT_SENDERS": "boss@example.com"}):
+        sizes = [len(e["body"]) for e in fit_emails(emails, budget=1000, now=NOW)]
+
+    assert sizes[2] > sizes[1] > sizes[0]
+    assert sizes[1] > sizes[3]
+
+
+def test_fit_emails_does_not_mutate_input():
+    emails = [_email("hello\n> quoted")]
+    fit_emails(emails, now=NOW)
+    assert emails[0]["body"] == "hello\n> quoted"
@@ -0,0 +1,148 @@
+import json
+import random
+import time
+
+import numpy as np
+
+import ranking
+from ranking import Ranker, low_priority_note, rank_emails
+
+
+def _email(i, sender="Alice <alice@example.com>", subject="Lunch on Friday?", **fields):
+    return {
+        "id": f"msg{i}",
+        "threadId": f"thread{i}",
+        "from": sender,
+        "subject": subject,
+        "snippet": "",
+        **fields,
+    }
+
+
+def _newsletter(i):
+    return _email(
+        i, sender="Weekly <no-reply@news.example.com>", subject=f"Issue {i}: top deals", bulk=True
+    )
+
+
+def test_bulk_and_automated_mail_scores_below_personal_mail():
+    emails = [_email(0), _newsletter(1), _email(2, subject="Invoice due today", bulk=True)]
+
+    scores = Ranker().score(emails)
+
+    assert scores[1] < ranking.RANK_THRESHOLD < scores[0]
+    # An urgent subject lifts bulk mail above a plain newsletter
+    assert scores[2] > scores[1]
+
+
+def test_thread_length_and_important_senders_raise_scores(monkeypatch):
+    monkeypatch.setenv("IMPORTANT_SENDERS", "boss@example.com")
+    emails = [
+        _email(0, sender="carol@example.com"),
+        _email(1, sender="dave@example.com", threadId="t"),
+        _email(2, sender="dave@example.com", threadId="t"),
+        _email(3, sender="Boss <boss@example.com>"),
+    ]
+
+    scores = Ranker().score(emails)
+
+    assert scores[0] < scores[1] == scores[2] < scores[3]
+
+
+def test_nul_in_a_subject_does_not_split_the_email():
+    # What an RFC 2047 subject such as =?utf-8?q?Invoice_=00_due?= decodes to
+    emails = [_email(0, subject="Invoice \x00 due"), _email(1), _newsletter(2)]
+
+    scores = Ranker().score(emails)
+
+    assert len(scores) == 3
+    assert scores[0] > scores[2]
+
+
+def test_rank_emails_keeps_order_and_a_minimum_of_emails():
+    emails = [_newsletter(i) for i in range(8)] + [_email(8)]
+
+    kept, skipped = rank_emails(emails, Ranker(), min_keep=3)
+
+    assert len(kept) == 3
+    assert emails[8] in kept
+    assert kept == [e for e in emails if e in kept]
+    assert len(skipped) == 6
+
+
+def test_rank_emails_leaves_small_batches_alone():
+    emails = [_newsletter(i) for i in range(3)]
+
+    assert rank_emails(emails, Ranker(), min_keep=5) == (emails, [])
+
+
+def test_learn_raises_scores_of_what_the_reader_opens():
+    ranker = Ranker()
+    github = "GitHub <notifications@github.com>"
+    emails = [_email(i, sender=github, subject=f"[org/repo] PR #{i}", bulk=True) for i in range(10)]
+    emails += [_newsletter(i) for i in range(10, 20)]
+    before = ranker.score(emails)
+
+    for _ in range(3):
+        ranker.learn(emails, {e["id"] for e in emails[:10]})
+    after = ranker.score(emails)
+
+    assert after[:10].min() > before[:10].max()
+    assert after[:10].min() > ranking.RANK_THRESHOLD > after[10:].max()
+    assert ranker.senders["notifications@github.com"] == [30, 30]
+
+
+def test_state_round_trips_through_file(tmp_path):
+    path = tmp_path / "ranking.json"
+    ranker = Ranker(str(path))
+    emails = [_email(0), _newsletter(1)]
+    ranker.learn(emails, {"msg1"})
+    ranker.save()
+
+    loaded = Ranker(str(path))
+
+    assert np.allclose(loaded.score(emails), ranker.score(emails))
+    assert loaded.senders == ranker.senders
+
+
+def test_unreadable_state_falls_back_to_priors(tmp_path):
+    path = tmp_path / "ranking.json"
+    path.write_text("{not json")
+    emails = [_email(0), _newsletter(1)]
+
+    assert np.allclose(Ranker(str(path)).score(emails), Ranker().score(emails))
+
+    path.write_text(json.dumps({"features": ["other"], "weights": [1.0]}))
+    assert np.allclose(Ranker(str(path)).score(emails), Ranker().score(emails))
+
+
+def test_low_priority_note_counts_senders():
+    note = low_priority_note([_newsletter(1), _newsletter(2), _email(3, sender="x@y.com")])
+
+    assert "3 low-priority email(s)" in note
+    assert "no-reply@news.example.com (2), x@y.com (1)" in note
+    assert low_priority_note([]) == ""
+
+
+def test_scores_ten_thousand_emails_quickly():
+    rng = random.Random(0)
+    words = "meeting invoice update weekly digest sale deadline review build release".split()
+    emails = [
+        _email(
+            i,
+            sender=rng.choice(["alice@example.com", "news@example.org", "noreply@github.com"]),
+            subject=" ".join(rng.choices(words, k=6)) + f" #{i}",
+            snippet=" ".join(rng.choices(words, k=25)),
+            threadId=f"thread{rng.randrange(5000)}",
+            bulk=rng.random() < 0.5,
+        )
+        for i in range(10_000)
+    ]
+    ranker = Ranker()
+
+    start = time.perf_counter()
+    scores = ranker.score(emails)
+    elapsed = time.perf_counter() - start
+
+    assert scores.shape == (10_000,)
+    assert elapsed < 1.0
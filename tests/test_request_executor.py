@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from openai import AsyncOpenAI, BadRequestError, OpenAI
+
+import request_executor
+from benchmarks.fakes import FakeOpenAI
+from request_executor import CircuitBreaker, ModelUnavailable, RequestExecutor
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def _fake(**options):
+        servers.append(FakeOpenAI(**options))
+        return servers[-1]
+
+    yield _fake
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(request_executor, "RETRY_BASE_DELAY", 0.01)
+
+
+def _client(server) -> OpenAI:
+    return OpenAI(api_key="fake-key", base_url=server.url, max_retries=0)
+
+
+def _slow_first(seconds: float):
+    # The first request straggles; the rest answer at once
+    calls = itertools.count()
+    return lambda: seconds if next(calls) == 0 else 0.0
+
+
+def test_hedge_answers_before_a_straggler(fake):
+    server = fake(latency=_slow_first(3.0))
+    executor = RequestExecutor(hedge_delay=0.1, fallback_model=None)
+
+    start = time.monotonic()
+    response = executor.complete(_client(server), model="gpt-4.1-mini", messages=MESSAGES)
+
+    assert response.choices[0].message.content == "Nothing urgent today."
+    assert time.monotonic() - start < 2.0
+    assert server.requests == 2
+
+
+def test_adaptive_hedging_waits_for_enough_latencies():
+    executor = RequestExecutor(hedge_min_delay=0.0)
+    for _ in range(request_executor.HEDGE_MIN_SAMPLES - 1):
+        executor._record_latency("map", 0.5)
+    assert executor.hedge_after("map") is None
+
+    executor._record_latency("map", 2.0)
+
+    assert executor.hedge_after("map") == 0.5
+    assert executor.hedge_after("briefing") is None
+    assert RequestExecutor(hedge_delay=3.0).hedge_after("map") == 3.0
+
+
+def test_429_and_5xx_are_retried(fake):
+    statuses = iter([503, 429])
+    server = fake(fail=lambda request: next(statuses, None))
+    executor = RequestExecutor(retries=2, fallback_model=None)
+
+    executor.complete(_client(server), model="gpt-4.1-mini", messages=MESSAGES)
+
+    assert server.requests == 3
+
+
+def test_client_errors_are_raised_without_retrying(fake):
+    server = fake(fail=lambda request: 400)
+    executor = RequestExecutor(retries=2)
+
+    with pytest.raises(BadRequestError):
+        executor.complete(_client(server), model="gpt-4.1-mini", messages=MESSAGES)
+
+    assert server.requests == 1
+    assert executor.breaker("gpt-4.1-mini").state == "closed"
+
+
+def test_deadline_bounds_a_call_that_never_answers(fake):
+    server = fake(latency=5.0)
+    executor = RequestExecutor(deadline=0.3, fallback_model=None)
+
+    start = time.monotonic()
+    with pytest.raises(ModelUnavailable):
+        executor.complete(_client(server), model="gpt-4.1-mini", messages=MESSAGES)
+
+    assert time.monotonic() - start < 2.0
+
+
+def test_open_breaker_sends_calls_to_the_fallback_model(fake):
+    server = fake(fail=lambda request: 500 if request["model"] == "gpt-4.1-mini" else None)
+    executor = RequestExecutor(retries=0, fallback_model="gpt-4.1-nano", breaker_threshold=2)
+
+    for _ in range(3):
+        response = executor.complete(_client(server), model="gpt-4.1-mini", messages=MESSAGES)
+        assert response.model == "gpt-4.1-nano"
+
+    # The third call skipped the model whose breaker had opened
+    assert server.models == {"gpt-4.1-mini": 2, "gpt-4.1-nano": 3}
+    assert executor.breaker("gpt-4.1-mini").state == "open"
+
+
+def test_breaker_lets_one_trial_through_after_its_cooldown():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=2, cooldown=10, clock=lambda: now[0])
+    assert not breaker.failure()
+    assert breaker.failure()
+    assert not breaker.allow()
+
+    now[0] = 10
+    assert breaker.state == "half_open"
+    assert breaker.allow() == "half_open"
+    assert not breaker.allow()
+    # A failed trial reopens it for another cooldown
+    assert breaker.failure()
+    assert breaker.state == "open"
+
+    now[0] = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_cancelled_trial_leaves_the_breaker_half_open():
+    now = [0.0]
+    executor = RequestExecutor(fallback_model=None)
+    breaker = executor._breakers["gpt-4.1-mini"] = CircuitBreaker(
+        threshold=1, cooldown=10, clock=lambda: now[0]
+    )
+    breaker.failure()
+    now[0] = 10
+    hang = asyncio.Event()
+    answered = MagicMock()
+
+    async def _create(**request):
+        if not hang.is_set():
+            await asyncio.Event().wait()
+        return answered
+
+    client = MagicMock()
+    client.chat.completions.create = _create
+
+    async def _cancel_trial_then_retry():
+        trial = asyncio.ensure_future(
+            executor.acomplete(client, model="gpt-4.1-mini", messages=MESSAGES)
+        )
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert breaker.state == "half_open"
+        hang.set()
+        return await executor.acomplete(client, model="gpt-4.1-mini", messages=MESSAGES)
+
+    assert asyncio.run(_cancel_trial_then_retry()) is answered
+    assert breaker.state == "closed"
+
+
+def test_cancelled_call_does_not_release_a_trial_it_did_not_take():
+    now = [0.0]
+    executor = RequestExecutor(fallback_model=None)
+    breaker = executor._breakers["gpt-4.1-mini"] = CircuitBreaker(
+        threshold=1, cooldown=10, clock=lambda: now[0]
+    )
+
+    async def _create(**request):
+        await asyncio.Event().wait()
+
+    client = MagicMock()
+    client.chat.completions.create = _create
+
+    async def _cancel_after_another_call_takes_the_trial():
+        call = asyncio.ensure_future(
+            executor.acomplete(client, model="gpt-4.1-mini", messages=MESSAGES)
+        )
+        await asyncio.sleep(0.01)
+        # Other calls open the breaker and, after the cooldown, take its trial
+        breaker.failure()
+        now[0] = 10
+        assert breaker.allow() == "half_open"
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(_cancel_after_another_call_takes_the_trial())
+    assert not breaker.allow()
+
+
+def test_async_hedge_cancels_the_straggler(fake):
+    server = fake(latency=_slow_first(3.0))
+    executor = RequestExecutor(hedge_delay=0.1, fallback_model=None)
+
+    async def _complete():
+        client = AsyncOpenAI(api_key="fake-key", base_url=server.url, max_retries=0)
+        async with client:
+            return await executor.acomplete(client, model="gpt-4.1-mini", messages=MESSAGES)
+
+    start = time.monotonic()
+    response = asyncio.run(_complete())
+
+    assert response.choices[0].message.content == "Nothing urgent today."
+    assert time.monotonic() - start < 2.0
+    assert server.requests == 2
+
+
+def test_executor_is_configured_from_the_environment(monkeypatch):
+    monkeypatch.setattr(request_executor, "_executor", None)
+    monkeypatch.setenv("OPENAI_DEADLINE", "30")
+    monkeypatch.setenv("OPENAI_HEDGE_DELAY", "off")
+    monkeypatch.setenv("OPENAI_FALLBACK_MODEL", "")
+
+    executor = request_executor.get_executor()
+
+    assert executor.deadline == 30
+    assert executor.hedge_after("briefing") is None
+    assert executor.fallback_model is None
+    assert request_executor.get_executor() is executor
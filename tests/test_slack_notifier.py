@@ -1,9 +1,15 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 
+import httpx
 import pytest
 import requests
 
-from slack_notifier import send_to_slack
+import slack_notifier
+from slack_notifier import AsyncSlackClient, SlackClient, send_to_slack, split_message
 
 SLACK_TOKEN = "xoxc-test-token"
 SLACK_COOKIE = "xoxd-test-cookie"
@@ -24,7 +30,7 @@ def _mock_post_response():
 
 
 @patch.dict("os.environ", SLACK_ENV)
-@patch("slack_notifier.requests.post")
+@patch("requests.Session.post")
 def test_send_to_slack(mock_post):
     mock_post.side_effect = [_mock_auth_response(), _mock_post_response()]
 
@@ -40,7 +46,7 @@ def test_send_to_slack(mock_post):
 
 
 @patch.dict("os.environ", SLACK_ENV)
-@patch("slack_notifier.requests.post")
+@patch("requests.Session.post")
 def test_send_to_slack_raises_on_http_error(mock_post):
     mock_post.side_effect = requests.HTTPError("500 Server Error")
 
@@ -49,7 +55,7 @@ def test_send_to_slack_raises_on_http_error(mock_post):
 
 
 @patch.dict("os.environ", SLACK_ENV)
-@patch("slack_notifier.requests.post")
+@patch("requests.Session.post")
 def test_send_to_slack_raises_on_auth_failure(mock_post):
     resp = MagicMock(status_code=200)
     resp.json.return_value = {"ok": False, "error": "invalid_auth"}
@@ -60,7 +66,7 @@ def test_send_to_slack_raises_on_auth_failure(mock_post):
 
 
 @patch.dict("os.environ", SLACK_ENV)
-@patch("slack_notifier.requests.post")
+@patch("requests.Session.post")
 def test_send_to_slack_raises_on_post_failure(mock_post):
     mock_post.side_effect = [
         _mock_auth_response(),
@@ -72,3 +78,174 @@ def test_send_to_slack_raises_on_post_failure(mock_post):
 
     with pytest.raises(RuntimeError, match="postMessage failed"):
         send_to_slack("Hello Slack")
+
+
+@patch.dict("os.environ", SLACK_ENV)
+def test_async_slack_client_looks_up_user_id_once():
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        if request.url.path.endswith("auth.test"):
+            return httpx.Response(200, json={"ok": True, "user_id": USER_ID})
+        return httpx.Response(200, json={"ok": True})
+
+    async def _send_twice():
+        client = AsyncSlackClient(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        await client.send("first")
+        await client.send("second")
+        await client.aclose()
+
+    asyncio.run(_send_twice())
+
+    paths = [r.url.path for r in requests_seen]
+    assert paths == ["/api/auth.test", "/api/chat.postMessage", "/api/chat.postMessage"]
+    assert requests_seen[0].headers["Authorization"] == f"Bearer {SLACK_TOKEN}"
+    assert json.loads(requests_seen[2].content) == {"channel": USER_ID, "text": "second"}
+
+
+@patch.dict("os.environ", SLACK_ENV)
+def test_async_slack_client_raises_on_slack_error():
+    def handler(request):
+        if request.url.path.endswith("auth.test"):
+            return httpx.Response(200, json={"ok": True, "user_id": USER_ID})
+        return httpx.Response(200, json={"ok": False, "error": "channel_not_found"})
+
+    client = AsyncSlackClient(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    with pytest.raises(RuntimeError, match="postMessage failed: channel_not_found"):
+        asyncio.run(client.send("hello"))
+
+
+class FakeSlack:
+    """Local Slack Web API stand-in: records requests and replays scripted responses."""
+
+    def __init__(self):
+        self.requests = []
+        # method -> list of (status, headers, body) served before the default reply
+        self.scripted = {}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                fake.requests.append((method, dict(self.headers), body))
+                if fake.scripted.get(method):
+                    status, headers, reply = fake.scripted[method].pop(0)
+                elif method == "auth.test":
+                    status, headers, reply = 200, {}, {"ok": True, "user_id": USER_ID}
+                else:
+                    status, headers, reply = 200, {}, {"ok": True}
+                data = json.dumps(reply).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def methods(self):
+        return [method for method, _, _ in self.requests]
+
+    def texts(self):
+        return [body["text"] for method, _, body in self.requests if method == "chat.postMessage"]
+
+
+@pytest.fixture
+def fake_slack(monkeypatch):
+    fake = FakeSlack()
+    monkeypatch.setenv("SLACK_API_URL", fake.url)
+    for key, value in SLACK_ENV.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setattr(slack_notifier, "SLACK_RETRY_DELAY", 0.01)
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+def test_slack_client_looks_up_user_id_once(fake_slack):
+    client = SlackClient()
+    client.send("first")
+    client.send("second")
+
+    assert fake_slack.methods() == ["auth.test", "chat.postMessage", "chat.postMessage"]
+    assert fake_slack.texts() == ["first", "second"]
+    assert fake_slack.requests[0][1]["Authorization"] == f"Bearer {SLACK_TOKEN}"
+
+
+def test_slack_client_honours_retry_after(fake_slack, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(slack_notifier.time, "sleep", sleeps.append)
+    fake_slack.scripted["chat.postMessage"] = [
+        (429, {"Retry-After": "2"}, {"ok": False, "error": "ratelimited"}),
+        (429, {}, {"ok": False, "error": "ratelimited"}),
+    ]
+
+    SlackClient().send("hello")
+
+    assert fake_slack.texts() == ["hello", "hello", "hello"]
+    # Retry-After when given, exponential backoff otherwise
+    assert sleeps == [2.0, 0.02]
+
+
+def test_slack_client_gives_up_after_retries(fake_slack, monkeypatch):
+    monkeypatch.setattr(slack_notifier.time, "sleep", lambda s: None)
+    fake_slack.scripted["chat.postMessage"] = [
+        (429, {"Retry-After": "0"}, {"ok": False, "error": "ratelimited"})
+    ] * (slack_notifier.SLACK_RETRIES + 1)
+
+    with pytest.raises(requests.HTTPError):
+        SlackClient().send("hello")
+
+
+def test_long_summaries_are_posted_in_order(fake_slack, monkeypatch):
+    monkeypatch.setattr(slack_notifier, "SLACK_MESSAGE_LIMIT", 40)
+    sections = [f"*Section {i}*\n" + "detail " * 3 for i in range(4)]
+    summary = "\n\n".join(s.strip() for s in sections)
+
+    SlackClient().send(summary)
+
+    texts = fake_slack.texts()
+    assert len(texts) > 1
+    assert all(len(t) <= 40 for t in texts)
+    assert [t for t in texts if t.startswith("*Section")] == [
+        f"*Section {i}*\n" + ("detail " * 3).strip() for i in range(4)
+    ]
+
+
+def test_split_message_prefers_paragraph_then_line_then_word_breaks():
+    assert split_message("aaa\n\nbbb\nccc", limit=10) == ["aaa", "bbb\nccc"]
+    assert split_message("aaa bbb\nccc ddd", limit=10) == ["aaa bbb", "ccc ddd"]
+    assert split_message("aaa bbb ccc", limit=8) == ["aaa bbb", "ccc"]
+    assert split_message("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert split_message("short") == ["short"]
+
+
+def test_async_slack_client_against_fake_server(fake_slack):
+    async def _send():
+        client = AsyncSlackClient()
+        fake_slack.scripted["chat.postMessage"] = [
+            (429, {"Retry-After": "0"}, {"ok": False, "error": "ratelimited"})
+        ]
+        await client.send("first")
+        await client.send("second")
+        await client.aclose()
+
+    asyncio.run(_send())
+
+    assert fake_slack.methods() == [
+        "auth.test",
+        "chat.postMessage",
+        "chat.postMessage",
+        "chat.postMessage",
+    ]
+    assert fake_slack.texts() == ["first", "first", "second"]
@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks.bench_startup import import_profile
+
+# Importing main or api must not load these; they are imported on first use
+DEFERRED = ("openai", "googleapiclient", "google.oauth2", "numpy", "httpx", "requests")
+# Seconds; generous, so slow CI machines pass. Importing main took about a second
+# before its dependencies were deferred
+IMPORT_BUDGET = {"main": 0.5, "api": 1.0}
+
+
+@pytest.mark.parametrize("module", ["main", "api"])
+def test_import_defers_heavy_dependencies(module):
+    profile = import_profile(module)
+
+    loaded = [name for name in DEFERRED if name in profile["modules"]]
+    assert loaded == []
+    assert profile["seconds"] < IMPORT_BUDGET[module]
@@ -1,6 +1,23 @@
+import asyncio
+import json
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
-from summariser import summarise_emails
+import request_executor
+from benchmarks.fakes import FakeOpenAI
+from prompts import DIGEST_SYSTEM, MAP_SYSTEM, SUMMARISE_SYSTEM
+from ranking import Ranker
+from request_executor import RequestExecutor
+from summariser import (
+    EXTRACTIVE_HEADER,
+    astream_summary,
+    asummarise_emails,
+    extractive_summary,
+    summarise_backlog,
+    summarise_emails,
+)
+from summary_cache import InMemorySummaryCache
 
 SAMPLE_EMAILS = [
     {
@@ -19,7 +36,7 @@ SAMPLE_EMAILS = [
 
 
 @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-@patch("summariser.OpenAI")
+@patch("openai.OpenAI")
 def test_summarise_emails(mock_openai_cls):
     mock_client = MagicMock()
     mock_openai_cls.return_value = mock_client
@@ -39,7 +56,7 @@ def test_summarise_emails(mock_openai_cls):
 
 
 @patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
-@patch("summariser.OpenAI")
+@patch("openai.OpenAI")
 def test_summarise_emails_formats_input(mock_openai_cls):
     mock_client = MagicMock()
     mock_openai_cls.return_value = mock_client
@@ -56,3 +73,447 @@ def test_summarise_emails_formats_input(mock_openai_cls):
     assert "--- Email 2 ---" in user_content
     assert "From: alice@example.com" in user_content
     assert "Subject: Invoice" in user_content
+
+
+def _thread_emails():
+    return [
+        {
+            "threadId": "t1",
+            "from": "Bob <bob@example.com>",
+            "subject": "Re: Launch",
+            "date": "",
+            "body": "Moving launch to Friday.",
+        },
+        {
+            "threadId": "t1",
+            "from": "Alice <alice@example.com>",
+            "subject": "Launch",
+            "date": "",
+            "body": "Launch is on Thursday.",
+        },
+    ]
+
+
+def test_summarise_emails_collapses_threads():
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content="ok"))
+    ]
+
+    summarise_emails(_thread_emails(), client=client)
+
+    user_content = client.chat.completions.create.call_args[1]["messages"][1]["content"]
+    assert "--- Email 2 ---" not in user_content
+    assert "[1 more similar email(s) collapsed into this one]" in user_content
+    assert "Launch is on Thursday." in user_content
+
+
+@patch.dict("os.environ", {"COLLAPSE_EMAILS": "0"})
+def test_summarise_emails_collapse_can_be_turned_off():
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content="ok"))
+    ]
+
+    summarise_emails(_thread_emails(), client=client)
+
+    user_content = client.chat.completions.create.call_args[1]["messages"][1]["content"]
+    assert "--- Email 2 ---" in user_content
+
+
+class StubOpenAI:
+    """Records chat.completions.create calls and answers from `reply(kwargs)`."""
+
+    def __init__(self, reply=None, delay=0.0):
+        self.calls = []
+        self.reply = reply or (lambda kwargs: f"reply {len(self.calls)}")
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self.chat = MagicMock()
+        self.chat.completions.create.side_effect = self._create
+
+    def _create(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return MagicMock(choices=[MagicMock(message=MagicMock(content=self.reply(kwargs)))])
+
+
+def _many_emails(count, body_chars=400):
+    return [
+        {
+            "from": f"sender{i}@example.com",
+            "subject": f"Subject {i}",
+            "date": "Mon, 1 Jan 2025 09:00:00 +0000",
+            "body": "x" * body_chars,
+        }
+        for i in range(count)
+    ]
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_map_reduce_for_large_inboxes(mock_openai_cls):
+    client = StubOpenAI(reply=lambda kwargs: "partial" if kwargs["max_tokens"] != 2048 else "final")
+    mock_openai_cls.return_value = client
+
+    result = summarise_emails(_many_emails(10), chunk_tokens=300)
+
+    assert result == "final"
+    map_calls = [c for c in client.calls if c["messages"][0]["content"] == MAP_SYSTEM]
+    reduce_calls = [c for c in client.calls if c["messages"][0]["content"] == SUMMARISE_SYSTEM]
+    assert len(map_calls) == 5
+    assert len(reduce_calls) == 1
+    assert all("--- Email" in c["messages"][1]["content"] for c in map_calls)
+    reduce_content = reduce_calls[0]["messages"][1]["content"]
+    assert "10 unread emails" in reduce_content
+    assert "--- Notes, batch 5 of 5 ---\npartial" in reduce_content
+    assert "--- Email" not in reduce_content
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_map_calls_run_concurrently(mock_openai_cls):
+    client = StubOpenAI(delay=0.05)
+    mock_openai_cls.return_value = client
+
+    summarise_emails(_many_emails(8), chunk_tokens=100, concurrency=3)
+
+    assert len(client.calls) == 9
+    assert client.max_active == 3
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_keeps_oversized_email_in_its_own_chunk(mock_openai_cls):
+    client = StubOpenAI()
+    mock_openai_cls.return_value = client
+
+    summarise_emails(_many_emails(2, body_chars=10_000), chunk_tokens=100)
+
+    assert len(client.calls) == 3
+
+
+def test_summarise_backlog_maps_each_window_then_reduces():
+    client = StubOpenAI(reply=lambda kwargs: "partial" if kwargs["max_tokens"] != 2048 else "final")
+
+    result = summarise_backlog(iter(_many_emails(10)), window=3, client=client)
+
+    assert result == "final"
+    map_calls = [c for c in client.calls if c["messages"][0]["content"] == MAP_SYSTEM]
+    reduce_calls = [c for c in client.calls if c["messages"][0]["content"] == SUMMARISE_SYSTEM]
+    assert len(map_calls) == 4
+    assert len(reduce_calls) == 1
+    assert "10 unread emails" in reduce_calls[0]["messages"][1]["content"]
+
+
+def test_summarise_backlog_limits_windows_in_flight():
+    client = StubOpenAI(delay=0.05)
+
+    summarise_backlog(iter(_many_emails(12)), window=2, concurrency=2, client=client)
+
+    assert len(client.calls) == 7
+    assert client.max_active == 2
+
+
+def test_summarise_backlog_single_window_is_one_call():
+    client = StubOpenAI()
+
+    summarise_backlog(iter(SAMPLE_EMAILS), client=client)
+
+    assert len(client.calls) == 1
+    assert client.calls[0]["messages"][0]["content"] == SUMMARISE_SYSTEM
+
+
+def test_summarise_backlog_empty_makes_no_call():
+    client = StubOpenAI()
+
+    assert summarise_backlog(iter([]), client=client) == ""
+    assert client.calls == []
+
+
+def _digest_reply(kwargs):
+    if kwargs["messages"][0]["content"] != DIGEST_SYSTEM:
+        return "briefing"
+    lines = kwargs["messages"][1]["content"].splitlines()
+    numbers = [int(line.split()[2]) for line in lines if line.startswith("--- Email")]
+    return json.dumps({"digests": [{"email": n, "digest": f"digest {n}"} for n in numbers]})
+
+
+def _digest_calls(client):
+    return [c for c in client.calls if c["messages"][0]["content"] == DIGEST_SYSTEM]
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_with_cache_only_digests_new_emails(mock_openai_cls):
+    client = StubOpenAI(reply=_digest_reply)
+    mock_openai_cls.return_value = client
+    cache = InMemorySummaryCache()
+    emails = _many_emails(3)
+
+    assert summarise_emails(emails, cache=cache) == "briefing"
+    assert len(_digest_calls(client)) == 1
+
+    client.calls.clear()
+    new_email = {**emails[0], "subject": "Brand new"}
+    summarise_emails([*emails, new_email], cache=cache)
+
+    [digest_call] = _digest_calls(client)
+    digest_content = digest_call["messages"][1]["content"]
+    assert "--- Email 4 ---" in digest_content
+    assert "--- Email 1 ---" not in digest_content
+    briefing_content = client.calls[-1]["messages"][1]["content"]
+    assert "Subject: Subject 0 | digest 1" in briefing_content
+    assert "Subject: Brand new | digest 4" in briefing_content
+    assert cache.stats()["hits"] == 3
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_fully_cached_makes_one_call(mock_openai_cls):
+    client = StubOpenAI(reply=_digest_reply)
+    mock_openai_cls.return_value = client
+    cache = InMemorySummaryCache()
+    summarise_emails(_many_emails(5), cache=cache)
+    client.calls.clear()
+
+    summarise_emails(_many_emails(5), cache=cache)
+
+    assert len(client.calls) == 1
+    assert client.calls[0]["messages"][0]["content"] == SUMMARISE_SYSTEM
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_malformed_digest_reply_is_not_cached(mock_openai_cls):
+    client = StubOpenAI(reply=lambda kwargs: "not json")
+    mock_openai_cls.return_value = client
+    cache = InMemorySummaryCache()
+
+    summarise_emails(_many_emails(2), cache=cache)
+
+    assert "(no digest available)" in client.calls[-1]["messages"][1]["content"]
+    assert len(cache) == 0
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "test-key"})
+@patch("openai.OpenAI")
+def test_summarise_emails_keeps_huge_email_from_crowding_out_others(mock_openai_cls):
+    client = StubOpenAI()
+    mock_openai_cls.return_value = client
+    emails = _many_emails(3, body_chars=200)
+    emails[0]["body"] = "z" * 100_000
+
+    summarise_emails(emails, input_budget=500)
+
+    content = client.calls[0]["messages"][1]["content"]
+    assert len(client.calls) == 1
+    assert content.count("x" * 200) == 2
+    assert len(content) < 5000
+
+
+def _stream_chunk(text=None, usage=None):
+    choices = [MagicMock(delta=MagicMock(content=text))] if text is not None else []
+    return MagicMock(choices=choices, usage=usage)
+
+
+class AsyncStubOpenAI:
+    """Async counterpart of StubOpenAI, tracking concurrent in-flight calls."""
+
+    def __init__(self, reply, delay=0.0, stream=None):
+        self.calls = []
+        self.reply = reply
+        self.delay = delay
+        self.stream = stream
+        self.active = 0
+        self.max_active = 0
+        self.chat = MagicMock()
+        self.chat.completions.create.side_effect = self._create
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            return self.stream
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return MagicMock(choices=[MagicMock(message=MagicMock(content=self.reply(kwargs)))])
+
+
+def test_asummarise_emails_runs_map_calls_concurrently():
+    client = AsyncStubOpenAI(
+        reply=lambda kwargs: "partial" if kwargs["max_tokens"] != 2048 else "final", delay=0.01
+    )
+
+    result = asyncio.run(
+        asummarise_emails(_many_emails(40), client, chunk_tokens=1000, concurrency=3)
+    )
+
+    assert result == "final"
+    map_calls = [c for c in client.calls if c["messages"][0]["content"] == MAP_SYSTEM]
+    assert len(map_calls) > 3
+    assert client.max_active == 3
+    assert client.calls[-1]["messages"][0]["content"] == SUMMARISE_SYSTEM
+
+
+def test_asummarise_emails_uses_digest_cache():
+    def reply(kwargs):
+        if kwargs["messages"][0]["content"] == DIGEST_SYSTEM:
+            return json.dumps({"digests": [{"email": 1, "digest": "Meet at 3"}]})
+        return "briefing"
+
+    cache = InMemorySummaryCache()
+    client = AsyncStubOpenAI(reply=reply)
+
+    asyncio.run(asummarise_emails(SAMPLE_EMAILS[:1], client, cache=cache))
+    asyncio.run(asummarise_emails(SAMPLE_EMAILS[:1], client, cache=cache))
+
+    digest_calls = [c for c in client.calls if c["messages"][0]["content"] == DIGEST_SYSTEM]
+    assert len(digest_calls) == 1
+    assert "Meet at 3" in client.calls[-1]["messages"][1]["content"]
+
+
+class AsyncFakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def test_astream_summary_yields_deltas_then_usage():
+    usage = MagicMock(prompt_tokens=10, completion_tokens=3, total_tokens=13)
+    stream = AsyncFakeStream(
+        [_stream_chunk("Daily "), _stream_chunk("summary"), _stream_chunk(usage=usage)]
+    )
+    client = AsyncStubOpenAI(reply=None, stream=stream)
+
+    async def _events():
+        return [event async for event in astream_summary(SAMPLE_EMAILS, client)]
+
+    assert asyncio.run(_events()) == [
+        {"type": "delta", "text": "Daily "},
+        {"type": "delta", "text": "summary"},
+        {
+            "type": "done",
+            "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+        },
+    ]
+    assert client.calls[0]["stream"] is True
+    assert client.calls[0]["stream_options"] == {"include_usage": True}
+    assert stream.closed
+
+
+def test_astream_summary_closes_upstream_when_closed_early():
+    stream = AsyncFakeStream([_stream_chunk("a"), _stream_chunk("b")])
+    client = AsyncStubOpenAI(reply=None, stream=stream)
+
+    async def _first_event():
+        events = astream_summary(SAMPLE_EMAILS, client)
+        first = await anext(events)
+        await events.aclose()
+        return first
+
+    assert asyncio.run(_first_event()) == {"type": "delta", "text": "a"}
+    assert stream.closed
+
+
+def _ranked_emails():
+    newsletters = [
+        {
+            "id": f"news{i}",
+            "from": "Weekly <no-reply@news.example.com>",
+            "subject": f"Issue {i}: top deals",
+            "date": "",
+            "body": "Deals of the week.",
+            "bulk": True,
+        }
+        for i in range(8)
+    ]
+    personal = {
+        "id": "alice",
+        "from": "alice@example.com",
+        "subject": "Lunch on Friday?",
+        "date": "",
+        "body": "Are you free?",
+    }
+    return [*newsletters, personal]
+
+
+@patch.dict("os.environ", {"RANK_EMAILS": "1", "COLLAPSE_EMAILS": "0"})
+@patch("ranking.get_ranker")
+def test_summarise_emails_counts_low_priority_emails_when_ranking(mock_get_ranker):
+    mock_get_ranker.return_value = Ranker()
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content="ok"))
+    ]
+
+    summarise_emails(_ranked_emails(), client=client)
+
+    user_content = client.chat.completions.create.call_args[1]["messages"][1]["content"]
+    assert "Lunch on Friday?" in user_content
+    assert user_content.count("--- Email") == 5
+    assert "Not included above: 4 low-priority email(s)" in user_content
+    assert "no-reply@news.example.com (4)" in user_content
+
+
+@patch.dict("os.environ", {"RANK_EMAILS": "0", "COLLAPSE_EMAILS": "0"})
+def test_summarise_emails_summarises_everything_without_ranking():
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [
+        MagicMock(message=MagicMock(content="ok"))
+    ]
+
+    summarise_emails(_ranked_emails(), client=client)
+
+    user_content = client.chat.completions.create.call_args[1]["messages"][1]["content"]
+    assert user_content.count("--- Email") == 9
+    assert "Not included above" not in user_content
+
+
+@patch.dict("os.environ", {"COLLAPSE_EMAILS": "0"})
+def test_summarise_emails_lists_emails_when_no_model_answers(monkeypatch):
+    from openai import OpenAI
+
+    server = FakeOpenAI(fail=lambda request: 503)
+    monkeypatch.setattr(
+        request_executor, "_executor", RequestExecutor(retries=1, fallback_model="gpt-4.1-nano")
+    )
+    monkeypatch.setattr(request_executor, "RETRY_BASE_DELAY", 0.01)
+    try:
+        client = OpenAI(api_key="fake-key", base_url=server.url, max_retries=0)
+        result = summarise_emails(SAMPLE_EMAILS, client=client)
+    finally:
+        server.close()
+
+    assert server.models == {"gpt-4.1-mini": 2, "gpt-4.1-nano": 1}
+    assert result == (
+        EXTRACTIVE_HEADER + "- *alice@example.com*: Meeting — Let's meet at 3pm\n"
+        "- *bob@example.com*: Invoice — Please find attached"
+    )
+
+
+def test_extractive_summary_reads_digest_lines():
+    content = (
+        "Today's date: Jan 01, 2025\n\n"
+        "- Email 1 | From: alice@example.com | Subject: Meeting | Meet at 3pm.\n"
+        "- Email 2 | From: bob@example.com | Subject: Invoice | (no digest available)\n"
+    )
+
+    assert extractive_summary(content, max_items=1) == (
+        EXTRACTIVE_HEADER + "- *alice@example.com*: Meeting — Meet at 3pm.\n- …and 1 more"
+    )
@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+import pytest
+
+from summary_cache import (
+    InMemorySummaryCache,
+    SQLiteSummaryCache,
+    digest_key,
+    open_summary_cache,
+)
+
+EMAIL = {"from": "a@b.com", "subject": "Hi", "date": "Mon", "body": "Hey"}
+
+
+def test_digest_key_changes_with_content_model_and_prompt_version():
+    key = digest_key(EMAIL, "gpt-4.1-mini", 1)
+
+    assert digest_key(dict(EMAIL), "gpt-4.1-mini", 1) == key
+    assert digest_key({**EMAIL, "body": "Hey!"}, "gpt-4.1-mini", 1) != key
+    assert digest_key(EMAIL, "gpt-4.1", 1) != key
+    assert digest_key(EMAIL, "gpt-4.1-mini", 2) != key
+
+
+def test_digest_key_ignores_fields_outside_the_content():
+    assert digest_key({**EMAIL, "id": "m1"}, "m", 1) == digest_key({**EMAIL, "id": "m2"}, "m", 1)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def _make(**kwargs):
+        if request.param == "memory":
+            return InMemorySummaryCache(**kwargs)
+        return SQLiteSummaryCache(str(tmp_path / "digests.db"), **kwargs)
+
+    return _make
+
+
+def test_get_many_counts_hits_and_misses(make_cache):
+    cache = make_cache()
+    cache.put_many({"k1": "digest one"})
+
+    assert cache.get_many(["k1", "k2"]) == {"k1": "digest one"}
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_evicts_least_recently_used(make_cache):
+    cache = make_cache(max_entries=2)
+    with patch("summary_cache.time.time", side_effect=[1.0, 2.0, 3.0, 4.0, 5.0]):
+        cache.put_many({"k1": "one"})
+        cache.put_many({"k2": "two"})
+        cache.get_many(["k1"])
+        cache.put_many({"k3": "three"})
+        assert set(cache.get_many(["k1", "k2", "k3"])) == {"k1", "k3"}
+
+
+def test_entries_expire_after_ttl(make_cache):
+    cache = make_cache(ttl=60)
+    with patch("summary_cache.time.time", return_value=1000.0):
+        cache.put_many({"k1": "one"})
+    with patch("summary_cache.time.time", return_value=1061.0):
+        assert cache.get_many(["k1"]) == {}
+
+
+def test_sqlite_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "digests.db")
+    SQLiteSummaryCache(path).put_many({"k1": "one"})
+
+    assert SQLiteSummaryCache(path).get_many(["k1"]) == {"k1": "one"}
+
+
+def test_open_summary_cache_from_env(tmp_path):
+    with patch.dict("os.environ", {}, clear=True):
+        assert open_summary_cache() is None
+    with patch.dict("os.environ", {"SUMMARY_CACHE": "memory"}):
+        assert isinstance(open_summary_cache(), InMemorySummaryCache)
+    with patch.dict("os.environ", {"SUMMARY_CACHE": str(tmp_path / "d.db")}):
+        assert isinstance(open_summary_cache(), SQLiteSummaryCache)
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from jobs import JobQueue, Pipeline, run_job
+
+JOB_WORKERS = 2
+# Seconds an idle worker waits before polling the queue again
+POLL_INTERVAL = 2.0
+
+
+def work(path: str, stop=None, poll_interval: float = POLL_INTERVAL) -> None:
+    """Run jobs from the queue at `path` until `stop` is set."""
+    queue = JobQueue(path)
+    pipeline = None
+    try:
+        while stop is None or not stop.is_set():
+            job = queue.claim()
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            try:
+                # Created on first use, so an idle worker needs no credentials
+                pipeline = pipeline or Pipeline()
+                queue.succeed(job["id"], run_job(queue, job, pipeline))
+            except Exception as e:
+                print(f"Job {job['id']} failed: {type(e).__name__}", file=sys.stderr)
+                queue.fail(job["id"], f"{type(e).__name__}: {e}")
+    finally:
+        queue.close()
+
+
+def main():
+    path = os.environ.get("JOB_QUEUE")
+    if not path:
+        print("Error: set JOB_QUEUE to the job queue's SQLite file", file=sys.stderr)
+        sys.exit(1)
+    count = int(os.environ.get("JOB_WORKERS", JOB_WORKERS))
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=work, args=(path, stop)) for _ in range(count)]
+    for process in workers:
+        process.start()
+    print(f"Started {count} worker(s) on {path}.")
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in workers:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()